@@ -0,0 +1,271 @@
+import os
+import threading
+import numpy as np
+from gallery import DESCRIPTOR_SIZE, as_descriptor_matrix, pairwise_distances
+
+# Number of inverted lists probed per query; higher means better recall but slower search
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+
+# Lloyd iterations used when (re)training the coarse quantizer
+ANN_KMEANS_ITERS = int(os.environ.get('ANN_KMEANS_ITERS', 15))
+
+# Retrain once the index has grown this many times past the size it was trained on
+ANN_RETRAIN_GROWTH = 4
+
+# Below this many descriptors an exhaustive scan is as fast as probing lists
+ANN_MIN_TRAIN_SIZE = 256
+
+# Product quantization: descriptors are split into this many sub-vectors, each stored as a one-byte code
+PQ_SUBSPACES = int(os.environ.get('PQ_SUBSPACES', 32))
+
+# Centroids per sub-vector codebook (at most 256 so a code fits in one byte)
+PQ_CENTROIDS = 256
+
+
+def default_list_count(n):
+    """Roughly sqrt(n) inverted lists, the usual IVF rule of thumb."""
+    return max(1, int(np.sqrt(max(n, 1))))
+
+
+def kmeans(data, k, iters=ANN_KMEANS_ITERS, seed=0):
+    """Plain NumPy k-means with k-means++ seeding. Returns the centroid matrix."""
+    rng = np.random.default_rng(seed)
+    n = len(data)
+    k = min(k, n)
+    # Seed from a sample so training stays cheap on very large galleries
+    sample = data if n <= 64 * k else data[rng.choice(n, 64 * k, replace=False)]
+
+    centroids = np.empty((k, data.shape[1]), dtype=np.float32)
+    centroids[0] = sample[rng.integers(len(sample))]
+    closest = pairwise_distances(sample, centroids[:1])[:, 0] ** 2
+    for i in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(len(sample), p=closest / total) if total > 0 else rng.integers(len(sample))
+        centroids[i] = sample[pick]
+        closest = np.minimum(closest, pairwise_distances(sample, centroids[i:i + 1])[:, 0] ** 2)
+
+    for _ in range(iters):
+        labels = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def assign(data, centroids, chunk=8192):
+    """Index of the nearest centroid for every row of data."""
+    labels = np.empty(len(data), dtype=np.int32)
+    sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    for start in range(0, len(data), chunk):
+        labels[start:start + chunk] = pairwise_distances(data[start:start + chunk], centroids, sq_norms).argmin(axis=1)
+    return labels
+
+
+class ProductQuantizer:
+    """Product quantization codec for the gallery's descriptor matrix.
+
+    Each 128-d descriptor is split into PQ_SUBSPACES sub-vectors and every
+    sub-vector is replaced by the index of its nearest centroid in that
+    subspace's codebook, so a descriptor takes PQ_SUBSPACES bytes instead of
+    512. Distances are computed asymmetrically: the query stays exact and is
+    compared against the codebook once, then every stored row costs
+    PQ_SUBSPACES table lookups.
+    """
+
+    def __init__(self, subspaces=PQ_SUBSPACES, centroids=PQ_CENTROIDS):
+        if DESCRIPTOR_SIZE % subspaces:
+            raise ValueError(f"PQ_SUBSPACES must divide {DESCRIPTOR_SIZE}")
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.width = DESCRIPTOR_SIZE // subspaces
+        self.codebooks = None
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _split(self, matrix):
+        return [np.ascontiguousarray(matrix[:, m * self.width:(m + 1) * self.width]) for m in range(self.subspaces)]
+
+    def fit(self, matrix):
+        """Train one k-means codebook per subspace."""
+        matrix = as_descriptor_matrix(matrix)
+        codebooks = np.zeros((self.subspaces, self.centroids, self.width), dtype=np.float32)
+        for m, sub in enumerate(self._split(matrix)):
+            trained = kmeans(sub, self.centroids)
+            codebooks[m, :len(trained)] = trained
+            codebooks[m, len(trained):] = np.inf  # Unused slots when trained on fewer rows than centroids
+        self.codebooks = codebooks
+        return self
+
+    def encode(self, matrix):
+        matrix = as_descriptor_matrix(matrix)
+        codes = np.empty((len(matrix), self.subspaces), dtype=np.uint8)
+        if len(matrix) == 0:
+            return codes
+        for m, sub in enumerate(self._split(matrix)):
+            usable = np.isfinite(self.codebooks[m, :, 0])
+            codes[:, m] = assign(sub, self.codebooks[m][usable])
+        return codes
+
+    def decode(self, codes):
+        """Approximate float32 descriptors reconstructed from their codes."""
+        if len(codes) == 0:
+            return as_descriptor_matrix([])
+        return np.ascontiguousarray(np.concatenate(
+            [self.codebooks[m][codes[:, m]] for m in range(self.subspaces)], axis=1), dtype=np.float32)
+
+    def sq_norms(self, codes):
+        # Asymmetric distances do not use row norms; a zero-stride view keeps the snapshot layout uniform
+        return np.broadcast_to(np.float32(0), (len(codes),))
+
+    def distances(self, queries, codes, sq_norms=None):
+        """Approximate distances between exact queries and quantized rows."""
+        queries = as_descriptor_matrix(queries)
+        sq = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for m, sub in enumerate(self._split(queries)):
+            diff = sub[:, None, :] - self.codebooks[m][None, :, :]
+            table = np.einsum('qkd,qkd->qk', diff, diff)  # Squared distance to every centroid of the subspace
+            sq += table[:, codes[:, m]]
+        return np.sqrt(sq, out=sq)
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest neighbour index over face descriptors.
+
+    Descriptors are bucketed by their nearest k-means centroid. A query only
+    scans the `nprobe` buckets whose centroids are closest to it, trading a
+    little recall for a large cut in distance computations. Rows are labelled
+    with the owning student's USN.
+    """
+
+    def __init__(self, nprobe=ANN_NPROBE):
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self.centroids = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        self.vectors = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        self.labels = np.empty(0, dtype='U32')
+        self.lists = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self.generation = None  # Gallery generation the index was brought up to date with, if any
+        self.version = None  # Student store version it holds, for a single-process server's private gallery
+        self._order = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, labels, n_lists=None, nprobe=ANN_NPROBE):
+        """Train a fresh index on the given descriptors."""
+        index = cls(nprobe=nprobe)
+        index._train(as_descriptor_matrix(vectors), np.asarray(labels, dtype='U32'), n_lists)
+        return index
+
+    def _train(self, vectors, labels, n_lists=None):
+        with self._lock:
+            if len(vectors) >= ANN_MIN_TRAIN_SIZE:
+                self.centroids = kmeans(vectors, n_lists or default_list_count(len(vectors)))
+            else:
+                self.centroids = vectors.mean(axis=0, keepdims=True) if len(vectors) else self.centroids
+            self.vectors = vectors
+            self.labels = labels
+            self.lists = assign(vectors, self.centroids) if len(vectors) else np.empty(0, dtype=np.int32)
+            self.trained_size = len(vectors)
+            self._order = None
+
+    def update(self, usn, encodings):
+        """Replace the descriptors of one student without retraining the quantizer."""
+        self.update_many({usn: encodings})
+
+    def update_many(self, students):
+        """Replace the descriptors of many students ({usn: encodings}) in one pass."""
+        matrices = {usn: as_descriptor_matrix(encodings) for usn, encodings in students.items()}
+        new_vectors = np.concatenate(list(matrices.values())) if matrices else as_descriptor_matrix([])
+        new_labels = np.concatenate([np.full(len(m), usn, dtype='U32') for usn, m in matrices.items()] or
+                                    [np.empty(0, dtype='U32')])
+        with self._lock:
+            keep = ~np.isin(self.labels, list(matrices))
+            vectors = np.concatenate([self.vectors[keep], new_vectors])
+            labels = np.concatenate([self.labels[keep], new_labels])
+            if len(self.centroids) == 0 or len(vectors) > ANN_RETRAIN_GROWTH * max(self.trained_size, ANN_MIN_TRAIN_SIZE):
+                self._train(vectors, labels)
+                return
+            self.lists = np.concatenate([self.lists[keep], assign(new_vectors, self.centroids)])
+            self.vectors = vectors
+            self.labels = labels
+            self._order = None
+
+    def _inverted_lists(self):
+        """Descriptors regrouped so every inverted list is one contiguous block."""
+        if self._order is None:
+            order = np.argsort(self.lists, kind='stable')
+            vectors = np.ascontiguousarray(self.vectors[order])
+            offsets = np.searchsorted(self.lists[order], np.arange(len(self.centroids) + 1))
+            self._order = (vectors, np.einsum('ij,ij->i', vectors, vectors), self.labels[order], offsets)
+        return self._order
+
+    def search(self, queries, nprobe=None):
+        """Nearest indexed descriptor for every query. Returns (distances, labels).
+
+        Queries are grouped by the lists they probe, so each probed list is
+        scanned once with a batched distance computation.
+        """
+        queries = as_descriptor_matrix(queries)
+        distances = np.full(len(queries), np.inf, dtype=np.float32)
+        best_rows = np.full(len(queries), -1, dtype=np.int64)
+        with self._lock:
+            if len(self.vectors) == 0 or len(queries) == 0:
+                return distances, np.full(len(queries), '', dtype='U32')
+            vectors, sq_norms, labels, offsets = self._inverted_lists()
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            centroid_dists = pairwise_distances(queries, self.centroids)
+            probe = np.argpartition(centroid_dists, nprobe - 1, axis=1)[:, :nprobe]
+
+        for l in np.unique(probe):
+            start, end = offsets[l], offsets[l + 1]
+            if start == end:
+                continue
+            members = np.nonzero((probe == l).any(axis=1))[0]
+            dists = pairwise_distances(queries[members], vectors[start:end], sq_norms[start:end])
+            nearest = dists.argmin(axis=1)
+            values = dists[np.arange(len(members)), nearest]
+            closer = values < distances[members]
+            distances[members[closer]] = values[closer]
+            best_rows[members[closer]] = nearest[closer] + start
+
+        found = best_rows >= 0
+        result_labels = np.full(len(queries), '', dtype='U32')
+        result_labels[found] = labels[best_rows[found]]
+        return distances, result_labels
+
+    def save(self, path):
+        """Write the index next to the student data, replacing the old file atomically."""
+        with self._lock:
+            arrays = dict(centroids=self.centroids, vectors=self.vectors, labels=self.labels,
+                          lists=self.lists, trained_size=np.int64(self.trained_size),
+                          generation=np.int64(-1 if self.generation is None else self.generation),
+                          version=np.int64(-1 if self.version is None else self.version))
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=ANN_NPROBE):
+        """Load a saved index, or return None if there is none."""
+        if not os.path.exists(path):
+            return None
+        index = cls(nprobe=nprobe)
+        with np.load(path) as data:
+            index.centroids = data['centroids']
+            index.vectors = data['vectors']
+            index.labels = data['labels']
+            index.lists = data['lists']
+            index.trained_size = int(data['trained_size'])
+            generation = int(data['generation']) if 'generation' in data.files else -1
+            index.generation = None if generation < 0 else generation
+            version = int(data['version']) if 'version' in data.files else -1
+            index.version = None if version < 0 else version
+        return index
@@ -1,36 +1,63 @@
 import os
-import cv2
-import dlib
-import pickle
-import numpy as np
+import io
+import csv
+import time
+import threading
 from datetime import datetime
+from warmup import LazyResource, warm_up, readiness, rss_mb, uptime
 from werkzeug.security import check_password_hash, generate_password_hash
-from flask import Flask, request, render_template, redirect, url_for, session, send_file
+from flask import Flask, request, render_template, redirect, url_for, session, send_file, jsonify, g, Response
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.oauth2.service_account import Credentials
+from gallery import FaceGallery, MATCH_TOLERANCE, SHARED_GALLERY
+from ann_index import IVFIndex
+from student_store import StudentStore
+from face_pipeline import (process_images, format_timings, format_quality, load_models, get_embedding_cache,
+                           estimate_request_bytes)
+from memory_budget import MemoryBudget, BudgetExceeded
+from sheet_queue import SheetWriteQueue
+from sheet_registry import SheetRegistry
+from session_log import SessionLog
+from video_attendance import VideoSession, run_capture, VIDEO_SESSION_SECONDS
+from video_sessions import VideoSessionStore, parse_source, parse_window, VIDEO_SYNC_INTERVAL
+from job_queue import JobQueue, QueueFull
+from semester_analytics import SemesterAnalytics
+from bulk_enroll import RosterError, read_roster, open_batch, plan_batch, enroll_batch, estimate_batch_bytes
+from metrics import REGISTRY, STAGE_SECONDS, SamplingProfiler, ProfileStore, span, google_call
 
 # Initialize the Flask app
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
 
-# Path to save pickle files and photos
+# Path to the student store; encodings.pkl is the legacy format imported on first run
 STUDENT_DATA_PATH = 'student_data/'
 PICKLE_FILE = os.path.join(STUDENT_DATA_PATH, 'encodings.pkl')
+ANN_INDEX_FILE = os.path.join(STUDENT_DATA_PATH, 'ann_index.npz')
+GALLERY_DIR = os.path.join(STUDENT_DATA_PATH, 'gallery')
+
+# Use the approximate index for campus-wide matching (exams, guest lectures, mixed labs)
+USE_ANN_INDEX = os.environ.get('USE_ANN_INDEX', '0') == '1'
+
+# When to load the dlib models and Google API clients: 'background' warms them on a thread
+# after import, 'eager' loads them during import (gunicorn preload), 'lazy' on first use
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'background')
+
+# Allow logged-in users to sample-profile a single request with ?profile=1 (or an X-Profile: 1 header)
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '1') == '1'
+
+# Set by gunicorn.conf.py: the app is imported once in the master and forked into the workers,
+# so database connections and background threads are opened per worker in after_fork()
+PRELOAD_APP = os.environ.get('PRELOAD_APP', '0') == '1'
 
 # Ensure student data path exists
 if not os.path.exists(STUDENT_DATA_PATH):
     os.makedirs(STUDENT_DATA_PATH)
 
-# Ensure the pickle file exists
-if not os.path.exists(PICKLE_FILE):
-    with open(PICKLE_FILE, 'wb') as f:
-        pass  # Create an empty pickle file if it doesn't exist yet
-
-# Load face detection and face recognition models
-face_detector = dlib.get_frontal_face_detector()
-shape_predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
-face_recognizer = dlib.face_recognition_model_v1('dlib_face_recognition_resnet_model_v1.dat')
+# Open the student store and import the legacy pickle file on first run
+student_store = StudentStore(STUDENT_DATA_PATH)
+if os.path.exists(PICKLE_FILE):
+    print(f"Migrated {student_store.migrate_pickle(PICKLE_FILE)} students from {PICKLE_FILE}")
 
 # Initial credentials (username: 1AM22CI, password: CI@2024)
 credentials = {"1AM22CI": generate_password_hash("CI@2024")}
@@ -38,25 +65,241 @@ credentials = {"1AM22CI": generate_password_hash("CI@2024")}
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = 'credentials.json'  # Path to your service account file
-creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-sheets_service = build('sheets', 'v4', credentials=creds)
-drive_service = build('drive', 'v3', credentials=creds)
+creds = LazyResource('credentials', lambda: Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES))
+sheets_service = LazyResource('sheets', lambda: build('sheets', 'v4', credentials=creds.get(), cache_discovery=False))
+drive_service = LazyResource('drive', lambda: build('drive', 'v3', credentials=creds.get(), cache_discovery=False))
+
+# dlib models; the pipeline loads them itself on first use if warmup has not got there yet
+face_models = LazyResource('face_models', load_models)
+
+# Everything /ready waits for
+WARM_RESOURCES = [face_models, creds, sheets_service, drive_service]
+
+# Caps the memory that concurrent photo uploads may hold in this process; requests beyond it queue
+upload_budget = MemoryBudget()
+
+# Request metrics exposed on /metrics, alongside the stage and Google API histograms in metrics.py
+PHOTOS = REGISTRY.counter('attendance_photos_total', 'Uploaded photos by embedding cache outcome', labels=('route', 'cache'))
+FACES_DETECTED = REGISTRY.counter('attendance_faces_detected_total', 'Faces found in uploaded photos', labels=('route',))
+FACES_REJECTED = REGISTRY.counter('attendance_faces_rejected_total', 'Faces dropped by the quality gate before embedding',
+                                  labels=('route', 'reason'))
+QUALITY_SAVED_SECONDS = REGISTRY.counter('attendance_quality_saved_seconds_total',
+                                         'Estimated alignment and descriptor CPU seconds saved by the quality gate',
+                                         labels=('route',))
+FACES_MATCHED = REGISTRY.counter('attendance_faces_matched_total', 'Faces recognized as an enrolled student', labels=('scope',))
+FACES_UNKNOWN = REGISTRY.counter('attendance_faces_unknown_total', 'Faces that matched no enrolled student', labels=('scope',))
+STUDENTS_RECORDED = REGISTRY.counter('attendance_students_recorded_total', 'Students written to attendance sessions',
+                                     labels=('status',))
+REGISTRY.gauge('upload_budget_in_use_bytes', 'Upload memory currently reserved', lambda: upload_budget.stats()['in_use_bytes'])
+REGISTRY.gauge('upload_budget_waiting', 'Requests queued for upload memory', lambda: upload_budget.stats()['waiting'])
+REGISTRY.gauge('upload_budget_rejected', 'Requests turned away for lack of upload memory', lambda: upload_budget.stats()['rejected'])
+REGISTRY.gauge('embedding_cache_hits', 'Images answered from the embedding cache', lambda: get_embedding_cache().stats()['hits'])
+REGISTRY.gauge('embedding_cache_misses', 'Images that needed the dlib pipeline', lambda: get_embedding_cache().stats()['misses'])
+
+# Recent per-request and job profiles, listed on /metrics/profiles by whichever worker serves the request
+profiles = ProfileStore(os.path.join(STUDENT_DATA_PATH, 'profiles'))
+
+# Camera/video attendance sessions, visible to every server process
+video_sessions = VideoSessionStore(os.path.join(STUDENT_DATA_PATH, 'video_sessions.db'))
+
+# Seconds a stop request waits for the capturing process to record the session
+VIDEO_STOP_WAIT = 30
+
+# Registry of class spreadsheets; imports the old *_sheet_id.txt files on first run
+sheet_registry = SheetRegistry()
+
+# Cross-subject attendance over every attendance_*.txt log; rescans only logs changed since the last report
+semester_analytics = SemesterAnalytics('.')
 
 def load_all_students():
-    """Load all students from the pickle file."""
-    students = []
+    """Load all students from the student store."""
+    return student_store.all()
+
+# Keep every enrolled descriptor in memory so matching never touches the student store. The shared
+# gallery is mapped from files that all server processes use, and is only rebuilt from the store
+# when the published one is missing or older than the store
+private_version = None
+if SHARED_GALLERY:
+    gallery = FaceGallery.open_shared(GALLERY_DIR, load_all_students, version=student_store.version())
+else:
+    store_version = student_store.version()
+    gallery = FaceGallery(load_all_students())
+    # Student store version this process's gallery holds exactly; None once another process has written to the store
+    private_version = store_version if student_store.version() == store_version else None
+
+# Campus-wide ANN index, kept at the gallery's generation. The worker that changes the gallery updates the
+# index and saves it before any other change can be published; the other workers load the saved file.
+# A private gallery's index is saved and reloaded by student store version while only this process writes
+ann_index = None
+ann_index_lock = threading.Lock()
+
+def load_ann_index(generation):
+    """The saved ANN index if it was made for this gallery generation, else None."""
+    if not SHARED_GALLERY and private_version is None:
+        return None  # Other processes have changed the store, so the saved index may not match this gallery
+    index = IVFIndex.load(ANN_INDEX_FILE)
+    if index is None:
+        return None
+    if not SHARED_GALLERY:
+        if index.version != private_version:
+            return None
+        index.generation = generation
+    return index if index.generation == generation else None
+
+def save_ann_index(index):
+    """Save the index for other workers and restarts, unless the private gallery has fallen out of step."""
+    if SHARED_GALLERY:
+        index.save(ANN_INDEX_FILE)
+    elif private_version is not None:
+        index.version = private_version
+        index.save(ANN_INDEX_FILE)
+
+def rebuild_ann_index():
+    """Train and save an index over the gallery's rows; call with the gallery locked."""
+    index = IVFIndex.build(gallery.row_descriptors(), gallery.row_labels())
+    index.generation = gallery.generation
+    save_ann_index(index)
+    return index
+
+def current_ann_index():
+    """The ANN index for the gallery generation being served, reloaded or rebuilt after another worker's change."""
+    global ann_index
+    index, generation = ann_index, gallery.generation
+    if index is not None and index.generation == generation:
+        return index
+    index = load_ann_index(generation)
+    if index is None:
+        with gallery.locked():
+            index = load_ann_index(gallery.generation) or rebuild_ann_index()
+    with ann_index_lock:
+        if ann_index is None or ann_index.generation is None or ann_index.generation < index.generation:
+            ann_index = index
+    return index
+
+def update_ann_index(generation, students):
+    """Gallery listener: apply one change to the index and save it while the gallery is still locked."""
+    global ann_index, private_version
+    if private_version is not None:
+        # Every change to the private gallery follows one write to the store, unless another process wrote too
+        version = student_store.version()
+        private_version = version if version == private_version + 1 else None
     try:
-        with open(PICKLE_FILE, 'rb') as f:
-            while True:
-                try:
-                    student = pickle.load(f)
-                    students.append(student)
-                except EOFError:
-                    break
-    except FileNotFoundError:
-        pass
-    return students
+        with ann_index_lock:
+            index = ann_index
+            if index is None or index.generation != generation - 1:
+                index = load_ann_index(generation - 1)
+            if students is None or index is None:
+                index = rebuild_ann_index()
+            else:
+                index.update_many(students)
+                index.generation = generation
+                save_ann_index(index)
+            ann_index = index
+    except Exception as e:
+        print(f"ANN index update to gallery generation {generation} failed; it will be rebuilt on next use: {e}")
+
+if USE_ANN_INDEX:
+    gallery.on_change(update_ann_index)
+    current_ann_index()
+
+def assign_campus(face_encodings):
+    """Match faces against every enrolled student, through the ANN index when enabled.
+
+    Returns one (name, usn) per face, or None for an unknown face.
+    """
+    if not USE_ANN_INDEX:
+        return gallery.assign_all(face_encodings)
+    distances, usns = current_ann_index().search(face_encodings)
+    assignments = []
+    for distance, usn in zip(distances, usns):
+        student = gallery.lookup(usn) if distance < MATCH_TOLERANCE else None
+        assignments.append((student['name'], student['usn']) if student else None)
+    return assignments
+
+def match_campus(face_encodings):
+    """Set of (name, usn) recognized among the faces, campus-wide."""
+    return {student for student in assign_campus(face_encodings) if student}
+
+def observe_pipeline(route, result):
+    """Record the pipeline's stage timings and face counts for /metrics."""
+    for stage, seconds in result.timings.items():
+        STAGE_SECONDS.observe(seconds, route=route, stage='pipeline' if stage == 'total' else f'pipeline.{stage}')
+    photos = len(result.faces_per_image)
+    PHOTOS.inc(result.cache_hits, route=route, cache='hit')
+    PHOTOS.inc(photos - result.cache_hits, route=route, cache='miss')
+    FACES_DETECTED.inc(len(result.encodings), route=route)
+    if result.quality:
+        for reason, count in result.quality['reasons'].items():
+            FACES_REJECTED.inc(count, route=route, reason=reason)
+        QUALITY_SAVED_SECONDS.inc(result.quality['saved_seconds'], route=route)
+
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once models and API clients are loaded, 503 while warming up."""
+    is_ready, report = readiness(WARM_RESOURCES, require_loaded=MODEL_WARMUP != 'lazy')
+    report['upload_budget'] = upload_budget.stats()
+    report['attendance_jobs'] = attendance_jobs.depth()
+    report['enroll_jobs'] = enroll_jobs.depth()
+    report['sheet_queue'] = {'pending': sheet_queue.depth(), 'failed': len(sheet_queue.failed())}
+    return jsonify(report), 200 if is_ready else 503
+
+@app.errorhandler(BudgetExceeded)
+def upload_budget_exceeded(e):
+    """Turn away uploads that do not fit in the memory budget instead of risking the worker."""
+    if e.too_large:
+        return f"{e}. Please upload fewer or smaller photos.", 413
+    return str(e), 503, {'Retry-After': '10'}
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint for this worker's stage timings, counters and gauges."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_profile():
+    """Sample the stack of this request's thread when the caller asked for a profile."""
+    wanted = request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+    if REQUEST_PROFILING and wanted and 'user' in session:
+        g.profiler = SamplingProfiler().start()
 
+@app.after_request
+def finish_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        profile_id = profiles.add(f"{request.method} {request.path}", profiler)
+        response.headers['X-Profile-Id'] = profile_id
+        hottest = ', '.join(f"{name} {share:.0%}" for name, share in profiler.top(5))
+        print(f"Profile {profile_id} {request.method} {request.path} ({profiler.duration * 1000:.0f}ms): {hottest}")
+    return response
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    profiler = g.pop('profiler', None)  # Still set only if the request failed before after_request
+    if profiler is not None:
+        profiler.stop()
+
+@app.route('/metrics/profiles')
+def list_profiles():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    return jsonify(profiles.list())
+
+@app.route('/metrics/profiles/<profile_id>')
+def download_profile(profile_id):
+    """Collapsed stacks of one profiled request, ready for flamegraph.pl or speedscope."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    entry = profiles.get(profile_id)
+    if entry is None:
+        return "Unknown profile", 404
+    return Response(entry['folded'], mimetype='text/plain')
+
+@app.route('/embedding_cache')
+def embedding_cache_stats():
+    """Hit rate and size of this worker's embedding cache."""
+    return jsonify(get_embedding_cache().stats())
 
 @app.route('/', methods=['GET'])
 def index():
@@ -124,45 +367,31 @@ def enroll():
         usn = request.form['usn']
         semester = session.get('semester', 'Not Set')
         section = session.get('section', 'Not Set')
-        files = request.files.getlist('photos')
-        encodings = []
+        files = [file for file in request.files.getlist('photos') if file.filename]
         
-        # Process each photo and extract face encodings
-        for file in files:
-            img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = face_detector(gray)
-            
-            for face in faces:
-                shape = shape_predictor(gray, face)
-                face_encoding = np.array(face_recognizer.compute_face_descriptor(img, shape))
-                encodings.append(face_encoding)
+        # Stream the photos through the pipeline in parallel and extract face encodings
+        with upload_budget.reserve(estimate_request_bytes(files)):
+            result = process_images(files)
+        observe_pipeline('enroll', result)
+        print(f"Enroll {usn}: {len(files)} photos ({result.cache_hits} cached), {len(result.encodings)} faces, "
+              f"{format_quality(result.quality)} ({format_timings(result.timings)})")
+        encodings = result.encodings
         
         if encodings:
-            # Load existing students from pickle
-            existing_students = load_all_students()
-            student_exists = False
-            
-            # Check if student already exists in the pickle file
-            for student in existing_students:
-                if student['usn'] == usn:
-                    student['name'] = name  # Update the student's name
-                    student['encodings'] = encodings  # Update the face encodings
-                    student['semester'] = semester  # Update semester
-                    student['section'] = section  # Update section
-                    student_exists = True
-                    break
+            student = {"name": name, "usn": usn, "encodings": encodings, "semester": semester, "section": section}
             
-            # If student doesn't exist, add new entry
-            if not student_exists:
-                existing_students.append({"name": name, "usn": usn, "encodings": encodings, "semester": semester, "section": section})
+            # Add the student, or replace the existing entry with the same USN
+            with span('enroll', 'store_upsert'):
+                student_exists = student_store.upsert(student)
             
-            # Save all students back to pickle file
-            with open(PICKLE_FILE, 'wb') as f:
-                for student in existing_students:
-                    pickle.dump(student, f)
+            # Publish the new encodings to the in-memory gallery
+            with span('enroll', 'gallery_upsert'):
+                gallery.upsert(student, version=student_store.version())
             
             message = f"Student {'updated' if student_exists else 'enrolled'} successfully."
+        elif result.quality and result.quality['rejected']:
+            message = (f"No usable face in the images: {result.quality['rejected']} face(s) were too small, "
+                       "blurred or turned away. Please upload clear, front-facing photos.")
         else:
             message = "No face detected in the images."
         
@@ -171,6 +400,75 @@ def enroll():
     return render_template('enroll.html')
 
 
+@app.route('/bulk_enroll', methods=['POST'])
+def bulk_enroll():
+    """Enroll a batch of students from a zip of per-USN photo folders and a roster CSV.
+
+    The batch is checked right away and then queued as a durable job, since a
+    large one takes longer than a request may run. Responds 202 with the job's
+    status URL, whose result is the report of bulk_enroll.enroll_batch; pass
+    dry_run=1 to check a batch without saving it.
+    """
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if 'archive' not in request.files or 'roster' not in request.files:
+        return jsonify({'error': 'Upload the photo archive as "archive" and the roster CSV as "roster"'}), 400
+    archive, roster_file = request.files['archive'], request.files['roster']
+    dry_run = request.form.get('dry_run') == '1'
+
+    roster_text = io.TextIOWrapper(roster_file.stream, encoding='utf-8-sig', newline='')
+    try:
+        roster = read_roster(roster_text)
+        batch = open_batch(archive.stream)
+        planned = plan_batch(batch, roster)
+    except (RosterError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        roster_text.detach()  # Keep the upload open for spooling
+
+    # Refuse now what the worker could never fit in its memory budget
+    needed = estimate_batch_bytes(batch, [path for paths in planned[0].values() for path in paths])
+    if needed > upload_budget.limit:
+        raise BudgetExceeded(f"Batch needs {needed / 2**20:.0f} MB, budget is {upload_budget.limit / 2**20:.0f} MB",
+                             too_large=True)
+
+    archive.stream.seek(0)
+    roster_file.stream.seek(0)
+    with span('bulk_enroll', 'submit'):
+        job_id = enroll_jobs.submit({'dry_run': dry_run}, [archive, roster_file])
+    return jsonify({'job_id': job_id, 'status_url': url_for('enroll_job_status', job_id=job_id)}), 202
+
+
+@app.route('/enroll_jobs/<job_id>')
+def enroll_job_status(job_id):
+    """Poll a bulk enrollment job: queued, running, done (with the report) or error."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    status = enroll_jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+
+def run_bulk_enroll_job(params, paths):
+    """Job handler: enroll a spooled batch (the archive, then the roster) and return its report."""
+    archive_path, roster_path = paths
+    with open(roster_path, encoding='utf-8-sig', newline='') as f:
+        roster = read_roster(f)
+    batch = open_batch(archive_path)
+    planned = plan_batch(batch, roster)
+
+    # Photos stream through the pipeline a window at a time, so only that window is reserved
+    photos = [path for paths in planned[0].values() for path in paths]
+    with upload_budget.reserve(estimate_batch_bytes(batch, photos)):
+        students, report = enroll_batch(batch, roster, student_store, params['dry_run'], planned)
+
+    if students and not params['dry_run']:
+        with span('bulk_enroll', 'gallery_upsert'):
+            gallery.upsert_many(students, version=student_store.version())
+    return report
+
+
 @app.route('/take_attendance', methods=['GET', 'POST'])
 def take_attendance():
     if 'user' not in session:
@@ -180,94 +478,296 @@ def take_attendance():
         subject = session.get('subject', 'default')
         section = session.get('section', 'A')
         semester = session.get('semester', '1')  # Get semester from session
-        sheet_id = get_google_sheet_id(subject, section, semester)
-        
-        if not sheet_id:
-            sheet_id = create_google_sheet(subject, section, semester)
-        
-        # Modify file naming to include semester
-        attendance_file = f"attendance_{semester}_{subject}_{section}.txt"  # Include semester
         
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         if 'class_images' not in request.files:
             return "No files part", 400  # Handle missing files
         
-        files = request.files.getlist('class_images')
+        files = [file for file in request.files.getlist('class_images') if file.filename]
         
         if not files:
             return "No selected files", 400  # Handle no file selected
         
-        present_students = set()  # Use set to avoid duplicates
-        
-        # Process each file
-        for file in files:
-            img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = face_detector(gray)
-            
-            for face in faces:
-                shape = shape_predictor(gray, face)
-                face_encoding = np.array(face_recognizer.compute_face_descriptor(img, shape))
-                
-                # Compare this face with all enrolled students
-                with open(PICKLE_FILE, 'rb') as f:
-                    while True:
-                        try:
-                            student = pickle.load(f)
-                            
-                            # Only consider students from the current semester and section
-                            if student['semester'] == semester and student['section'] == section:
-                                matches = [np.linalg.norm(face_encoding - enc) < 0.6 for enc in student['encodings']]
-                                if any(matches):
-                                    present_students.add((student['name'], student['usn']))  # Add student to set
-                                    break
-                        except EOFError:
-                            break
-        
-        # Load all students to get the absent students
-        absent_students = [(student['name'], student['usn']) for student in load_all_students() if (student['name'], student['usn']) not in present_students and student['semester'] == semester and student['section'] == section]
-        
-        # Update attendance in Google Sheets
-        update_attendance_in_sheet(sheet_id, list(present_students), absent_students, timestamp)
+        # Open events match against the whole campus, regular classes only against their own section
+        scope = 'campus' if request.form.get('scope') == 'campus' else 'class'
         
-        # Save attendance in text file
-        with open(attendance_file, 'a') as report:
-            report.write(f"\n--- Attendance Session: {timestamp} ---\n")
-            report.write("Present Students:\n")
-            report.writelines(f"{name} ({usn})\n" for name, usn in present_students)
-            report.write("\nAbsent Students:\n")
-            report.writelines(f"{name} ({usn})\n" for name, usn in absent_students)
+        # Refuse now what the worker could never fit in its memory budget
+        needed = estimate_request_bytes(files)
+        if needed > upload_budget.limit:
+            raise BudgetExceeded(f"Request needs {needed / 2**20:.0f} MB, budget is {upload_budget.limit / 2**20:.0f} MB",
+                                 too_large=True)
         
-        return f"Attendance taken for {semester} {subject} ({section}). Report saved as {attendance_file}. View Sheet: https://docs.google.com/spreadsheets/d/{sheet_id}/edit?usp=sharing"
+        # Queue the photos as a durable job and answer right away; the page polls for the result.
+        # A profiled request only spools the photos, so the job is profiled too
+        params = {'semester': semester, 'subject': subject, 'section': section, 'scope': scope, 'timestamp': timestamp}
+        if g.get('profiler') is not None:
+            params['profile'] = True
+        with span('take_attendance', 'submit'):
+            job_id = attendance_jobs.submit(params, files)
+        return jsonify({'job_id': job_id, 'status_url': url_for('attendance_job_status', job_id=job_id)}), 202
     
     return render_template('take_attendance.html')
 
 
+@app.errorhandler(QueueFull)
+def attendance_queue_full(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+
+
+@app.route('/attendance_jobs/<job_id>')
+def attendance_job_status(job_id):
+    """Poll an attendance job: queued (with its position), running, done (with the result) or error."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    status = attendance_jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+
+def run_attendance_job(params, photo_paths):
+    """Job handler: recognize the faces in a submission's photos and record the session.
+
+    A submission made with ?profile=1 is sample-profiled here, where the work
+    happens; the result then names the profile and its hottest frames.
+    """
+    if not params.get('profile'):
+        return recognize_attendance(params, photo_paths)
+    profiler = SamplingProfiler().start()
+    try:
+        attendance = recognize_attendance(params, photo_paths)
+    finally:
+        profiler.stop()
+        label = f"attendance job {params['semester']} {params['subject']} ({params['section']})"
+        profile_id = profiles.add(label, profiler)
+        hottest = ', '.join(f"{name} {share:.0%}" for name, share in profiler.top(5))
+        print(f"Profile {profile_id} {label} ({profiler.duration * 1000:.0f}ms): {hottest}")
+    attendance['profile'] = {'id': profile_id, 'seconds': round(profiler.duration, 3),
+                             'top': [[name, round(share, 3)] for name, share in profiler.top(5)]}
+    return attendance
+
+
+def recognize_attendance(params, photo_paths):
+    semester, subject, section, scope = params['semester'], params['subject'], params['section'], params['scope']
+    files = [open(path, 'rb') for path in photo_paths]
+    try:
+        # Stream all files through the pipeline in parallel
+        with upload_budget.reserve(estimate_request_bytes(files)):
+            result = process_images(files)
+    finally:
+        for file in files:
+            file.close()
+    observe_pipeline('take_attendance', result)
+    print(f"Attendance {semester} {subject} ({section}): {len(files)} photos ({result.cache_hits} cached), "
+          f"{len(result.encodings)} faces, {format_quality(result.quality)} ({format_timings(result.timings)})")
+    face_encodings = result.encodings
+    
+    with span('take_attendance', 'match'):
+        if scope == 'campus':
+            assignments = assign_campus(face_encodings)
+        else:
+            assignments = gallery.assign(face_encodings, semester, section)
+    present_students = {student for student in assignments if student}
+    unknown = assignments.count(None)
+    FACES_MATCHED.inc(len(assignments) - unknown, scope=scope)
+    FACES_UNKNOWN.inc(unknown, scope=scope)
+    
+    attendance = record_attendance(semester, subject, section, present_students, params['timestamp'])
+    attendance['faces'] = len(face_encodings)
+    attendance['unknown_faces'] = unknown
+    attendance['rejected_faces'] = result.quality['rejected'] if result.quality else 0
+    return attendance
+
+
+def record_attendance(semester, subject, section, present_students, timestamp):
+    """Save one attendance session everywhere it is reported.
+
+    Returns the message for the teacher, the present and absent lists and the
+    sheet link (None while a new class's sheet is still being created).
+    """
+    attendance_file = f"attendance_{semester}_{subject}_{section}.txt"  # Include semester
+    
+    # Everyone else in the class is absent
+    absent_students = [student for student in gallery.roster(semester, section) if student not in present_students]
+    
+    # Record the session in the structured log read by the statistics apps
+    with span('take_attendance', 'session_log'):
+        SessionLog(attendance_file).append_session(timestamp, present_students, absent_students)
+    
+    # Save attendance in text file
+    with span('take_attendance', 'text_report'), open(attendance_file, 'a') as report:
+        report.write(f"\n--- Attendance Session: {timestamp} ---\n")
+        report.write("Present Students:\n")
+        report.writelines(f"{name} ({usn})\n" for name, usn in present_students)
+        report.write("\nAbsent Students:\n")
+        report.writelines(f"{name} ({usn})\n" for name, usn in absent_students)
+    STUDENTS_RECORDED.inc(len(present_students), status='present')
+    STUDENTS_RECORDED.inc(len(absent_students), status='absent')
+    
+    # Queue the Google Sheets update; the background worker writes it without blocking the teacher
+    with span('take_attendance', 'sheet_enqueue'):
+        sheet_queue.enqueue(semester, subject, section, list(present_students), absent_students, timestamp)
+    
+    message = f"Attendance taken for {semester} {subject} ({section}). Report saved as {attendance_file}."
+    sheet_id = known_google_sheet_id(subject, section, semester)
+    sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit?usp=sharing" if sheet_id else None
+    if sheet_url:
+        message = f"{message} View Sheet: {sheet_url}"
+    else:
+        message = f"{message} The Google Sheet is being created and will be updated shortly."
+    return {'message': message, 'sheet_url': sheet_url, 'timestamp': timestamp,
+            'present': sorted(present_students, key=lambda student: student[1]),
+            'absent': sorted(absent_students, key=lambda student: student[1])}
+
+
+@app.route('/video_attendance/start', methods=['POST'])
+def start_video_attendance():
+    """Start taking attendance from a camera or video source for the selected class.
+
+    The capture runs in this server process; the session's status and stop
+    requests may reach any of them.
+    """
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    
+    semester = session.get('semester', '1')
+    section = session.get('section', 'A')
+    subject = session.get('subject', 'default')
+    try:
+        source = parse_source(request.form.get('source'))  # Camera index, or a stream URL or file from VIDEO_SOURCES
+        window = parse_window(request.form.get('window'), VIDEO_SESSION_SECONDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.form.get('scope') == 'campus':
+        video = VideoSession(match_campus, window)
+    else:
+        video = VideoSession(lambda encodings: gallery.match(encodings, semester, section), window)
+    params = {'semester': semester, 'subject': subject, 'section': section,
+              'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    session_id = video_sessions.create(params)
+    threading.Thread(target=run_video_session, args=(session_id, video, source, params), daemon=True).start()
+    return jsonify({'session_id': session_id})
+
+def run_video_session(session_id, video, source, params):
+    """Capture until the window ends or a stop is requested, then record the session."""
+    stop = threading.Event()
+    outcome = {}
+    def capture():
+        try:
+            outcome['summary'] = run_capture(video, source, stop)
+        except Exception as e:
+            outcome['error'] = e
+    capture_thread = threading.Thread(target=capture, daemon=True)
+    capture_thread.start()
+    while capture_thread.is_alive():
+        capture_thread.join(VIDEO_SYNC_INTERVAL)
+        present = sorted(video.present(), key=lambda student: student[1])
+        if video_sessions.report(session_id, [f"{name} ({usn})" for name, usn in present], video.summary()):
+            stop.set()
+    
+    if 'error' in outcome:
+        print(f"Video session {session_id} failed: {outcome['error']}")
+        video_sessions.finish(session_id, error=str(outcome['error']))
+        return
+    summary = outcome['summary']
+    print(f"Video session {session_id}: {summary['frames_processed']}/{summary['frames_read']} frames, "
+          f"{summary['processing_fps']:.1f} fps, {summary['descriptors']} descriptors")
+    try:
+        attendance = record_attendance(params['semester'], params['subject'], params['section'],
+                                       video.present(), params['timestamp'])
+    except Exception as e:
+        print(f"Video session {session_id} could not be recorded: {e}")
+        video_sessions.finish(session_id, error=str(e))
+        return
+    video_sessions.finish(session_id, result=dict(attendance, stats=summary))
+
+@app.route('/video_attendance/<session_id>', methods=['GET'])
+def video_attendance_status(session_id):
+    """Students recognized so far and the tracking statistics of a video session, and its result once recorded."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    entry = video_sessions.get(session_id)
+    if entry is None:
+        return jsonify({'error': 'Unknown session'}), 404
+    return jsonify({'running': entry['state'] == 'running', 'state': entry['state'], 'error': entry['error'],
+                    'present': entry['present'], 'stats': entry['stats'], 'result': entry['result']})
+
+@app.route('/video_attendance/<session_id>/stop', methods=['POST'])
+def stop_video_attendance(session_id):
+    """Stop the capture and record everyone seen long enough as present.
+
+    Answers with the recorded session, or 202 if the capturing process has not
+    finished recording it within VIDEO_STOP_WAIT; the status URL then has it.
+    """
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if not video_sessions.request_stop(session_id):
+        return jsonify({'error': 'Unknown session'}), 404
+    deadline = time.monotonic() + VIDEO_STOP_WAIT
+    entry = video_sessions.get(session_id)
+    while entry['state'] == 'running' and time.monotonic() < deadline:
+        time.sleep(0.2)
+        entry = video_sessions.get(session_id)
+    if entry['state'] == 'error':
+        return jsonify({'error': entry['error']}), 500
+    if entry['state'] == 'running':
+        return jsonify({'session_id': session_id,
+                        'status_url': url_for('video_attendance_status', session_id=session_id)}), 202
+    return jsonify(entry['result'])
+
+
 @app.route('/attendance_statistics')
 def attendance_statistics():
     return render_template('attendance_statistics.html')
 
+
+@app.route('/attendance_statistics/semester')
+def semester_statistics():
+    """Student x subject attendance percentages as JSON, optionally for one ?semester= and/or ?section=."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    with span('semester_statistics', 'report'):
+        report = semester_analytics.report(request.args.get('semester'), request.args.get('section'))
+    return jsonify(report)
+
+def known_google_sheet_id(subject, section, semester):
+    """Return the registered Google Sheet ID without contacting the API, or None."""
+    return sheet_registry.sheet_id(semester, subject, section)
+
 def get_google_sheet_id(subject, section, semester):
-    """Retrieve the Google Sheet ID for the given semester, subject, and section."""
-    sheet_id_file = f'{subject}_{section}_{semester}_sheet_id.txt'  # Include semester in the file name
-    if os.path.exists(sheet_id_file):
-        with open(sheet_id_file, 'r') as file:
-            sheet_id = file.read().strip()
-        
-        # Verify if the sheet exists by making a request to read the sheet's metadata
-        try:
-            sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-            return sheet_id  # Sheet exists, return the ID
-        except HttpError as e:
-            if e.resp.status == 404:
-                print(f"Sheet with ID {sheet_id} not found. Creating a new sheet...")
-                return create_google_sheet(subject, section, semester)
-            else:
-                raise  # Reraise the exception for other HTTP errors
-    else:
-        print("Sheet ID file not found. Creating a new sheet...")
-        return create_google_sheet(subject, section, semester)
+    """Retrieve the Google Sheet ID for the given semester, subject, and section.
+
+    A registered sheet is trusted until its existence check is older than the
+    TTL; only then is it verified, asking the API for the ID field alone.
+    """
+    entry = sheet_registry.get(semester, subject, section)
+    if entry is None:
+        print("Sheet not registered. Creating a new sheet...")
+        return sheet_registry.get_or_create(semester, subject, section,
+                                            lambda: create_google_sheet(subject, section, semester))
+    if sheet_registry.is_fresh(entry):
+        return entry['sheet_id']
+    
+    # Verify if the sheet still exists with a minimal metadata request
+    try:
+        with google_call('spreadsheets.get'):
+            sheets_service.spreadsheets().get(spreadsheetId=entry['sheet_id'], fields='spreadsheetId').execute()
+        sheet_registry.mark_verified(semester, subject, section)
+        return entry['sheet_id']  # Sheet exists, return the ID
+    except HttpError as e:
+        if e.resp.status == 404:
+            print(f"Sheet with ID {entry['sheet_id']} not found. Creating a new sheet...")
+            return sheet_registry.get_or_create(semester, subject, section,
+                                                lambda: create_google_sheet(subject, section, semester),
+                                                stale_id=entry['sheet_id'])
+        else:
+            raise  # Reraise the exception for other HTTP errors
+
+def forget_google_sheet(subject, section, semester, sheet_id=None):
+    """Drop a sheet that turned out to be deleted, so the next lookup creates a new one."""
+    sheet_registry.forget(semester, subject, section, sheet_id)
 
 def create_google_sheet(subject, section, semester):
     """Create a new Google Sheet and save its ID."""
@@ -275,50 +775,70 @@ def create_google_sheet(subject, section, semester):
         spreadsheet = {
             'properties': {'title': f'Attendance_{semester}_{subject}_{section}'},  # Include semester
             'sheets': [
-                {'properties': {'title': 'Present'}},
-                {'properties': {'title': 'Absent'}}
+                {'properties': {'title': 'Present', 'sheetId': 0}},
+                {'properties': {'title': 'Absent', 'sheetId': 1}}
             ]
         }
         # Create the sheet
-        sheet = sheets_service.spreadsheets().create(body=spreadsheet).execute()
+        with google_call('spreadsheets.create'):
+            sheet = sheets_service.spreadsheets().create(body=spreadsheet).execute()
         sheet_id = sheet['spreadsheetId']
         
-        # Save the sheet ID to a file for future use
-        with open(f'{subject}_{section}_{semester}_sheet_id.txt', 'w') as file:
-            file.write(sheet_id)
+        # Register the sheet ID for future use
+        sheet_registry.put(semester, subject, section, sheet_id)
         
         # Make the sheet viewable by anyone with the link (view only)
-        drive_service.permissions().create(
-            fileId=sheet_id,
-            body={'type': 'anyone', 'role': 'reader'}
-        ).execute()
+        with google_call('permissions.create'):
+            drive_service.permissions().create(
+                fileId=sheet_id,
+                body={'type': 'anyone', 'role': 'reader'}
+            ).execute()
         
         return sheet_id
     except HttpError as err:
         print(f"Error creating or sharing the sheet: {err}")
         return None
 
-def update_attendance_in_sheet(sheet_id, present_students, absent_students, timestamp):
-    range_present = 'Present!A1'
-    range_absent = 'Absent!A1'
-    values_present = [[timestamp] + [f"{name} ({usn})" for name, usn in present_students]]
-    values_absent = [[timestamp] + [f"{name} ({usn})" for name, usn in absent_students]]
-
-    # Append the attendance data without overwriting existing data
-    sheets_service.spreadsheets().values().append(
-        spreadsheetId=sheet_id,
-        range=range_present,
-        valueInputOption='RAW',
-        body={'values': values_present}
-    ).execute()
-
-    # Append absent students
-    sheets_service.spreadsheets().values().append(
-        spreadsheetId=sheet_id,
-        range=range_absent,
-        valueInputOption='RAW',
-        body={'values': values_absent}
-    ).execute()
+# Persistent queue that writes attendance sessions to Google Sheets in the background
+sheet_queue = SheetWriteQueue(os.path.join(STUDENT_DATA_PATH, 'sheet_queue.db'), sheets_service,
+                              get_google_sheet_id, forget_google_sheet)
+REGISTRY.gauge('sheet_queue_depth', 'Attendance sessions waiting to be written to Google Sheets', sheet_queue.depth)
+REGISTRY.gauge('sheet_queue_failed', 'Attendance sessions given up on after repeated Google Sheets errors',
+               lambda: len(sheet_queue.failed()))
+
+# Durable queue of attendance submissions, processed by worker threads in every server process
+attendance_jobs = JobQueue(os.path.join(STUDENT_DATA_PATH, 'jobs'), run_attendance_job, transient=(BudgetExceeded,))
+REGISTRY.gauge('attendance_jobs_queued', 'Attendance jobs waiting for a worker', lambda: attendance_jobs.depth()['queued'])
+REGISTRY.gauge('attendance_jobs_running', 'Attendance jobs being processed', lambda: attendance_jobs.depth()['running'])
+
+# Bulk enrollments, one batch at a time per server process; a batch already fills the pipeline pool
+enroll_jobs = JobQueue(os.path.join(STUDENT_DATA_PATH, 'enroll_jobs'), run_bulk_enroll_job, name='enroll', workers=1,
+                       transient=(BudgetExceeded,))
+REGISTRY.gauge('enroll_jobs_queued', 'Bulk enrollment jobs waiting for a worker', lambda: enroll_jobs.depth()['queued'])
+REGISTRY.gauge('enroll_jobs_running', 'Bulk enrollment jobs being processed', lambda: enroll_jobs.depth()['running'])
+
+def after_fork():
+    """Per-worker setup under gunicorn preload; called from gunicorn.conf.py post_fork."""
+    student_store.reopen()
+    sheet_queue.reopen()
+    sheet_queue.start()
+    attendance_jobs.reopen()
+    attendance_jobs.start()
+    video_sessions.reopen()
+    enroll_jobs.reopen()
+    enroll_jobs.start()
+    if MODEL_WARMUP == 'background':
+        warm_up(WARM_RESOURCES)
+
+if MODEL_WARMUP == 'eager':
+    warm_up(WARM_RESOURCES, background=False)
+if not PRELOAD_APP:
+    sheet_queue.start()
+    attendance_jobs.start()
+    enroll_jobs.start()
+    if MODEL_WARMUP == 'background':
+        warm_up(WARM_RESOURCES)
+print(f"App initialized in {uptime():.2f}s (RSS {rss_mb():.0f} MB, model warmup: {MODEL_WARMUP})")
 
 if __name__ == '__main__':
     app.run(debug=True)
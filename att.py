@@ -1,58 +1,19 @@
 from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify
 import os
-import re
-from collections import defaultdict
 from fpdf import FPDF
+from attendance_stats import count_sessions, percentages
+from session_log import load_counters, counter_sources
+from report_jobs import ReportJobs, parse_threshold
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # For using flash messages
 
-# Function to read the entire attendance data from a file
-def read_attendance_data(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            attendance_data = file.read()
-        return attendance_data
-    except FileNotFoundError:
-        print(f"File not found at the path: {file_path}")
-        return None
-
 # Function to process the attendance data and calculate percentages
 def process_attendance_data(attendance_data):
-    students = defaultdict(lambda: {'present': 0, 'total_sessions': 0})
-    
-    present_pattern = re.compile(r"Present Students:\s*(.*?)\s*Absent Students:", re.DOTALL)
-    absent_pattern = re.compile(r"Absent Students:\s*(.*?)\s*(?=\n---|$)", re.DOTALL)
-
-    sessions = attendance_data.strip().split("\n\n--- Attendance Session:")
-    
-    for session in sessions:
-        present_students = present_pattern.search(session)
-        absent_students = absent_pattern.search(session)
-        
-        if present_students:
-            present_list = re.findall(r"([\w\s]+ \(\w+\))", present_students.group(1))
-            for student in present_list:
-                students[student]['present'] += 1
-                students[student]['total_sessions'] += 1
-        
-        if absent_students:
-            absent_list = re.findall(r"([\w\s]+ \(\w+\))", absent_students.group(1))
-            for student in absent_list:
-                students[student]['total_sessions'] += 1
-    
-    attendance_percentages = {}
-    for student, data in students.items():
-        total_sessions = data['total_sessions']
-        if total_sessions > 0:
-            attendance_percentages[student] = (data['present'] / total_sessions) * 100
-        else:
-            attendance_percentages[student] = 0
-    
-    return attendance_percentages
+    return percentages(count_sessions(attendance_data))
 
 # Function to create a PDF report
-def create_pdf_report(statistics):
+def create_pdf_report(statistics, pdf_output_path, threshold=75):
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
@@ -60,16 +21,16 @@ def create_pdf_report(statistics):
     pdf.cell(200, 10, txt="Attendance Report", ln=True, align="C")
     pdf.ln(10)
 
-    # Adding students with attendance below 75%
+    # Adding students with attendance below the threshold
     pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, "Students with Attendance Below 75%", ln=True)
+    pdf.cell(0, 10, f"Students with Attendance Below {threshold:g}%", ln=True)
     pdf.set_font("Arial", "", 12)
 
     # Set to track students already printed
     printed_students = set()
 
     for student, percentage in statistics.items():
-        if percentage < 75:
+        if percentage < threshold:
             if student not in printed_students:
                 pdf.set_text_color(255, 0, 0)  # Red color for low attendance
                 pdf.cell(0, 10, f"{student} - {percentage:.1f}%", ln=True)
@@ -78,23 +39,30 @@ def create_pdf_report(statistics):
 
     pdf.ln(5)
 
-    # Adding students with attendance 75% or above
+    # Adding students with attendance at or above the threshold
     pdf.set_font("Arial", "B", 12)
-    pdf.cell(0, 10, "Students with Attendance 75% or Above", ln=True)
+    pdf.cell(0, 10, f"Students with Attendance {threshold:g}% or Above", ln=True)
     pdf.set_font("Arial", "", 12)
 
     for student, percentage in statistics.items():
-        if percentage >= 75:
+        if percentage >= threshold:
             if student not in printed_students:
                 pdf.set_text_color(0, 128, 0)  # Green color for good attendance
                 pdf.cell(0, 10, f"{student} - {percentage:.1f}%", ln=True)
                 pdf.set_text_color(0, 0, 0)  # Reset color to black
                 printed_students.add(student)
 
-    pdf_output_path = "attendance_report.pdf"
     pdf.output(pdf_output_path)
     return pdf_output_path
 
+# Function to build the PDF for one attendance file; runs on a report worker thread
+def render_report(file_path, threshold, pdf_output_path):
+    # Read the structured session log, or parse only what was appended to the text report
+    counters = load_counters(file_path)
+    create_pdf_report(percentages(counters), pdf_output_path, threshold)
+
+report_jobs = ReportJobs(render_report, counter_sources)
+
 @app.route('/', methods=['GET', 'POST'])
 def home():
     folder_path = os.path.dirname(os.path.abspath(__file__))
@@ -104,20 +72,31 @@ def home():
         selected_file = request.form.get('file')
         if selected_file:
             file_path = os.path.join(folder_path, selected_file)
-            attendance_data = read_attendance_data(file_path)
-            if attendance_data is not None:
-                attendance_percentages = process_attendance_data(attendance_data)
-                pdf_path = create_pdf_report(attendance_percentages)
-                return jsonify({"status": "success", "pdf_path": pdf_path, "file_name": selected_file})
+            if os.path.exists(file_path):
+                try:
+                    threshold = parse_threshold(request.form.get('threshold'))
+                except ValueError:
+                    return jsonify({"status": "error", "message": "The threshold must be a number from 0 to 100."}), 400
+                job_id = report_jobs.submit(file_path, selected_file, threshold)
+                job = report_jobs.status(job_id)
+                return jsonify({"status": job['status'], "job_id": job_id, "file_name": selected_file})
+            print(f"File not found at the path: {file_path}")
             return jsonify({"status": "error", "message": "Error reading the file. Please try again."})
 
     return render_template('attendance_statistics.html', files=files)
 
-@app.route('/download/<file_name>')
-def download(file_name):
-    pdf_path = "attendance_report.pdf"
-    if os.path.exists(pdf_path):
-        return send_file(pdf_path, as_attachment=True, download_name=f"{file_name}_attendance_report.pdf")
+@app.route('/report_status/<job_id>')
+def report_status(job_id):
+    job = report_jobs.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown report. Please try again."}), 404
+    return jsonify({"status": job['status'], "job_id": job_id, "file_name": job['file_name'], "message": job['message']})
+
+@app.route('/download/<job_id>')
+def download(job_id):
+    job = report_jobs.status(job_id)
+    if job and job['status'] == 'success' and os.path.exists(job['pdf_path']):
+        return send_file(job['pdf_path'], as_attachment=True, download_name=f"{job['file_name']}_attendance_report.pdf")
     else:
         flash("Report not found. Please try again.")
         return redirect(url_for('home'))
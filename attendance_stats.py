@@ -0,0 +1,113 @@
+import os
+import json
+from collections import defaultdict
+
+# Line that opens every session in an attendance_*.txt file
+SESSION_MARKER = b'--- Attendance Session:'
+
+# Sidecar directory holding the parsed counters of each attendance file
+STATS_DIR_NAME = '.attendance_stats'
+
+# Bytes at the head of a file used to notice that it was replaced rather than appended to
+FINGERPRINT_BYTES = 256
+
+
+def parse_sessions(text):
+    """Yield (timestamp, present, absent) for every session in attendance text.
+
+    Students are the 'name (usn)' lines exactly as take_attendance wrote them,
+    so names with punctuation are kept intact.
+    """
+    timestamp, present, absent, current = None, [], [], None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if line.startswith('--- Attendance Session:'):
+            if timestamp is not None:
+                yield timestamp, present, absent
+            timestamp = line[len('--- Attendance Session:'):].strip(' -')
+            present, absent, current = [], [], None
+        elif line == 'Present Students:':
+            current = present
+        elif line == 'Absent Students:':
+            current = absent
+        elif line and current is not None:
+            current.append(line)
+    if timestamp is not None:
+        yield timestamp, present, absent
+
+
+def count_sessions(text, counters=None):
+    """Add every session in text to {student: [present, total_sessions]} counters."""
+    counters = defaultdict(lambda: [0, 0], counters or {})
+    for _, present, absent in parse_sessions(text):
+        for student in present:
+            counters[student][0] += 1
+            counters[student][1] += 1
+        for student in absent:
+            counters[student][1] += 1
+    return counters
+
+
+def percentages(counters):
+    """Attendance percentage per student from [present, total_sessions] counters."""
+    return {student: (present / total) * 100 if total > 0 else 0
+            for student, (present, total) in counters.items()}
+
+
+class IncrementalStats:
+    """Attendance counters for one log file, updated from where the last parse stopped.
+
+    The sidecar remembers the byte offset of the last session it has seen in
+    full plus per-student [present, total] counters. A report parses only what
+    was appended since then. The final session of the file is counted but not
+    folded into the sidecar, because take_attendance may still be writing it.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        directory, name = os.path.split(os.path.abspath(file_path))
+        self.state_path = os.path.join(directory, STATS_DIR_NAME, f'{name}.json')
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, self.state_path)
+
+    def counters(self):
+        """Per-student [present, total_sessions], or None if the file does not exist."""
+        try:
+            f = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            fingerprint = f.read(FINGERPRINT_BYTES).hex()
+            size = os.fstat(f.fileno()).st_size
+            state = self._load_state()
+            if state is None or state['offset'] > size or not fingerprint.startswith(state['fingerprint']):
+                state = {'offset': 0, 'fingerprint': '', 'students': {}}  # New or rewritten file
+            f.seek(state['offset'])
+            chunk = f.read()
+
+        # Everything before the last session marker is final and is folded into the sidecar
+        last_marker = max(chunk.rfind(SESSION_MARKER), 0)
+        settled, tail = chunk[:last_marker], chunk[last_marker:]
+        counters = count_sessions(settled.decode('utf-8', errors='replace'), state['students'])
+        if settled:
+            self._save_state({'offset': state['offset'] + len(settled), 'fingerprint': fingerprint,
+                              'students': dict(counters)})
+
+        # The last session is counted on top without being persisted
+        return count_sessions(tail.decode('utf-8', errors='replace'), {k: list(v) for k, v in counters.items()})
+
+    def percentages(self):
+        counters = self.counters()
+        return None if counters is None else percentages(counters)
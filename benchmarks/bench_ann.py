@@ -0,0 +1,58 @@
+"""Compare the IVF approximate index against exact campus-wide search.
+
+Usage: python benchmarks/bench_ann.py --students 20000 --encodings 4 --nprobe 1 4 8 16
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import FaceGallery, MATCH_TOLERANCE
+from ann_index import IVFIndex
+from benchmarks.common import synthetic_students
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ANN vs exact face search.')
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--encodings', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    students, centers = synthetic_students(args.students, args.encodings, rng)
+    gallery = FaceGallery(students)
+
+    # Queries are fresh noisy views of random enrolled students
+    truth = rng.integers(args.students, size=args.queries)
+    queries = centers[truth] + rng.normal(scale=0.02, size=(args.queries, 128)).astype(np.float32)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery.row_descriptors(), gallery.row_labels())
+    print(f"Built IVF index over {len(index)} descriptors, {len(index.centroids)} lists "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    # Warm up so the one-off list regrouping is not charged to the first nprobe
+    index.search(queries[:1])
+
+    start = time.perf_counter()
+    exact = gallery.match_all(queries)
+    exact_time = time.perf_counter() - start
+    print(f"exact      : {exact_time * 1000:8.2f} ms  matched {len(exact)}")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        distances, usns = index.search(queries, nprobe=nprobe)
+        elapsed = time.perf_counter() - start
+        approx = {usn for usn in usns[distances < MATCH_TOLERANCE]}
+        recall = len(approx & {usn for _, usn in exact}) / max(len(exact), 1)
+        print(f"nprobe={nprobe:<4}: {elapsed * 1000:8.2f} ms  recall {recall:.3f}  "
+              f"speedup {exact_time / elapsed:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
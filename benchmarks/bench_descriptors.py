@@ -0,0 +1,42 @@
+"""Per-face versus batched ResNet descriptor throughput on CPU.
+
+Usage: python benchmarks/bench_descriptors.py photos/ --batch-sizes 1 8 16 32 64
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_pipeline import extract_chips, load_models
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched face descriptor computation.')
+    parser.add_argument('photos', help='Directory of class photos')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    recognizer = load_models().recognizer
+    chips = []
+    for name in sorted(os.listdir(args.photos)):
+        with open(os.path.join(args.photos, name), 'rb') as f:
+            chips.extend(extract_chips(f.read())[0])
+    if not chips:
+        sys.exit('No faces found in the photos.')
+    print(f"{len(chips)} face chips")
+
+    # Warm up the network so allocation is not charged to the first run
+    recognizer.compute_face_descriptor(chips[:1])
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(chips), batch_size):
+            recognizer.compute_face_descriptor(chips[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"batch={batch_size:<4} {len(chips) / elapsed:8.1f} faces/s  {elapsed * 1000 / len(chips):6.1f} ms/face")
+
+
+if __name__ == '__main__':
+    main()
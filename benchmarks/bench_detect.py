@@ -0,0 +1,76 @@
+"""Latency and recall of downscaled detection across image sizes.
+
+The reference for recall is the detector run on the full-resolution image
+with one upsampling step. Every configuration is scored on how many of the
+reference faces it finds (IoU >= 0.5 after mapping back to full resolution).
+
+Usage: python benchmarks/bench_detect.py photos/ --sizes 1500 3000 6000 --max-side 0 1200 1600 2400 --upsample 0 1
+"""
+import os
+import sys
+import time
+import argparse
+import cv2
+import dlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_pipeline import detect_faces
+
+
+# Function to compute the intersection-over-union of two dlib rectangles
+def iou(a, b):
+    left, top = max(a.left(), b.left()), max(a.top(), b.top())
+    right, bottom = min(a.right(), b.right()), min(a.bottom(), b.bottom())
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a.width() * a.height() + b.width() * b.height() - inter
+    return inter / union if union else 0.0
+
+
+# Function to count how many reference faces a detection run recovered
+def matched(reference, found, threshold=0.5):
+    return sum(1 for ref in reference if any(iou(ref, face) >= threshold for face in found))
+
+
+# Function to resize an image so its longest side equals `side`
+def resize_long_side(img, side):
+    height, width = img.shape[:2]
+    scale = side / max(height, width)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=interpolation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark downscale-then-refine face detection.')
+    parser.add_argument('photos', help='Directory of class photos')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1500, 3000, 6000], help='Long side of the test images')
+    parser.add_argument('--max-side', type=int, nargs='+', default=[0, 1200, 1600, 2400], help='0 means no downscaling')
+    parser.add_argument('--upsample', type=int, nargs='+', default=[0, 1])
+    args = parser.parse_args()
+
+    detector = dlib.get_frontal_face_detector()
+    photos = [cv2.imread(os.path.join(args.photos, name), cv2.IMREAD_GRAYSCALE)
+              for name in sorted(os.listdir(args.photos))]
+    photos = [photo for photo in photos if photo is not None]
+    print(f"{len(photos)} photos")
+    print(f"{'size':>6} {'max_side':>8} {'upsample':>8} {'ms/image':>9} {'recall':>7}")
+
+    for size in args.sizes:
+        images = [resize_long_side(photo, size) for photo in photos]
+        references = [list(detector(img, 1)) for img in images]
+        total_reference = sum(len(ref) for ref in references) or 1
+
+        for max_side in args.max_side:
+            for upsample in args.upsample:
+                found_total, elapsed = 0, 0.0
+                for img, reference in zip(images, references):
+                    start = time.perf_counter()
+                    faces = detect_faces(detector, img, max_side=max_side, upsample=upsample)
+                    elapsed += time.perf_counter() - start
+                    found_total += matched(reference, faces)
+                print(f"{size:>6} {max_side:>8} {upsample:>8} {elapsed * 1000 / len(images):>9.1f} "
+                      f"{found_total / total_reference:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Memory, speed and accuracy of the gallery's compact descriptor options.
+
+Every combination of storage (float32, float16, pq), descriptor cap and
+exact versus two-stage matching is compared against the exact float32
+gallery on the same faces: enrolled students of one class plus strangers.
+Agreement is the share of faces assigned exactly as the baseline assigns
+them (same student, or unknown for both); recall is the share of
+photographed students found.
+
+Usage: python benchmarks/bench_gallery.py --students 20000 --encodings 12 --max-encodings 0 6
+       python benchmarks/bench_gallery.py --students 5000 --output gallery.json
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import FaceGallery, make_codec
+from benchmarks.common import synthetic_students, synthetic_faces, time_call, summarize, write_results
+
+
+def agreement(assignments, baseline):
+    return float(np.mean([a == b for a, b in zip(assignments, baseline)])) if baseline else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compact gallery storage and two-stage matching.')
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--encodings', type=int, default=12, help='Enrolled descriptors per student')
+    parser.add_argument('--faces', type=int, default=40, help='Enrolled students in the photo')
+    parser.add_argument('--strangers', type=int, default=5, help='Unenrolled faces in the photo')
+    parser.add_argument('--dtypes', nargs='+', default=['float32', 'float16', 'pq'])
+    parser.add_argument('--max-encodings', type=int, nargs='+', default=[0, 6], help='Descriptor caps (0 keeps all)')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='Also write the results as JSON')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    students, centers = synthetic_students(args.students, args.encodings, rng)
+    # Photographed students are spread over the campus so the campus search has to find them
+    truth = rng.choice(args.students, size=args.faces, replace=False)
+    faces = synthetic_faces(centers, truth, rng)
+    faces += list(rng.normal(scale=0.09, size=(args.strangers, 128)).astype(np.float32))
+    truth_usns = {students[i]['usn'] for i in truth}
+
+    baseline_gallery = FaceGallery(students, codec=make_codec('float32'), max_encodings=0, two_stage=False)
+    baseline = baseline_gallery.assign_all(faces)
+    baseline_bytes = baseline_gallery.nbytes()
+    del baseline_gallery
+
+    results = []
+    for dtype in args.dtypes:
+        for max_encodings in args.max_encodings:
+            start = time.perf_counter()
+            gallery = FaceGallery(students, codec=make_codec(dtype), max_encodings=max_encodings, two_stage=False)
+            build_seconds = time.perf_counter() - start
+            for two_stage in (False, True):
+                gallery.two_stage = two_stage
+                assignments = gallery.assign_all(faces)
+                found = {student[1] for student in assignments if student}
+                params = {'dtype': dtype, 'max_encodings': max_encodings, 'two_stage': two_stage,
+                          'students': args.students, 'encodings': args.encodings}
+                result = summarize('gallery.campus_match', time_call(lambda: gallery.assign_all(faces), args.repeat),
+                                   items=len(faces), unit='faces', **params)
+                result.update({
+                    'memory_bytes': gallery.nbytes(),
+                    'memory_ratio': baseline_bytes / gallery.nbytes(),
+                    'agreement': agreement(assignments, baseline),
+                    'recall': len(found & truth_usns) / len(truth_usns),
+                    'false_matches': sum(1 for student in assignments[args.faces:] if student),
+                    'build_seconds': build_seconds,
+                })
+                print(f"{'':<28} memory {result['memory_bytes'] / 2**20:8.1f} MB ({result['memory_ratio']:4.1f}x smaller)"
+                      f"  agreement {result['agreement']:.3f}  recall {result['recall']:.3f}"
+                      f"  false matches {result['false_matches']}  build {build_seconds:.1f}s")
+                results.append(result)
+            del gallery
+
+    if args.output:
+        write_results(args.output, results, args=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""Benchmark and load-test suite for the recognition and reporting paths.
+
+Runs on synthetic data only: rosters of random 128-d encodings and
+attendance logs with thousands of sessions. Each scenario times the legacy
+code path next to the current one and reports p50/p99 latency and
+throughput. Results are written as JSON so runs can be diffed over time.
+
+Scenarios:
+  match    one class photo matched against the class (legacy pickle scan vs gallery) and the campus
+  storage  loading and saving the roster (legacy pickle vs student store)
+  parse    attendance statistics from a text log (legacy regex, line parser, incremental, binary log)
+  pdf      PDF report generation
+  flask    end-to-end take_attendance (submit and poll the job) through the Flask test client with fake Google services
+
+Usage: python benchmarks/bench_suite.py --sizes 500 5000 50000 --sessions 2000 --output bench.json
+       python benchmarks/bench_suite.py --only flask --clients 8 --requests 50
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import (synthetic_students, synthetic_faces, synthetic_attendance_log, legacy_save_pickle,
+                               legacy_load_pickle, legacy_match, legacy_parse, time_call, summarize, write_results)
+from gallery import FaceGallery
+from student_store import StudentStore
+from attendance_stats import count_sessions, parse_sessions, percentages, IncrementalStats
+from session_log import SessionLog, parse_student_line
+
+SCENARIOS = ('match', 'storage', 'parse', 'pdf', 'flask')
+
+# Faces in one synthetic class photo
+FACES_PER_PHOTO = 40
+
+# Legacy paths re-read the pickle per face; beyond this roster size they are skipped as too slow
+LEGACY_MAX_STUDENTS = 5000
+
+
+def bench_match(sizes, encodings, repeat, rng, workdir):
+    results = []
+    for size in sizes:
+        students, centers = synthetic_students(size, encodings, rng)
+        gallery = FaceGallery(students)
+        # A photo of class 1A: its students (every 56th by construction) plus a few strangers
+        class_rows = np.arange(0, size, 56)[:FACES_PER_PHOTO]
+        faces = synthetic_faces(centers, class_rows, rng)
+        faces += list(rng.normal(scale=0.09, size=(5, 128)).astype(np.float32))
+
+        if size <= LEGACY_MAX_STUDENTS:
+            pickle_path = os.path.join(workdir, f'match_{size}.pkl')
+            legacy_save_pickle(pickle_path, students)
+            results.append(summarize('match.legacy_pickle_scan', time_call(
+                lambda: legacy_match(pickle_path, faces, '1', 'A'), repeat=max(1, repeat // 5), warmup=0),
+                items=len(faces), unit='faces', students=size))
+        results.append(summarize('match.gallery_class', time_call(
+            lambda: gallery.match(faces, '1', 'A'), repeat), items=len(faces), unit='faces', students=size))
+        results.append(summarize('match.gallery_campus', time_call(
+            lambda: gallery.match_all(faces), repeat), items=len(faces), unit='faces', students=size))
+    return results
+
+
+def bench_storage(sizes, encodings, repeat, rng, workdir):
+    results = []
+    for size in sizes:
+        students, _ = synthetic_students(size, encodings, rng)
+        pickle_path = os.path.join(workdir, f'storage_{size}.pkl')
+        results.append(summarize('storage.pickle_save', time_call(
+            lambda: legacy_save_pickle(pickle_path, students), repeat, warmup=0), items=size, unit='students',
+            students=size))
+        results.append(summarize('storage.pickle_load', time_call(
+            lambda: legacy_load_pickle(pickle_path), repeat), items=size, unit='students', students=size))
+
+        store_dir = os.path.join(workdir, f'store_{size}')
+
+        def fresh_store_bulk():
+            shutil.rmtree(store_dir, ignore_errors=True)
+            StudentStore(store_dir).upsert_many(students)
+        results.append(summarize('storage.store_bulk_upsert', time_call(fresh_store_bulk, repeat, warmup=0),
+                                 items=size, unit='students', students=size))
+
+        store = StudentStore(store_dir)
+        results.append(summarize('storage.store_single_upsert', time_call(lambda: store.upsert(students[0]), repeat),
+                                 unit='students', students=size))
+        results.append(summarize('storage.store_load_all', time_call(store.all, repeat), items=size,
+                                 unit='students', students=size))
+        results.append(summarize('storage.store_load_class', time_call(lambda: store.by_class('1', 'A'), repeat),
+                                 unit='classes', students=size))
+    return results
+
+
+def bench_parse(class_size, sessions_list, repeat, rng, workdir):
+    results = []
+    roster = [(f'Student {i}', f'USN{i:06d}') for i in range(class_size)]
+    for sessions in sessions_list:
+        path = os.path.join(workdir, f'attendance_{sessions}.txt')
+        synthetic_attendance_log(path, roster, sessions, rng)
+        with open(path, 'r') as f:
+            text = f.read()
+        params = {'sessions': sessions, 'class_size': class_size}
+
+        results.append(summarize('parse.legacy_regex', time_call(lambda: legacy_parse(text), repeat),
+                                 items=sessions, unit='sessions', **params))
+        results.append(summarize('parse.line_parser', time_call(lambda: percentages(count_sessions(text)), repeat),
+                                 items=sessions, unit='sessions', **params))
+
+        # Incremental: a cold parse builds the sidecar, then each report only reads one new session
+        stats = IncrementalStats(path)
+        results.append(summarize('parse.incremental_cold', time_call(
+            lambda: (shutil.rmtree(os.path.dirname(stats.state_path), ignore_errors=True), stats.counters()),
+            repeat, warmup=0), items=sessions, unit='sessions', **params))
+        stats.counters()
+
+        def append_and_count():
+            with open(path, 'a') as report:
+                report.write("\n--- Attendance Session: 2024-02-01 10:00:00 ---\nPresent Students:\n"
+                             f"{roster[0][0]} ({roster[0][1]})\n\nAbsent Students:\n")
+            stats.counters()
+        results.append(summarize('parse.incremental_warm', time_call(append_and_count, repeat), unit='reports',
+                                 **params))
+
+        # Structured binary log, aggregated with bincount
+        log = SessionLog(path)
+        for name in ('records', 'students', 'sessions'):
+            if os.path.exists(getattr(log, f'{name}_path')):
+                os.remove(getattr(log, f'{name}_path'))
+        os.makedirs(os.path.dirname(log.records_path), exist_ok=True)
+        log._append([(timestamp, [parse_student_line(s) for s in present], [parse_student_line(s) for s in absent])
+                     for timestamp, present, absent in parse_sessions(text)])
+        results.append(summarize('parse.binary_log', time_call(lambda: percentages(log.counters()), repeat),
+                                 items=sessions, unit='sessions', **params))
+    return results
+
+
+def bench_pdf(class_sizes, repeat, workdir):
+    import att
+    results = []
+    for class_size in class_sizes:
+        statistics = {f'Student {i} (USN{i:06d})': (i * 37) % 101 for i in range(class_size)}
+        output = os.path.join(workdir, f'report_{class_size}.pdf')
+        results.append(summarize('pdf.create_report', time_call(lambda: att.create_pdf_report(statistics, output),
+                                                                repeat), unit='reports', students=class_size))
+    return results
+
+
+def bench_flask(students_count, clients, requests_per_client, rng):
+    """Concurrent take_attendance submissions through the Flask test client.
+
+    Each client submits a photo and polls its job until the result is ready,
+    so latency covers the queue wait as well as the work. The face pipeline is
+    replaced by synthetic descriptors of the photographed class, so the run
+    measures the job queue, matching, logging and the Sheets queue rather
+    than dlib. Google services are the in-memory fakes.
+    """
+    os.environ.setdefault('MODEL_WARMUP', 'lazy')
+    import app as app_module
+    from tests.fake_google import FakeSheetsService, FakeDriveService
+    from face_pipeline import PipelineResult
+
+    fake_sheets, fake_drive = FakeSheetsService(), FakeDriveService()
+    app_module.sheets_service = fake_sheets
+    app_module.drive_service = fake_drive
+    app_module.sheet_queue.sheets_service = fake_sheets
+    app_module.sheet_queue.stop()
+
+    students, centers = synthetic_students(students_count, 2, rng)
+    app_module.gallery.reload(students)
+    class_rows = np.arange(0, students_count, 56)[:FACES_PER_PHOTO]
+    faces = synthetic_faces(centers, class_rows, rng)
+    app_module.process_images = lambda files: PipelineResult(
+        list(faces), [len(faces)], {'total': 0.0}, 0)
+    app_module.estimate_request_bytes = lambda files: 0
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client_loop():
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess.update({'user': 'bench', 'semester': '1', 'section': 'A', 'subject': 'BENCH'})
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            response = client.post('/take_attendance', data={
+                'class_images': (io.BytesIO(b'photo'), 'class.jpg')}, content_type='multipart/form-data')
+            state = response.status_code
+            if response.status_code == 202:
+                while True:
+                    state = client.get(response.get_json()['status_url']).get_json()['state']
+                    if state in ('done', 'error'):
+                        break
+                    time.sleep(0.005)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if state != 'done':
+                    errors.append(state)
+
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    total = clients * requests_per_client
+    result = summarize('flask.take_attendance', latencies, unit='requests', students=students_count,
+                       clients=clients)
+    result['throughput'] = total / wall
+    result['errors'] = len(errors)
+    app_module.attendance_jobs.stop()
+
+    start = time.perf_counter()
+    written = app_module.sheet_queue.process_pending()
+    drain = summarize('flask.sheet_queue_drain', [time.perf_counter() - start], items=max(written, 1),
+                      unit='sessions', queued=written)
+    drain['sheets_api_calls'] = len(fake_sheets.calls)
+    return [result, drain]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark matching, storage, parsing, PDF and request paths.')
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 5000, 50000], help='Roster sizes')
+    parser.add_argument('--encodings', type=int, default=3, help='Encodings per student')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[100, 1000, 5000], help='Sessions per log')
+    parser.add_argument('--class-size', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent clients in the flask scenario')
+    parser.add_argument('--requests', type=int, default=25, help='Requests per client in the flask scenario')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    # Everything, including the app's data files in the flask scenario, is written to a scratch directory
+    workdir = tempfile.mkdtemp(prefix='attendance-bench-')
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if 'match' in args.only:
+            results += bench_match(args.sizes, args.encodings, args.repeat, rng, workdir)
+        if 'storage' in args.only:
+            results += bench_storage(args.sizes, args.encodings, args.repeat, rng, workdir)
+        if 'parse' in args.only:
+            results += bench_parse(args.class_size, args.sessions, args.repeat, rng, workdir)
+        if 'pdf' in args.only:
+            results += bench_pdf([args.class_size, args.class_size * 10], args.repeat, workdir)
+        if 'flask' in args.only:
+            results += bench_flask(max(args.sizes), args.clients, args.requests, rng)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    write_results(output, results, args=vars(args))
+
+
+if __name__ == '__main__':
+    main()
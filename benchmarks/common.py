@@ -0,0 +1,152 @@
+"""Shared helpers for the benchmark scripts: synthetic data, the legacy
+code paths the new ones are compared against, timing and JSON output.
+"""
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import platform
+import subprocess
+from collections import defaultdict
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+SECTIONS = 'ABCDEFG'
+
+
+# Function to generate a synthetic roster where each student's encodings cluster around one identity
+def synthetic_students(count, encodings_per_student, rng):
+    centers = rng.normal(scale=0.09, size=(count, 128)).astype(np.float32)
+    students = []
+    for i, center in enumerate(centers):
+        encodings = center + rng.normal(scale=0.02, size=(encodings_per_student, 128)).astype(np.float32)
+        students.append({'name': f'Student {i}', 'usn': f'USN{i:06d}', 'semester': str(i % 8 + 1),
+                         'section': SECTIONS[i % 7], 'encodings': list(encodings)})
+    return students, centers
+
+
+# Function to produce fresh noisy views of some enrolled students, as faces in a class photo would be
+def synthetic_faces(centers, indices, rng):
+    return list(centers[indices] + rng.normal(scale=0.02, size=(len(indices), 128)).astype(np.float32))
+
+
+# Function to write an attendance_*.txt log in the format take_attendance produces
+def synthetic_attendance_log(path, roster, sessions, rng, present_ratio=0.8):
+    with open(path, 'w') as report:
+        for i in range(sessions):
+            present = rng.random(len(roster)) < present_ratio
+            report.write(f"\n--- Attendance Session: 2024-01-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d} ---\n")
+            report.write("Present Students:\n")
+            report.writelines(f"{name} ({usn})\n" for (name, usn), here in zip(roster, present) if here)
+            report.write("\nAbsent Students:\n")
+            report.writelines(f"{name} ({usn})\n" for (name, usn), here in zip(roster, present) if not here)
+
+
+# Legacy storage: one pickled dict per student appended to encodings.pkl
+def legacy_save_pickle(path, students):
+    with open(path, 'wb') as f:
+        for student in students:
+            pickle.dump(student, f)
+
+
+def legacy_load_pickle(path):
+    students = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                students.append(pickle.load(f))
+            except EOFError:
+                break
+    return students
+
+
+# Legacy take_attendance matching: re-read the pickle for every face and compare encoding by encoding
+def legacy_match(path, face_encodings, semester, section):
+    present_students = set()
+    for face_encoding in face_encodings:
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    student = pickle.load(f)
+                    if student['semester'] == semester and student['section'] == section:
+                        matches = [np.linalg.norm(face_encoding - enc) < 0.6 for enc in student['encodings']]
+                        if any(matches):
+                            present_students.add((student['name'], student['usn']))
+                            break
+                except EOFError:
+                    break
+    return present_students
+
+
+# Legacy process_attendance_data: regex split over the whole text report
+def legacy_parse(attendance_data):
+    students = defaultdict(lambda: {'present': 0, 'total_sessions': 0})
+    present_pattern = re.compile(r"Present Students:\s*(.*?)\s*Absent Students:", re.DOTALL)
+    absent_pattern = re.compile(r"Absent Students:\s*(.*?)\s*(?=\n---|$)", re.DOTALL)
+    for session in attendance_data.strip().split("\n\n--- Attendance Session:"):
+        present_students = present_pattern.search(session)
+        absent_students = absent_pattern.search(session)
+        if present_students:
+            for student in re.findall(r"([\w\s]+ \(\w+\))", present_students.group(1)):
+                students[student]['present'] += 1
+                students[student]['total_sessions'] += 1
+        if absent_students:
+            for student in re.findall(r"([\w\s]+ \(\w+\))", absent_students.group(1)):
+                students[student]['total_sessions'] += 1
+    return {student: (data['present'] / data['total_sessions']) * 100 if data['total_sessions'] else 0
+            for student, data in students.items()}
+
+
+def time_call(func, repeat=5, warmup=1):
+    """Seconds taken by each of `repeat` calls of func, after `warmup` untimed calls."""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(name, latencies, items=1, unit='items', **params):
+    """Result record with p50/p99/mean latency and throughput (items per second)."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    result = {
+        'name': name,
+        'params': params,
+        'runs': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+        'throughput': float(items / latencies.mean()) if latencies.mean() > 0 else None,
+        'unit': f'{unit}/s',
+    }
+    print(f"{name:<28} {' '.join(f'{k}={v}' for k, v in params.items()):<34} "
+          f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+          f"{result['throughput'] or 0:12.1f} {result['unit']}")
+    return result
+
+
+def environment_info():
+    """Machine and revision details stored next to the numbers so runs can be compared."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                  text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'git_revision': revision,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def write_results(path, results, **meta):
+    """Write results as JSON: {"environment": ..., "meta": ..., "results": [...]}."""
+    with open(path, 'w') as f:
+        json.dump({'environment': environment_info(), 'meta': meta, 'results': results}, f, indent=2)
+    print(f"Wrote {len(results)} results to {path}")
@@ -0,0 +1,223 @@
+"""Bulk enrollment from a photo directory or zip with one folder per USN, plus a roster CSV."""
+import os
+import csv
+import json
+import time
+import zipfile
+import argparse
+from collections import OrderedDict
+from image_io import HEADER_BYTES, decoded_bytes
+from face_pipeline import process_images, format_timings, format_quality, estimate_peak_bytes
+
+# Files taken as photos; anything else in the batch is ignored
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Columns the roster CSV must have
+ROSTER_COLUMNS = ('usn', 'name', 'semester', 'section')
+
+
+class RosterError(ValueError):
+    """The roster CSV or the photo batch cannot be enrolled as given."""
+
+
+def read_roster(lines):
+    """Parse the roster CSV into {usn: {'name', 'semester', 'section'}}, in file order."""
+    reader = csv.DictReader(lines)
+    columns = {(column or '').strip().lower() for column in reader.fieldnames or ()}
+    missing = [column for column in ROSTER_COLUMNS if column not in columns]
+    if missing:
+        raise RosterError(f"Roster is missing the column(s): {', '.join(missing)}")
+
+    roster = OrderedDict()
+    for line_number, row in enumerate(reader, start=2):
+        if None in row:
+            raise RosterError(f"Roster line {line_number} has more cells than the header; quote names with commas")
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if not any(row.values()):
+            continue
+        usn = row['usn'].upper()
+        if not usn or not row['name']:
+            raise RosterError(f"Roster line {line_number} has no USN or name")
+        if usn in roster:
+            raise RosterError(f"Roster line {line_number} repeats USN {usn}")
+        roster[usn] = {'name': row['name'], 'semester': row['semester'], 'section': row['section']}
+    return roster
+
+
+def group_photos(paths):
+    """Group photo paths by the name of the folder holding them: {usn: [path, ...]}."""
+    photos = {}
+    for path in sorted(paths):
+        parts = path.replace('\\', '/').split('/')
+        if len(parts) < 2 or any(part.startswith('.') or part == '__MACOSX' for part in parts):
+            continue
+        if parts[-1].lower().endswith(IMAGE_EXTENSIONS):
+            photos.setdefault(parts[-2].strip().upper(), []).append(path)
+    return photos
+
+
+class DirectoryBatch:
+    """Photos stored on disk as <root>/<USN>/<photo>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def paths(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                yield os.path.relpath(os.path.join(directory, name), self.root)
+
+    def size(self, path):
+        return os.path.getsize(os.path.join(self.root, path))
+
+    def open(self, path):
+        return open(os.path.join(self.root, path), 'rb')
+
+
+class ArchiveBatch:
+    """Photos inside a zip archive as [<top folder>/]<USN>/<photo>."""
+
+    def __init__(self, file):
+        try:
+            self.archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise RosterError("The photo archive is not a valid zip file")
+
+    def paths(self):
+        return (info.filename for info in self.archive.infolist() if not info.is_dir())
+
+    def size(self, path):
+        return self.archive.getinfo(path).file_size
+
+    def open(self, path):
+        return self.archive.open(path)
+
+
+def open_batch(source):
+    """DirectoryBatch for a directory, ArchiveBatch for a zip path or file object."""
+    if isinstance(source, str) and os.path.isdir(source):
+        return DirectoryBatch(source)
+    return ArchiveBatch(source)
+
+
+def estimate_batch_bytes(batch, paths):
+    """Peak pipeline memory for the batch, from file sizes and image headers only."""
+    def sizes():
+        for path in paths:
+            with batch.open(path) as f:
+                header = f.read(HEADER_BYTES)
+            size = batch.size(path)
+            yield size, decoded_bytes(header, size)
+    return estimate_peak_bytes(sizes())
+
+
+def plan_batch(batch, roster):
+    """Match photo folders to roster entries.
+
+    Returns ({usn: [photo paths]} for roster students with photos, report)
+    where the report already lists roster entries without photos and folders
+    missing from the roster.
+    """
+    photos = group_photos(batch.paths())
+    report = {
+        'roster': len(roster),
+        'missing_photos': [usn for usn in roster if usn not in photos],
+        'unknown_folders': sorted(usn for usn in photos if usn not in roster),
+    }
+    return OrderedDict((usn, photos[usn]) for usn in roster if usn in photos), report
+
+
+def enroll_batch(batch, roster, store, dry_run=False, planned=None):
+    """Run every photo of the batch through the pipeline and enroll the students in one transaction.
+
+    `planned` is the output of plan_batch() when the caller already has it.
+    Returns (enrolled students, report). With dry_run the store is untouched.
+    """
+    start = time.perf_counter()
+    photos, report = planned or plan_batch(batch, roster)
+    order = [(usn, path) for usn, paths in photos.items() for path in paths]
+
+    # One stream through the pipeline; photos are read lazily as workers free up
+    result = process_images(batch.open(path) for _, path in order)
+
+    students, no_face, multiple_faces = OrderedDict(), {}, {}
+    position = 0
+    for (usn, path), count in zip(order, result.faces_per_image):
+        encodings = result.encodings[position:position + count]
+        position += count
+        if count == 0:
+            no_face.setdefault(usn, []).append(path)
+        elif count > 1:
+            multiple_faces.setdefault(usn, []).append({'photo': path, 'faces': count})
+        else:
+            student = students.setdefault(usn, dict(roster[usn], usn=usn, encodings=[]))
+            student['encodings'].extend(encodings)
+
+    existed = [] if dry_run else store.upsert_many(list(students.values()))
+
+    report.update({
+        'photos': len(order),
+        'cache_hits': result.cache_hits,
+        'quality': result.quality,
+        'enrolled': len(students) - sum(existed),
+        'updated': sum(existed),
+        'dry_run': dry_run,
+        'not_enrolled': [usn for usn in photos if usn not in students],
+        'no_face': [{'usn': usn, 'name': roster[usn]['name'], 'photos': paths} for usn, paths in no_face.items()],
+        'multiple_faces': [{'usn': usn, 'name': roster[usn]['name'], 'photos': entries}
+                           for usn, entries in multiple_faces.items()],
+        'timings': {stage: round(seconds, 3) for stage, seconds in result.timings.items()},
+        'seconds': round(time.perf_counter() - start, 3),
+    })
+    print(f"Bulk enroll: {len(order)} photos ({result.cache_hits} cached), {len(students)} students "
+          f"{'checked' if dry_run else 'enrolled'} in {report['seconds']:.1f}s, {format_quality(result.quality)} "
+          f"({format_timings(result.timings)})")
+    return list(students.values()), report
+
+
+def print_report(report):
+    """Human-readable summary of a bulk enrollment report."""
+    print(f"{report['enrolled']} new and {report['updated']} updated of {report['roster']} students "
+          f"from {report['photos']} photos{' (dry run, nothing saved)' if report['dry_run'] else ''}")
+    if report['quality'] and report['quality']['rejected']:
+        print(f"Quality gate: {format_quality(report['quality'])}")
+    if report['not_enrolled']:
+        print(f"\nNot enrolled (no usable photo): {', '.join(report['not_enrolled'])}")
+    if report['no_face']:
+        print("\nPhotos with no usable face (none detected, or too small, blurred or turned away):")
+        for entry in report['no_face']:
+            print(f"{entry['name']} ({entry['usn']}): {', '.join(entry['photos'])}")
+    if report['multiple_faces']:
+        print("\nPhotos with more than one face (skipped):")
+        for entry in report['multiple_faces']:
+            photos = ', '.join(f"{photo['photo']} [{photo['faces']}]" for photo in entry['photos'])
+            print(f"{entry['name']} ({entry['usn']}): {photos}")
+    if report['missing_photos']:
+        print(f"\nRoster entries without photos: {', '.join(report['missing_photos'])}")
+    if report['unknown_folders']:
+        print(f"\nPhoto folders not in the roster: {', '.join(report['unknown_folders'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enroll a batch of students from a photo directory or zip archive.')
+    parser.add_argument('photos', help='Directory or zip archive with one folder of photos per USN')
+    parser.add_argument('roster', help='CSV with usn, name, semester and section columns')
+    parser.add_argument('--student-data', default='student_data/')
+    parser.add_argument('--dry-run', action='store_true', help='Detect faces and report without saving')
+    parser.add_argument('--report', help='Also write the report as JSON to this file')
+    args = parser.parse_args()
+
+    from student_store import StudentStore
+    with open(args.roster, newline='', encoding='utf-8-sig') as f:
+        roster = read_roster(f)
+    _, report = enroll_batch(open_batch(args.photos), roster, StudentStore(args.student_data), args.dry_run)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if not args.dry_run:
+        print("\nRestart the app (or enroll through /bulk_enroll) for running workers to see the new students.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,112 @@
+import os
+import json
+import time
 import argparse
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.errors import HttpError
+from drive_admin import connect, execute, SERVICE_ACCOUNT_FILE
+from sheet_registry import SHEET_REGISTRY_DIR, known_sheet_ids
 
-# Set up Google Sheets API credentials and the Spreadsheet ID
-SERVICE_ACCOUNT_FILE = 'credentials.json'  # Path to your service account credentials file
+# Set up Google Sheets API scopes
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
-# Authenticate with Google Sheets API
-def authenticate_google_sheets():
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('sheets', 'v4', credentials=creds)
+# Spreadsheets cleared at once
+CLEAR_WORKERS = int(os.environ.get('CLEAR_WORKERS', 8))
 
-# Function to clear data from all sheets in the spreadsheet
-def clear_all_data(spreadsheet_id):
+
+def whole_tab_range(title):
+    """A1 range covering every cell of a tab: its quoted title on its own."""
+    return "'{}'".format(title.replace("'", "''"))
+
+
+# Function to clear data from all sheets in one spreadsheet with a single batchClear
+def clear_all_data(service, spreadsheet_id, http=None, dry_run=False):
+    start = time.perf_counter()
+    result = {'spreadsheet_id': spreadsheet_id, 'title': None, 'tabs': [], 'status': 'cleared', 'error': None}
     try:
-        # Authenticate with the API
-        service = authenticate_google_sheets()
+        # Only the titles are needed, not the whole spreadsheet resource
+        metadata = execute(service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields='properties.title,sheets.properties.title'),
+            'sheets.spreadsheets.get', http)
+        result['title'] = metadata.get('properties', {}).get('title')
+        result['tabs'] = [sheet['properties']['title'] for sheet in metadata.get('sheets', [])]
 
-        # Get spreadsheet metadata to get all the sheet names
-        spreadsheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+        if dry_run:
+            result['status'] = 'dry_run'
+        elif result['tabs']:
+            execute(service.spreadsheets().values().batchClear(
+                spreadsheetId=spreadsheet_id, body={'ranges': [whole_tab_range(tab) for tab in result['tabs']]}),
+                'sheets.values.batchClear', http)
+    except HttpError as err:
+        result['status'] = 'missing' if err.resp.status == 404 else 'error'
+        result['error'] = str(err)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
 
-        # Extract sheet names (or sheetId) for each sheet in the spreadsheet
-        sheet_names = [sheet['properties']['title'] for sheet in spreadsheet_metadata['sheets']]
 
-        # Clear data from all sheets
-        for sheet in sheet_names:
-            range_to_clear = f'{sheet}!A:Z'  # Clears columns A to Z (you can adjust the range if needed)
-            request = service.spreadsheets().values().clear(
-                spreadsheetId=spreadsheet_id,
-                range=range_to_clear
-            )
-            request.execute()
+# Clear many spreadsheets concurrently through one client, one HTTP connection per thread
+def clear_spreadsheets(service, spreadsheet_ids, http_factory=None, workers=CLEAR_WORKERS, dry_run=False):
+    local = threading.local()
 
-        print(f"All data cleared successfully from the spreadsheet: {spreadsheet_id}")
+    def clear(spreadsheet_id):
+        if http_factory is not None and getattr(local, 'http', None) is None:
+            local.http = http_factory()
+        return clear_all_data(service, spreadsheet_id, getattr(local, 'http', None), dry_run)
+
+    spreadsheet_ids = list(dict.fromkeys(spreadsheet_ids))
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for result in pool.map(clear, spreadsheet_ids):
+            results.append(result)
+            tabs = ', '.join(result['tabs'])
+            if result['status'] in ('cleared', 'dry_run'):
+                verb = 'Would clear' if dry_run else 'Cleared'
+                print(f"[{len(results)}/{len(spreadsheet_ids)}] {verb} {result['title']} ({result['spreadsheet_id']}): {tabs}")
+            else:
+                print(f"[{len(results)}/{len(spreadsheet_ids)}] Error clearing {result['spreadsheet_id']}: {result['error']}")
+    return results
+
+
+def summarize(results, seconds):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'spreadsheets': len(results), 'tabs': sum(len(result['tabs']) for result in results),
+            'seconds': round(seconds, 3), **counts}
 
-    except HttpError as err:
-        print(f"Error clearing data: {err}")
 
 def main():
     # Set up the command-line argument parser
-    parser = argparse.ArgumentParser(description='Clear all data in all sheets of a Google Spreadsheet.')
-    parser.add_argument('spreadsheet_id', help='The ID of the Google Spreadsheet you want to clear data from.')
-
-    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Clear all data in all sheets of one or more Google Spreadsheets.')
+    parser.add_argument('spreadsheet_ids', nargs='*', help='IDs of the Google Spreadsheets to clear')
+    parser.add_argument('--from-registry', action='store_true',
+                        help='Also clear every class spreadsheet in sheet_registry.json and *_sheet_id.txt files')
+    parser.add_argument('--directory', default=SHEET_REGISTRY_DIR,
+                        help='Where sheet_registry.json and *_sheet_id.txt live (default: the current directory)')
+    parser.add_argument('--workers', type=int, default=CLEAR_WORKERS, help='Spreadsheets cleared at once')
+    parser.add_argument('--dry-run', action='store_true', help='List the tabs that would be cleared')
+    parser.add_argument('--credentials', default=SERVICE_ACCOUNT_FILE, help='Service account file')
+    parser.add_argument('--report', help='Also write the per-spreadsheet results as JSON to this file')
     args = parser.parse_args()
 
-    # Call the function to clear data from the provided spreadsheet_id
-    clear_all_data(args.spreadsheet_id)
+    spreadsheet_ids = list(args.spreadsheet_ids)
+    if args.from_registry:
+        spreadsheet_ids += known_sheet_ids(args.directory)
+    if not spreadsheet_ids:
+        parser.error('give spreadsheet IDs or --from-registry')
+    service, http_factory = connect(args.credentials, SCOPES, api='sheets', version='v4')
+
+    start = time.perf_counter()
+    results = clear_spreadsheets(service, spreadsheet_ids, http_factory, args.workers, args.dry_run)
+    summary = summarize(results, time.perf_counter() - start)
+    print(f"\n{summary.get('dry_run' if args.dry_run else 'cleared', 0)} of {summary['spreadsheets']} spreadsheets "
+          f"{'would be cleared' if args.dry_run else 'cleared'} ({summary['tabs']} tabs), "
+          f"{summary.get('missing', 0)} missing, {summary.get('error', 0)} failed in {summary['seconds']:.1f}s")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'summary': summary, 'spreadsheets': results}, f, indent=2)
+
 
 if __name__ == '__main__':
     main()
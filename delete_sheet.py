@@ -1,51 +1,40 @@
-import os
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.oauth2.service_account import Credentials
+import argparse
+from drive_admin import add_arguments, admin_from_args
 
-# Define your service account file path and scopes
-SERVICE_ACCOUNT_FILE = 'credentials.json'  # Path to your service account credentials
-SCOPES = ['https://www.googleapis.com/auth/drive']
-
-# Initialize the Google Drive API client
-def initialize_drive_service():
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('drive', 'v3', credentials=creds)
 
 # Function to list and delete all Google Sheets
-def delete_all_google_sheets():
-    try:
-        # Initialize the Google Drive API
-        service = initialize_drive_service()
-
-        # Query to list all Google Sheets files
-        results = service.files().list(
-            q="mimeType='application/vnd.google-apps.spreadsheet'",  # Query to get only Google Sheets
-            fields="files(id, name)"
-        ).execute()
-
-        # Get the list of Google Sheets files
-        sheets = results.get('files', [])
-
-        if not sheets:
-            print('No Google Sheets found.')
-        else:
-            print(f"Found {len(sheets)} Google Sheets. Deleting...")
-
-            # Iterate through each sheet and delete it
-            for sheet in sheets:
-                sheet_id = sheet['id']
-                sheet_name = sheet['name']
-
-                # Delete the Google Sheet file
-                service.files().delete(fileId=sheet_id).execute()
-                print(f"Deleted: {sheet_name} (ID: {sheet_id})")
-
-            print("All Google Sheets have been deleted.")
-    
-    except HttpError as error:
-        print(f"An error occurred: {error}")
+def delete_all_google_sheets(admin):
+    # Every page of Google Sheets files, not just the first
+    sheets = list(admin.list_files())
+
+    if not sheets:
+        print('No Google Sheets found.')
+        return None
+
+    print(f"Found {len(sheets)} Google Sheets. {'Would delete (dry run)' if admin.dry_run else 'Deleting'}...")
+    report = admin.delete_many(sheets)
+
+    for sheet in report['deleted']:
+        print(f"{'Would delete' if admin.dry_run else 'Deleted'}: {sheet['name']} (ID: {sheet['id']})")
+    for sheet in report['missing']:
+        print(f"Already gone: {sheet['name']} (ID: {sheet['id']})")
+    for sheet in report['failed']:
+        print(f"Failed to delete {sheet['name']} (ID: {sheet['id']}): {sheet['error']}")
+
+    print(f"\n{len(report['deleted'])} {'would be deleted' if admin.dry_run else 'deleted'}, "
+          f"{len(report['missing'])} already gone, {len(report['failed'])} failed "
+          f"in {report['seconds']:.1f}s ({report['requests']} calls in {report['batches']} batch requests, "
+          f"{report['retries']} retried)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete every Google Sheet the service account can see.')
+    add_arguments(parser)
+    args = parser.parse_args()
+    delete_all_google_sheets(admin_from_args(args))
+
 
 # Run the function to delete all Google Sheets
 if __name__ == '__main__':
-    delete_all_google_sheets()
+    main()
@@ -0,0 +1,230 @@
+"""Paged Drive listings and batched per-file calls for the sheet admin scripts."""
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from metrics import google_call
+
+SERVICE_ACCOUNT_FILE = 'credentials.json'  # Path to your service account file
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+SPREADSHEET_QUERY = "mimeType='application/vnd.google-apps.spreadsheet'"
+
+# Calls per batch HTTP request; Drive accepts at most 100
+DRIVE_BATCH_SIZE = min(100, int(os.environ.get('DRIVE_BATCH_SIZE', 100)))
+
+# Batch requests in flight at once
+DRIVE_ADMIN_WORKERS = int(os.environ.get('DRIVE_ADMIN_WORKERS', 4))
+
+# Files per files.list page; Drive returns at most 1000
+DRIVE_PAGE_SIZE = 1000
+
+# Seconds before the first retry of a rate-limited call; doubles on every further failure
+DRIVE_RETRY_BASE = float(os.environ.get('DRIVE_RETRY_BASE', 1))
+
+# Upper bound on one retry delay
+DRIVE_RETRY_MAX = 32
+
+# Retries of one call before its error is reported
+DRIVE_MAX_RETRIES = int(os.environ.get('DRIVE_MAX_RETRIES', 5))
+
+# Statuses worth retrying; 403 only when Drive says it is a rate limit
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """True for rate-limit and transient server errors."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status in RETRY_STATUSES or (status == 403 and 'ratelimitexceeded' in str(error).lower())
+
+
+def is_not_found(error):
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+def connect(service_account_file=SERVICE_ACCOUNT_FILE, scopes=DRIVE_SCOPES, api='drive', version='v3'):
+    """Return (API service, factory of per-thread authorized HTTP connections)."""
+    import httplib2
+    import google_auth_httplib2
+    from googleapiclient.discovery import build
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_file(service_account_file, scopes=scopes)
+    service = build(api, version, credentials=creds, cache_discovery=False)
+    return service, lambda: google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+
+
+def backoff(attempt):
+    """Sleep before retry number `attempt` (from 0) of a rate-limited call."""
+    time.sleep(min(DRIVE_RETRY_MAX, DRIVE_RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+def execute(request, call, http=None, on_retry=None):
+    """Execute one API request, retrying rate-limit and server errors with backoff."""
+    for attempt in range(DRIVE_MAX_RETRIES + 1):
+        try:
+            with google_call(call):
+                return request.execute(http=http)
+        except HttpError as e:
+            if not is_retryable(e) or attempt == DRIVE_MAX_RETRIES:
+                raise
+            if on_retry:
+                on_retry()
+            backoff(attempt)
+
+
+class DriveAdmin:
+    """Paginated listing and batched, concurrent per-file operations on Drive.
+
+    `http_factory` makes one HTTP connection per worker thread (see connect());
+    without it requests use the service's own connection, which is fine for
+    the fakes. With `dry_run` nothing is modified: delete_many() only reports
+    what it would delete. `progress(done, total)` is called as batches finish.
+    """
+
+    def __init__(self, service, http_factory=None, workers=DRIVE_ADMIN_WORKERS, batch_size=DRIVE_BATCH_SIZE,
+                 dry_run=False, progress=None):
+        self.service = service
+        self.http_factory = http_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'retries': 0}
+
+    def _http(self):
+        if self.http_factory is None:
+            return None
+        if getattr(self._local, 'http', None) is None:
+            self._local.http = self.http_factory()
+        return self._local.http
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def _execute(self, request, call):
+        self._count(requests=1)
+        return execute(request, call, self._http(), on_retry=lambda: self._count(requests=1, retries=1))
+
+    def list_files(self, query=SPREADSHEET_QUERY, fields='id, name'):
+        """Yield every file matching `query`, following nextPageToken through all pages."""
+        page_token = None
+        while True:
+            page = self._execute(self.service.files().list(
+                q=query, fields=f'nextPageToken, files({fields})', pageSize=DRIVE_PAGE_SIZE, pageToken=page_token,
+                spaces='drive'), 'drive.files.list')
+            yield from page.get('files', [])
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _run_batch(self, make_request, items):
+        """Send one batch, retrying the whole batch or just its failed calls. Returns {item: (response, error)}."""
+        results = {}
+        pending = list(items)
+        for attempt in range(DRIVE_MAX_RETRIES + 1):
+            replies = {}
+
+            def collect(request_id, response, error):
+                replies[request_id] = (response, error)
+
+            batch = self.service.new_batch_http_request(callback=collect)
+            for index, item in enumerate(pending):
+                batch.add(make_request(item), request_id=str(index))
+            try:
+                with google_call('drive.batch'):
+                    self._count(batches=1, requests=len(pending))
+                    batch.execute(http=self._http())
+            except HttpError as e:
+                if not is_retryable(e) or attempt == DRIVE_MAX_RETRIES:
+                    results.update((item, (None, e)) for item in pending)
+                    return results
+                self._count(retries=len(pending))
+                backoff(attempt)
+                continue
+
+            retry = []
+            for index, item in enumerate(pending):
+                response, error = replies.get(str(index), (None, None))
+                if is_retryable(error) and attempt < DRIVE_MAX_RETRIES:
+                    retry.append(item)
+                else:
+                    results[item] = (response, error)
+            if not retry:
+                return results
+            self._count(retries=len(retry))
+            pending = retry
+            backoff(attempt)
+        return results
+
+    def run_batched(self, make_request, items):
+        """Run make_request(item) for every item in concurrent batches. Returns {item: (response, error)}."""
+        items = list(dict.fromkeys(items))
+        chunks = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            for chunk_results in pool.map(lambda chunk: self._run_batch(make_request, chunk), chunks):
+                results.update(chunk_results)
+                if self.progress:
+                    self.progress(len(results), len(items))
+        return results
+
+    def get_many(self, file_ids, fields='id, name, trashed'):
+        """Look up files by ID. Returns ({id: metadata or None if it does not exist}, {id: error})."""
+        found, errors = {}, {}
+        results = self.run_batched(lambda file_id: self.service.files().get(fileId=file_id, fields=fields), file_ids)
+        for file_id, (response, error) in results.items():
+            if error is None:
+                found[file_id] = response
+            elif is_not_found(error):
+                found[file_id] = None
+            else:
+                errors[file_id] = error
+        return found, errors
+
+    def delete_many(self, files):
+        """Delete files given as {'id', 'name'} dicts. Returns a report; with dry_run nothing is deleted."""
+        start = time.perf_counter()
+        files = {f['id']: f for f in files}
+        report = {'matched': len(files), 'deleted': [], 'missing': [], 'failed': [], 'dry_run': self.dry_run}
+        if self.dry_run:
+            report['deleted'] = list(files.values())
+        else:
+            results = self.run_batched(lambda file_id: self.service.files().delete(fileId=file_id), files)
+            for file_id, (_, error) in results.items():
+                if error is None:
+                    report['deleted'].append(files[file_id])
+                elif is_not_found(error):
+                    report['missing'].append(files[file_id])
+                else:
+                    report['failed'].append(dict(files[file_id], error=str(error)))
+        report.update(self.stats, seconds=round(time.perf_counter() - start, 3))
+        return report
+
+
+def print_progress(done, total):
+    print(f"  {done}/{total} done", flush=True)
+
+
+def add_arguments(parser, dry_run=True):
+    """Command-line options shared by the Drive admin scripts."""
+    parser.add_argument('--workers', type=int, default=DRIVE_ADMIN_WORKERS, help='Batch requests in flight at once')
+    parser.add_argument('--batch-size', type=int, default=DRIVE_BATCH_SIZE, help='Calls per batch request (max 100)')
+    parser.add_argument('--credentials', default=SERVICE_ACCOUNT_FILE, help='Service account file')
+    if dry_run:
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+
+
+def admin_from_args(args):
+    """DriveAdmin configured from the options of add_arguments()."""
+    service, http_factory = connect(args.credentials)
+    return DriveAdmin(service, http_factory, workers=args.workers, batch_size=min(100, args.batch_size),
+                      dry_run=getattr(args, 'dry_run', False), progress=print_progress)
@@ -0,0 +1,133 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from gallery import DESCRIPTOR_SIZE
+
+# Where cached detections and descriptors live, one .npz per distinct image
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR', 'embedding_cache')
+
+# Disk budget for the cache; the least recently used entries are evicted beyond it (0 disables caching)
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get('EMBEDDING_CACHE_MAX_MB', 256))
+
+# Eviction trims the cache down to this fraction of the budget so it does not run on every write
+EVICT_TARGET_RATIO = 0.9
+
+
+def image_digest(data):
+    """SHA-256 of the uploaded image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def config_fingerprint(*settings):
+    """Short hash of everything that changes detections or descriptors for the same image."""
+    return hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """Content-addressed disk cache of face boxes and 128-d descriptors per image.
+
+    Entries are stored under `<directory>/<fingerprint>/<digest>.npz`, where the
+    fingerprint covers the detector and model settings, so changing any of them
+    starts a fresh namespace instead of serving stale descriptors. Entries are
+    written atomically and their mtime tracks last use for LRU eviction.
+    """
+
+    def __init__(self, fingerprint, directory=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.namespace = os.path.join(directory, fingerprint)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.namespace, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._entries())
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, digest):
+        return os.path.join(self.namespace, f'{digest}.npz')
+
+    def _entries(self):
+        """(path, size, mtime) of every entry, across all fingerprints."""
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.npz'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def get(self, digest):
+        """(boxes, descriptors, rejected) for an image digest, or None on a miss.
+
+        boxes is an (n, 4) int array of (left, top, right, bottom), descriptors
+        an (n, DESCRIPTOR_SIZE) float64 array and rejected the {reason: count}
+        of faces the quality gate dropped from the image.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(digest)
+        try:
+            with np.load(path) as entry:
+                boxes, descriptors = entry['boxes'], entry['descriptors']
+                rejected = dict(zip(entry['rejected_reasons'].tolist(), entry['rejected_counts'].tolist()))
+            os.utime(path)  # Mark as recently used for eviction
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return boxes, descriptors, rejected
+
+    def put(self, digest, boxes, descriptors, rejected=None):
+        if not self.enabled:
+            return
+        rejected = rejected or {}
+        path = self._path(digest)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, boxes=np.asarray(boxes, dtype=np.int32).reshape(-1, 4),
+                     descriptors=np.asarray(descriptors, dtype=np.float64).reshape(-1, DESCRIPTOR_SIZE),
+                     rejected_reasons=np.array(list(rejected), dtype='U32'),
+                     rejected_counts=np.array(list(rejected.values()), dtype=np.int64))
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)  # Rewriting an entry only changes the size by the difference
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._bytes += size - replaced
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache is back under its target size."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes * EVICT_TARGET_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'bytes': self._bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,410 @@
+import os
+import time
+import threading
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import dlib
+import numpy as np
+from embedding_cache import EmbeddingCache, config_fingerprint, image_digest
+from image_io import DECODE_MAX_SIDE, decode_image, read_upload, upload_size, estimate_decode_bytes
+from warmup import cpu_share
+
+# Number of worker processes; 1 runs the pipeline inline in the request thread. The default is this
+# server process's share of the CPUs, so the pools of all gunicorn workers together match the machine
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', cpu_share()))
+
+# Longest image side the HOG detector scans; larger uploads are downscaled for detection only (0 disables)
+DETECT_MAX_SIDE = int(os.environ.get('DETECT_MAX_SIDE', 2400))
+
+# Times the detector upsamples the (downscaled) image; each step halves the smallest detectable face
+DETECT_UPSAMPLE = int(os.environ.get('DETECT_UPSAMPLE', 0))
+
+# Faces embedded per ResNet call; larger batches amortize per-call overhead
+DESCRIPTOR_BATCH_SIZE = int(os.environ.get('DESCRIPTOR_BATCH_SIZE', 32))
+
+# Quality gate: faces failing any check are dropped before alignment and the ResNet (0 disables a check).
+# Smallest face side, in pixels of the full-resolution image
+FACE_MIN_SIZE = int(os.environ.get('FACE_MIN_SIZE', 40))
+
+# HOG detector score; dlib keeps detections scoring above 0, so raise this to drop weak ones (posters, bags)
+FACE_MIN_SCORE = float(os.environ.get('FACE_MIN_SCORE', 0))
+
+# Variance of the Laplacian over the face resized to QUALITY_SAMPLE_SIZE; lower is blurrier
+FACE_MIN_SHARPNESS = float(os.environ.get('FACE_MIN_SHARPNESS', 10))
+
+# Head turn estimated from the landmarks: 0 is frontal, 1 a full profile
+FACE_MAX_YAW = float(os.environ.get('FACE_MAX_YAW', 0.8))
+
+# Side of the square the face is resized to before measuring sharpness, so faces of any size compare
+QUALITY_SAMPLE_SIZE = 64
+
+# Reasons a face is rejected, in the order the checks run
+QUALITY_REASONS = ('size', 'score', 'blur', 'pose')
+
+# Grayscale crop around each face handed to the landmark predictor, as a fraction of the face size
+LANDMARK_MARGIN = 0.5
+
+# Aligned chip geometry expected by dlib_face_recognition_resnet_model_v1
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+# dlib model files
+SHAPE_PREDICTOR_PATH = 'shape_predictor_68_face_landmarks.dat'
+FACE_RECOGNIZER_PATH = 'dlib_face_recognition_resnet_model_v1.dat'
+
+# Pipeline stages in the order they run, used to report timings
+STAGES = ('decode', 'detect', 'quality', 'landmarks', 'align', 'descriptor')
+
+FaceModels = namedtuple('FaceModels', ['detector', 'shape_predictor', 'recognizer'])
+PipelineResult = namedtuple('PipelineResult', ['encodings', 'faces_per_image', 'timings', 'cache_hits', 'quality'],
+                            defaults=(None,))
+
+_models = None
+_models_lock = threading.Lock()
+_executor = None
+_cache = None
+
+# Running average of alignment plus descriptor seconds per face, to price rejected faces
+_embed_seconds_per_face = None
+
+
+def _reset_models_lock():
+    # A pool worker forked while a warmup thread held the lock would otherwise deadlock
+    global _models_lock
+    _models_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_models_lock)
+
+
+def load_models():
+    """Load the dlib models once per process.
+
+    Pool workers forked after the models are loaded share them copy-on-write
+    instead of reading the .dat files again.
+    """
+    global _models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                _models = FaceModels(dlib.get_frontal_face_detector(),
+                                     dlib.shape_predictor(SHAPE_PREDICTOR_PATH),
+                                     dlib.face_recognition_model_v1(FACE_RECOGNIZER_PATH))
+    return _models
+
+
+def detect_faces(detector, img, max_side=DETECT_MAX_SIDE, upsample=DETECT_UPSAMPLE, scores=False):
+    """Detect faces on a downscaled grayscale copy of the image and map them back to full resolution.
+
+    `img` is BGR or grayscale. Landmarks and descriptors are then computed on
+    the full-resolution image, so small back-row faces keep all their detail.
+    With `scores` the detector confidence of each face is returned as well,
+    as (faces, scores).
+    """
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0:
+        scale = 1.0
+        small = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    else:
+        # Downscale before converting, so no full-resolution grayscale copy is made
+        small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    if scores:
+        found, confidences, _ = detector.run(small, upsample, 0.0)
+    else:
+        found, confidences = detector(small, upsample), None
+    if scale < 1.0:
+        found = [dlib.rectangle(int(face.left() / scale), int(face.top() / scale),
+                                int(face.right() / scale), int(face.bottom() / scale)) for face in found]
+    return (list(found), list(confidences)) if scores else list(found)
+
+
+def sharpness(img, face, size=QUALITY_SAMPLE_SIZE):
+    """Variance of the Laplacian over the face, resized to size x size grayscale."""
+    height, width = img.shape[:2]
+    crop = img[max(face.top(), 0):min(face.bottom() + 1, height), max(face.left(), 0):min(face.right() + 1, width)]
+    if crop.size == 0:
+        return 0.0
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    crop = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+
+def estimate_yaw(shape):
+    """Head turn from 68-point landmarks: 0 when the nose tip sits midway between the outer eye corners, 1 at either."""
+    left, right, nose = shape.part(36).x, shape.part(45).x, shape.part(30).x
+    if right <= left:
+        return 1.0
+    return min(abs(2 * (nose - left) / (right - left) - 1), 1.0)
+
+
+def screen_face(img, face, score):
+    """Reason a detected face fails the checks that need no landmarks, or None if it passes."""
+    if FACE_MIN_SIZE and min(face.width(), face.height()) < FACE_MIN_SIZE:
+        return 'size'
+    if score < FACE_MIN_SCORE:
+        return 'score'
+    if FACE_MIN_SHARPNESS and sharpness(img, face) < FACE_MIN_SHARPNESS:
+        return 'blur'
+    return None
+
+
+def face_landmarks(predictor, img, face, margin=LANDMARK_MARGIN):
+    """68-point landmarks of one face, predicted on a grayscale crop around it.
+
+    The crop covers every pixel the predictor samples, so the result matches
+    running it on a full-frame grayscale copy without allocating one.
+    """
+    height, width = img.shape[:2]
+    pad_x, pad_y = int(face.width() * margin), int(face.height() * margin)
+    x0, y0 = max(face.left() - pad_x, 0), max(face.top() - pad_y, 0)
+    x1, y1 = min(face.right() + pad_x + 1, width), min(face.bottom() + pad_y + 1, height)
+    crop = img[y0:y1, x0:x1]
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    shape = predictor(crop, dlib.rectangle(face.left() - x0, face.top() - y0, face.right() - x0, face.bottom() - y0))
+    return dlib.full_object_detection(face, dlib.points([dlib.point(p.x + x0, p.y + y0) for p in shape.parts()]))
+
+
+def extract_chips(data):
+    """Decode one uploaded image and cut an aligned face chip for every face in it.
+
+    The chips are exactly what compute_face_descriptor(img, shape) would feed
+    the ResNet, so descriptors computed from them in batches are unchanged.
+    Faces failing the quality gate are dropped before alignment. Returns
+    (chips, boxes, timings, rejected) where boxes are the (left, top, right,
+    bottom) rectangles of the kept faces, timings maps each stage to seconds
+    spent and rejected counts dropped faces by reason.
+    """
+    models = load_models()
+    timings = dict.fromkeys(STAGES, 0.0)
+    rejected = dict.fromkeys(QUALITY_REASONS, 0)
+
+    start = time.perf_counter()
+    img = decode_image(data)
+    del data  # Only the decoded image is needed from here on
+    if img is None:
+        return [], [], timings, rejected  # Not an image we can decode
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    faces, scores = detect_faces(models.detector, img, scores=True)
+    timings['detect'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kept = []
+    for face, score in zip(faces, scores):
+        reason = screen_face(img, face, score)
+        if reason:
+            rejected[reason] += 1
+        else:
+            kept.append(face)
+    timings['quality'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shapes = dlib.full_object_detections()
+    faces = []
+    for face in kept:
+        shape = face_landmarks(models.shape_predictor, img, face)
+        if FACE_MAX_YAW and estimate_yaw(shape) > FACE_MAX_YAW:
+            rejected['pose'] += 1
+        else:
+            shapes.append(shape)
+            faces.append(face)
+    timings['landmarks'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chips = dlib.get_face_chips(img, shapes, size=CHIP_SIZE, padding=CHIP_PADDING) if len(shapes) else []
+    timings['align'] = time.perf_counter() - start
+    boxes = [(face.left(), face.top(), face.right(), face.bottom()) for face in faces]
+    return list(chips), boxes, timings, rejected
+
+
+def embed_chips(chips):
+    """Run the ResNet over a batch of aligned face chips in one call.
+
+    Returns (descriptors, seconds).
+    """
+    models = load_models()
+    start = time.perf_counter()
+    descriptors = [np.array(d) for d in models.recognizer.compute_face_descriptor(chips)]
+    return descriptors, time.perf_counter() - start
+
+
+def get_embedding_cache():
+    """Per-process cache of detections and descriptors, namespaced by the pipeline settings."""
+    global _cache
+    if _cache is None:
+        models = [(os.path.basename(path), os.path.getsize(path) if os.path.exists(path) else None)
+                  for path in (SHAPE_PREDICTOR_PATH, FACE_RECOGNIZER_PATH)]
+        _cache = EmbeddingCache(config_fingerprint(DECODE_MAX_SIDE, DETECT_MAX_SIDE, DETECT_UPSAMPLE,
+                                                  CHIP_SIZE, CHIP_PADDING, models, FACE_MIN_SIZE, FACE_MIN_SCORE,
+                                                  FACE_MIN_SHARPNESS, FACE_MAX_YAW))
+    return _cache
+
+
+def _get_executor():
+    """Create the worker pool on first use; each worker loads the models once."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PIPELINE_WORKERS, initializer=load_models)
+    return _executor
+
+
+def _map(func, items):
+    """Run func over items in the worker pool, or inline when there is nothing to gain."""
+    if PIPELINE_WORKERS <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    return list(_get_executor().map(func, items))
+
+
+def _imap(func, items):
+    """Yield func(item) in order, pulling items lazily with at most PIPELINE_WORKERS in flight.
+
+    Unlike Executor.map, the next upload is not read until a worker is free,
+    so only a window of images is held in memory at a time.
+    """
+    if PIPELINE_WORKERS <= 1:
+        for item in items:
+            yield func(item)
+        return
+    executor = _get_executor()
+    window = deque()
+    for item in items:
+        window.append(executor.submit(func, item))
+        del item
+        if len(window) >= PIPELINE_WORKERS:
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+def estimate_request_bytes(files):
+    """Peak memory the pipeline needs for a set of uploads, from their sizes and image headers.
+
+    Images stream through a window of PIPELINE_WORKERS (plus the one being
+    read), each holding its raw bytes, a copy on its way to the worker, and
+    the decoded bitmap with its downscaled detection copy.
+    """
+    return estimate_peak_bytes((upload_size(file), estimate_decode_bytes(file)) for file in files)
+
+
+def estimate_peak_bytes(sizes):
+    """Peak pipeline memory for images given as (encoded bytes, decoded bitmap bytes) pairs."""
+    per_image = [2 * encoded + int(1.25 * decoded) for encoded, decoded in sizes]
+    window = min(len(per_image), max(PIPELINE_WORKERS, 1) + 1)
+    return sum(sorted(per_image, reverse=True)[:window])
+
+
+def process_images(images, use_cache=True):
+    """Run detection, landmarking and embedding over all uploaded images concurrently.
+
+    `images` is an iterable of encoded image bytes or file objects (such as
+    Flask uploads), read one at a time as workers free up and closed right
+    after. Images seen before (by content hash) are answered from the
+    embedding cache and skip dlib entirely; the same photo uploaded twice in
+    one request is processed once. Chips from the remaining images are
+    collected first and then embedded in batches of DESCRIPTOR_BATCH_SIZE.
+    Returns a PipelineResult with the merged encodings, the face count of each
+    image, per-stage timings (summed CPU seconds per stage plus the wall-clock
+    'total'), the number of cache hits and the quality gate report (see
+    quality_report()). Faces rejected by the gate are neither embedded nor
+    returned.
+    """
+    start = time.perf_counter()
+    timings = dict.fromkeys(STAGES, 0.0)
+    cache = get_embedding_cache() if use_cache else None
+
+    digests, results, pending = [], {}, []
+    cache_hits = 0
+    rejected = dict.fromkeys(QUALITY_REASONS, 0)
+
+    def misses():
+        """Read uploads lazily, yielding only those that need the dlib pipeline."""
+        nonlocal cache_hits
+        for source in images:
+            data = read_upload(source)
+            digest = image_digest(data)
+            digests.append(digest)
+            if digest in results or digest in pending:
+                continue
+            cached = cache.get(digest) if cache is not None else None
+            if cached is not None:
+                results[digest] = list(cached[1])
+                for reason, count in cached[2].items():
+                    rejected[reason] = rejected.get(reason, 0) + count
+                cache_hits += 1
+                continue
+            pending.append(digest)
+            yield data
+            del data
+
+    chips, counts, boxes, image_rejections = [], [], [], []
+    for image_chips, image_boxes, image_timings, image_rejected in _imap(extract_chips, misses()):
+        chips.extend(image_chips)
+        counts.append(len(image_chips))
+        boxes.append(image_boxes)
+        image_rejections.append(image_rejected)
+        for stage, seconds in image_timings.items():
+            timings[stage] += seconds
+        for reason, count in image_rejected.items():
+            rejected[reason] += count
+
+    descriptors = []
+    batches = [chips[i:i + DESCRIPTOR_BATCH_SIZE] for i in range(0, len(chips), DESCRIPTOR_BATCH_SIZE)]
+    del chips
+    for batch_descriptors, seconds in _map(embed_chips, batches):
+        descriptors.extend(batch_descriptors)
+        timings['descriptor'] += seconds
+
+    # Split the batched descriptors back per image and remember them for the next upload
+    position = 0
+    for digest, count, image_boxes, image_rejected in zip(pending, counts, boxes, image_rejections):
+        results[digest] = descriptors[position:position + count]
+        position += count
+        if cache is not None:
+            cache.put(digest, image_boxes, results[digest], image_rejected)
+
+    encodings, faces_per_image = [], []
+    for digest in digests:
+        encodings.extend(results[digest])
+        faces_per_image.append(len(results[digest]))
+
+    timings['total'] = time.perf_counter() - start
+    return PipelineResult(encodings, faces_per_image, timings, cache_hits,
+                          quality_report(rejected, len(descriptors), timings['align'] + timings['descriptor']))
+
+
+def quality_report(rejected, embedded, embed_seconds):
+    """Faces dropped by the quality gate and the alignment and descriptor time they would have cost.
+
+    The per-face cost comes from the faces embedded in this call, or from
+    earlier calls when none were.
+    """
+    global _embed_seconds_per_face
+    if embedded:
+        per_face = embed_seconds / embedded
+        _embed_seconds_per_face = per_face if _embed_seconds_per_face is None else \
+            0.8 * _embed_seconds_per_face + 0.2 * per_face
+    total = sum(rejected.values())
+    return {'embedded': embedded, 'rejected': total, 'reasons': rejected,
+            'saved_seconds': total * (_embed_seconds_per_face or 0.0)}
+
+
+def format_timings(timings):
+    """One-line summary of stage timings in milliseconds, for the server log."""
+    return ', '.join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+
+
+def format_quality(quality):
+    """One-line summary of a quality report, for the server log."""
+    if not quality or not quality['rejected']:
+        return 'no faces rejected'
+    reasons = ', '.join(f"{reason}={count}" for reason, count in quality['reasons'].items() if count)
+    return f"{quality['rejected']} faces rejected ({reasons}), ~{quality['saved_seconds'] * 1000:.0f}ms saved"
@@ -0,0 +1,638 @@
+import os
+import json
+import bisect
+import shutil
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the in-process lock still applies
+    fcntl = None
+
+# Size of the descriptor produced by dlib's ResNet face recognition model
+DESCRIPTOR_SIZE = 128
+
+# Distance below which two descriptors are considered the same person
+MATCH_TOLERANCE = 0.6
+
+# How the gallery holds descriptors in memory: 'float32', 'float16' (half the memory)
+# or 'pq' (product-quantized to PQ_SUBSPACES bytes per descriptor, see ann_index.py)
+GALLERY_DTYPE = os.environ.get('GALLERY_DTYPE', 'float32')
+
+# Most descriptors kept per student; beyond it the most representative ones are kept (0 keeps all)
+GALLERY_MAX_ENCODINGS = int(os.environ.get('GALLERY_MAX_ENCODINGS', 0))
+
+# Screen faces against per-student centroid and medoid summaries first and
+# re-check only the closest students' full descriptors
+GALLERY_TWO_STAGE = os.environ.get('GALLERY_TWO_STAGE', '0') == '1'
+
+# Students per face whose full descriptors are re-checked by the two-stage matcher
+SCREEN_CANDIDATES = int(os.environ.get('SCREEN_CANDIDATES', 8))
+
+# Serve the gallery from memory-mapped files under student_data/gallery/ that every server
+# process shares, instead of a private copy per process
+SHARED_GALLERY = os.environ.get('SHARED_GALLERY', '1') == '1'
+
+# Published gallery generations kept on disk; older ones are removed once superseded
+GALLERY_KEEP_GENERATIONS = 2
+
+# Immutable view of the gallery; readers grab one and never see a half-built state.
+# Students are sorted by partition, so a partition is a slice of students, and student i
+# owns rows row_starts[i]:row_starts[i + 1] of the descriptor matrix and summary rows 2i
+# (centroid) and 2i + 1 (medoid).
+GallerySnapshot = namedtuple('GallerySnapshot', ['students', 'index', 'descriptors', 'sq_norms', 'owners',
+                                                 'row_starts', 'partitions', 'summaries', 'radii', 'codec'])
+
+
+@contextmanager
+def _file_lock(directory):
+    """Serialize gallery publishing across processes; a no-op for an in-process gallery."""
+    if directory is None or fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, 'LOCK'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _current_generation(directory):
+    try:
+        with open(os.path.join(directory, 'CURRENT'), 'r') as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+def pairwise_distances(queries, gallery, gallery_sq_norms=None):
+    """Euclidean distances between every query row and every gallery row."""
+    if gallery_sq_norms is None:
+        gallery_sq_norms = np.einsum('ij,ij->i', gallery, gallery)
+    query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+    sq = query_sq_norms[:, None] + gallery_sq_norms[None, :] - 2.0 * (queries @ gallery.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def as_descriptor_matrix(encodings):
+    """Stack a list of 128-d encodings into a contiguous float32 matrix."""
+    if len(encodings) == 0:
+        return np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+    return np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE))
+
+
+def summarize_encodings(matrix):
+    """Centroid, medoid and radius (largest distance from the centroid) of one student's descriptors."""
+    if len(matrix) == 0:
+        # Never a candidate: the radius makes the screening lower bound infinite
+        return np.zeros(DESCRIPTOR_SIZE, dtype=np.float32), np.zeros(DESCRIPTOR_SIZE, dtype=np.float32), -np.inf
+    centroid = matrix.mean(axis=0)
+    medoid = matrix[pairwise_distances(matrix, matrix).sum(axis=1).argmin()]
+    radius = float(np.sqrt(((matrix - centroid) ** 2).sum(axis=1).max()))
+    return centroid, medoid, radius
+
+
+def compact_encodings(matrix, max_count=GALLERY_MAX_ENCODINGS):
+    """Keep at most max_count descriptors: the medoid, then the ones farthest from those already kept.
+
+    Farthest-point selection keeps the spread of poses and lighting that
+    matching relies on and drops near-duplicates.
+    """
+    if max_count <= 0 or len(matrix) <= max_count:
+        return matrix
+    dists = pairwise_distances(matrix, matrix)
+    keep = [int(dists.sum(axis=1).argmin())]
+    closest = dists[keep[0]].copy()
+    while len(keep) < max_count:
+        keep.append(int(closest.argmax()))
+        np.minimum(closest, dists[keep[-1]], out=closest)
+    return matrix[sorted(keep)]
+
+
+class FloatCodec:
+    """Descriptors held as plain float32 or float16 rows."""
+
+    trained = True
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+
+    def fit(self, matrix):
+        return self
+
+    def encode(self, matrix):
+        return np.ascontiguousarray(matrix, dtype=self.dtype)
+
+    def decode(self, stored):
+        return np.asarray(stored, dtype=np.float32)
+
+    def sq_norms(self, stored):
+        decoded = self.decode(stored)
+        return np.einsum('ij,ij->i', decoded, decoded)
+
+    def distances(self, queries, stored, sq_norms):
+        return pairwise_distances(queries, self.decode(stored), sq_norms)
+
+
+def make_codec(kind=GALLERY_DTYPE):
+    """Codec for a GALLERY_DTYPE value."""
+    if kind in ('float32', 'float16'):
+        return FloatCodec(kind)
+    if kind == 'pq':
+        from ann_index import ProductQuantizer  # Imported here because ann_index imports this module
+        return ProductQuantizer()
+    raise ValueError(f"Unknown gallery dtype {kind!r}; use float32, float16 or pq")
+
+
+def codec_state(codec):
+    """(kind, arrays) that describe a trained codec, for saving a snapshot."""
+    if isinstance(codec, FloatCodec):
+        return codec.dtype.name, {}
+    return 'pq', {'codebooks': codec.codebooks} if codec.trained else {}
+
+
+def codec_from_state(kind, arrays):
+    """Rebuild a codec saved with codec_state()."""
+    if kind != 'pq' or 'codebooks' not in arrays:
+        return make_codec(kind)
+    from ann_index import ProductQuantizer
+    codebooks = arrays['codebooks']
+    codec = ProductQuantizer(subspaces=codebooks.shape[0], centroids=codebooks.shape[1])
+    codec.codebooks = codebooks
+    return codec
+
+
+def partition_table(students):
+    """{(semester, section): slice of students} for students sorted by partition."""
+    partitions = {}
+    for index, student in enumerate(students):
+        key = (str(student['semester']), str(student['section']))
+        begin = partitions[key].start if key in partitions else index
+        partitions[key] = slice(begin, index + 1)
+    return partitions
+
+
+def gather_rows(old, new, rows):
+    """Rows of old stacked on new, taken in `rows` order with one slice copy per run of consecutive rows."""
+    out = np.empty((len(rows),) + old.shape[1:], dtype=old.dtype)
+    breaks = np.nonzero((np.diff(rows) != 1) | (rows[1:] == len(old)))[0] + 1
+    for begin, end in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(rows)]])):
+        first = rows[begin]
+        source = old if first < len(old) else new
+        offset = 0 if first < len(old) else len(old)
+        out[begin:end] = source[first - offset:first - offset + end - begin]
+    return out
+
+
+class FaceGallery:
+    """In-memory face gallery partitioned by (semester, section).
+
+    All enrolled descriptors live in one contiguous matrix whose rows are
+    grouped by partition, so matching a class is a single slice and one batched
+    distance computation. The matrix is held in the codec's form (float32,
+    float16 or PQ codes). Every student also keeps a float32 centroid and
+    medoid, which the two-stage matcher screens against before touching the
+    full descriptors.
+
+    With a `directory` the gallery is shared between server processes: every
+    change is published there as a new generation of .npy files, which all
+    processes map read-only (see SHARED_GALLERY), so the descriptors sit once
+    in the page cache however many workers there are.
+    """
+
+    def __init__(self, students=(), codec=None, max_encodings=GALLERY_MAX_ENCODINGS, two_stage=GALLERY_TWO_STAGE,
+                 directory=None):
+        self._lock = threading.Lock()
+        self._attach_lock = threading.Lock()
+        self.codec = codec or make_codec()
+        self.max_encodings = max_encodings
+        self.two_stage = two_stage
+        self.directory = directory
+        self.version = 0
+        self._generation = 0
+        self._listeners = []
+        self._attached = None
+        self._settings = {'codec': codec_state(self.codec)[0], 'max_encodings': max_encodings}
+        self._published_settings = None
+        self._snapshot = self._build({})
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        students = list(students)
+        if students:
+            with self._lock:
+                self._load(students, replace=directory is not None)
+
+    @classmethod
+    def open_shared(cls, directory, load_students, version=0, **options):
+        """Attach to the gallery published in `directory`, publishing one first if needed.
+
+        `load_students()` is only called when there is no published generation
+        or it was built from an older `version` of the student store or with
+        other settings.
+        """
+        gallery = cls(directory=directory, **options)
+        gallery._refresh()
+        if not gallery._is_current(version):
+            with gallery._lock:
+                gallery._load(load_students, replace=True, version=version)
+        return gallery
+
+    def _is_current(self, version):
+        return self._attached is not None and self.version >= version and self._published_settings == self._settings
+
+    def _prepare(self, student):
+        """Compact, summarize and encode one student's descriptors into a gallery record."""
+        matrix = compact_encodings(as_descriptor_matrix(student['encodings']), self.max_encodings)
+        record = {key: student[key] for key in ('name', 'usn', 'semester', 'section')}
+        record['centroid'], record['medoid'], record['radius'] = summarize_encodings(matrix)
+        record['block'] = self.codec.encode(matrix)
+        return record
+
+    def _records(self, snapshot):
+        """Gallery records of a snapshot, as views of its matrices."""
+        return {student['usn']: dict(student, centroid=snapshot.summaries[2 * i], medoid=snapshot.summaries[2 * i + 1],
+                                     radius=float(snapshot.radii[i]),
+                                     block=snapshot.descriptors[snapshot.row_starts[i]:snapshot.row_starts[i + 1]])
+                for i, student in enumerate(snapshot.students)}
+
+    def _load(self, students, replace=False, version=0):
+        """Add students to (or with replace, substitute them for) the gallery and publish it; call with the lock held.
+
+        `students` may be a callable returning them, so a shared gallery that
+        another process has just brought up to date skips loading them.
+        """
+        with _file_lock(self.directory):
+            self._refresh()  # Build on whatever other processes published meanwhile
+            if replace and callable(students) and self._is_current(version):
+                return
+            students = list(students() if callable(students) else students)
+            if replace:
+                if not isinstance(self.codec, FloatCodec) or codec_state(self.codec)[0] != self._settings['codec']:
+                    self.codec = make_codec(self._settings['codec'])  # A PQ codebook is retrained on the new descriptors
+            if not self.codec.trained:
+                training = as_descriptor_matrix([e for s in students for e in as_descriptor_matrix(s['encodings'])])
+                if len(training):
+                    self.codec.fit(training)
+            records = {student['usn']: self._prepare(student) for student in students}
+            changed = None if replace else {usn: self.codec.decode(record['block']) for usn, record in records.items()}
+            if replace or not len(self._snapshot.students) or self._snapshot.codec is not self.codec:
+                if not replace:
+                    records = dict(self._records(self._snapshot), **records)
+                snapshot = self._build(records)
+            else:
+                snapshot = self._splice(self._snapshot, records)
+            del records
+            if self.directory is None:
+                self._snapshot = snapshot
+                self._generation += 1
+            else:
+                self._publish(snapshot, max(self.version, version))
+            for listener in self._listeners:
+                listener(self._generation, changed)
+
+    def on_change(self, listener):
+        """Call listener(generation, students) after each change this process makes, before another can follow.
+
+        `students` maps the USN of every added or replaced student to the rows
+        now stored for it, as float32; it is None after a reload, which replaced
+        everything. Generations count up by one per change, across processes
+        for a shared gallery.
+        """
+        self._listeners.append(listener)
+
+    @contextmanager
+    def locked(self):
+        """Hold off changes from this and (for a shared gallery) every other process."""
+        with self._lock, _file_lock(self.directory):
+            self._refresh()
+            yield self
+
+    def _build(self, records):
+        """Build the descriptor matrix, summaries and partition table from gallery records."""
+        records = sorted(records.values(), key=lambda s: (str(s['semester']), str(s['section']), s['usn']))
+        students = [{key: record[key] for key in ('name', 'usn', 'semester', 'section')} for record in records]
+        row_starts = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum([len(record['block']) for record in records], out=row_starts[1:])
+        if records:
+            descriptors = np.ascontiguousarray(np.concatenate([record['block'] for record in records]))
+            summaries = as_descriptor_matrix([row for s in records for row in (s['centroid'], s['medoid'])])
+        else:
+            descriptors = self.codec.encode(as_descriptor_matrix([]))
+            summaries = as_descriptor_matrix([])
+        owners = np.repeat(np.arange(len(records), dtype=np.int32), np.diff(row_starts))
+        radii = np.array([s['radius'] for s in records], dtype=np.float32)
+        return self._snapshot_of(students, descriptors, self.codec.sq_norms(descriptors), owners, row_starts,
+                                 summaries, radii, self.codec)
+
+    def _splice(self, snapshot, records):
+        """Snapshot with some students added or replaced, built from the old one with array copies.
+
+        Unlike _build() nothing is done per existing student: their rows are
+        moved by one gather per matrix, and the new students are slotted into
+        the sort order with a binary search inside their partition.
+        """
+        if not records:
+            return snapshot
+        count = len(snapshot.students)
+        added = sorted(records.values(), key=lambda s: (str(s['semester']), str(s['section']), s['usn']))
+        replaced = [snapshot.index[record['usn']] for record in added if record['usn'] in snapshot.index]
+        kept = np.delete(np.arange(count), replaced)
+
+        # Position of every new student among the old ones, then among the kept ones
+        partitions = sorted(snapshot.partitions.items())
+        positions = []
+        for record in added:
+            key = (str(record['semester']), str(record['section']))
+            students = snapshot.partitions.get(key)
+            if students is None:
+                positions.append(next((s.start for k, s in partitions if k > key), count))
+            else:
+                usns = [student['usn'] for student in snapshot.students[students]]
+                positions.append(students.start + bisect.bisect_left(usns, record['usn']))
+        order = np.insert(kept, np.searchsorted(kept, positions), count + np.arange(len(added)))
+
+        # Old and new rows side by side, then gathered into the new order
+        lengths = np.concatenate([np.diff(snapshot.row_starts), [len(record['block']) for record in added]])
+        starts = np.concatenate([snapshot.row_starts[:-1], snapshot.row_starts[-1] + np.cumsum(lengths[count:]) -
+                                 lengths[count:]]).astype(np.int64)
+        lengths = lengths[order].astype(np.int64)
+        row_starts = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=row_starts[1:])
+        rows = np.arange(row_starts[-1]) + np.repeat(starts[order] - row_starts[:-1], lengths)
+
+        blocks = [record['block'] for record in added]
+        descriptors = gather_rows(snapshot.descriptors, np.concatenate(blocks), rows)
+        sq_norms = gather_rows(snapshot.sq_norms, np.concatenate([self.codec.sq_norms(block) for block in blocks]), rows)
+        new_summaries = as_descriptor_matrix([row for s in added for row in (s['centroid'], s['medoid'])])
+        summaries = np.concatenate([snapshot.summaries, new_summaries]).reshape(-1, 2, DESCRIPTOR_SIZE)[order]
+        radii = np.concatenate([snapshot.radii, np.array([s['radius'] for s in added], dtype=np.float32)])[order]
+        new_students = [{key: record[key] for key in ('name', 'usn', 'semester', 'section')} for record in added]
+        students = [snapshot.students[i] if i < count else new_students[i - count] for i in order.tolist()]
+        owners = np.repeat(np.arange(len(order), dtype=np.int32), lengths)
+
+        # Partition slices from the old ones' sizes, without walking the students
+        sizes = {key: students.stop - students.start for key, students in partitions}
+        for i in replaced:
+            sizes[(str(snapshot.students[i]['semester']), str(snapshot.students[i]['section']))] -= 1
+        for record in added:
+            key = (str(record['semester']), str(record['section']))
+            sizes[key] = sizes.get(key, 0) + 1
+        new_partitions, begin = {}, 0
+        for key in sorted(sizes):
+            if sizes[key]:
+                new_partitions[key] = slice(begin, begin + sizes[key])
+                begin += sizes[key]
+        return self._snapshot_of(students, descriptors, sq_norms, owners, row_starts,
+                                 np.ascontiguousarray(summaries.reshape(-1, DESCRIPTOR_SIZE)), radii, self.codec,
+                                 new_partitions)
+
+    @staticmethod
+    def _snapshot_of(students, descriptors, sq_norms, owners, row_starts, summaries, radii, codec, partitions=None):
+        return GallerySnapshot(students, {student['usn']: i for i, student in enumerate(students)}, descriptors,
+                               sq_norms, owners, row_starts, partitions or partition_table(students), summaries,
+                               radii, codec)
+
+    def _publish(self, snapshot, version):
+        """Write a snapshot as the next generation and switch every process to it. Caller holds the file lock."""
+        generation = _current_generation(self.directory) + 1
+        path = os.path.join(self.directory, f'gen-{generation}')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        kind, codec_arrays = codec_state(snapshot.codec)
+        arrays = dict(descriptors=snapshot.descriptors, owners=snapshot.owners, row_starts=snapshot.row_starts,
+                      summaries=snapshot.summaries, radii=snapshot.radii, **codec_arrays)
+        if isinstance(snapshot.codec, FloatCodec):
+            arrays['sq_norms'] = snapshot.sq_norms
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+        meta = {'generation': generation, 'version': version, 'settings': self._settings,
+                'students': [[s['usn'], s['name'], str(s['semester']), str(s['section'])] for s in snapshot.students]}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            f.write(json.dumps(meta, separators=(',', ':')))  # One C-encoded string; json.dump streams in Python
+        os.replace(tmp_path, path)
+
+        # Swap the generation number atomically; readers notice the new file on their next call
+        current_tmp = os.path.join(self.directory, f'CURRENT.{os.getpid()}.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(str(generation))
+        os.replace(current_tmp, os.path.join(self.directory, 'CURRENT'))
+
+        # Processes still matching against an old generation keep their mapping after the files are removed.
+        # Leftover .tmp files are from publishers that died mid-write, since the file lock is held.
+        for name in os.listdir(self.directory):
+            stale = os.path.join(self.directory, name)
+            if name.startswith('CURRENT.') and name.endswith('.tmp'):
+                os.remove(stale)
+            elif name.startswith('gen-') and (name.endswith('.tmp') or
+                                              int(name[4:]) <= generation - GALLERY_KEEP_GENERATIONS):
+                shutil.rmtree(stale, ignore_errors=True)
+
+        # Map what was just written, reusing the student list and tables instead of reading them back
+        with self._attach_lock:
+            stat = os.stat(os.path.join(self.directory, 'CURRENT'))
+            self._attach(path, snapshot)
+            self._attached = (stat.st_ino, stat.st_mtime_ns)
+
+    def _refresh(self):
+        """Map the newest published generation if it changed since the last call. Cheap when it has not."""
+        if self.directory is None:
+            return
+        current = os.path.join(self.directory, 'CURRENT')
+        for _ in range(3):
+            try:
+                stat = os.stat(current)
+                if (stat.st_ino, stat.st_mtime_ns) == self._attached:
+                    return
+                with self._attach_lock:
+                    with open(current, 'r') as f:
+                        generation = int(f.read())
+                    self._attach(os.path.join(self.directory, f'gen-{generation}'))
+                    self._attached = (stat.st_ino, stat.st_mtime_ns)
+                return
+            except FileNotFoundError:
+                if not os.path.exists(current):
+                    return  # Nothing published yet
+                # The generation was replaced while being read; try the newer one
+
+    def _attach(self, path, published=None):
+        """Memory-map one published generation and make it the current snapshot.
+
+        `published` is the snapshot this process has just written there, whose
+        student list, index and partition table can be kept as they are.
+        """
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                  for name in os.listdir(path) if name.endswith('.npy')}
+        codec = published.codec if published is not None else codec_from_state(meta['settings']['codec'], arrays)
+        descriptors = arrays['descriptors']
+        sq_norms = arrays['sq_norms'] if 'sq_norms' in arrays else codec.sq_norms(descriptors)
+        if published is not None:
+            self._snapshot = published._replace(descriptors=descriptors, sq_norms=sq_norms, owners=arrays['owners'],
+                                                row_starts=arrays['row_starts'], summaries=arrays['summaries'],
+                                                radii=arrays['radii'])
+        else:
+            students = [{'usn': usn, 'name': name, 'semester': semester, 'section': section}
+                        for usn, name, semester, section in meta['students']]
+            self._snapshot = self._snapshot_of(students, descriptors, sq_norms, arrays['owners'],
+                                               arrays['row_starts'], arrays['summaries'], arrays['radii'], codec)
+        self.codec = codec
+        self.version = meta['version']
+        self._generation = meta['generation']
+        self._published_settings = meta['settings']
+
+    @property
+    def snapshot(self):
+        self._refresh()
+        return self._snapshot
+
+    @property
+    def generation(self):
+        """Number of changes made to the gallery so far; see on_change()."""
+        self._refresh()
+        return self._generation
+
+    def __len__(self):
+        return len(self.snapshot.students)
+
+    def reload(self, students, version=0):
+        """Replace the whole gallery, e.g. after the student file changed on disk.
+
+        A PQ codebook is retrained on the new descriptors.
+        """
+        with self._lock:
+            self._load(students, replace=True, version=version)
+
+    def upsert(self, student, version=0):
+        """Add or replace one student and publish the updated gallery."""
+        self.upsert_many([student], version)
+
+    def upsert_many(self, students, version=0):
+        """Add or replace a batch of students in one pass over the gallery.
+
+        Existing students' rows are copied across as they are, so the cost is
+        a few array copies rather than re-preparing every student.
+
+        `version` is the student store version that includes them; a shared
+        gallery records it so a restart can tell whether it is up to date.
+        """
+        with self._lock:
+            self._load(students, version=version)
+
+    def lookup(self, usn):
+        """Return the enrolled name, usn, semester and section for a USN, or None."""
+        snapshot = self.snapshot
+        index = snapshot.index.get(usn)
+        return snapshot.students[index] if index is not None else None
+
+    def row_labels(self):
+        """USN owning every row of the descriptor matrix."""
+        snapshot = self.snapshot
+        return [snapshot.students[i]['usn'] for i in snapshot.owners]
+
+    def row_descriptors(self):
+        """Every row of the descriptor matrix as float32 (reconstructed when quantized)."""
+        snapshot = self.snapshot
+        return snapshot.codec.decode(snapshot.descriptors)
+
+    def nbytes(self):
+        """Memory held by the descriptor matrix and the per-student summaries."""
+        snapshot = self.snapshot
+        return snapshot.descriptors.nbytes + snapshot.summaries.nbytes + snapshot.radii.nbytes
+
+    def roster(self, semester, section):
+        """Return (name, usn) for every student enrolled in the partition."""
+        snapshot = self.snapshot
+        students = snapshot.partitions.get((str(semester), str(section)), slice(0, 0))
+        return [(s['name'], s['usn']) for s in snapshot.students[students]]
+
+    def _exact_nearest(self, snapshot, queries, students, chunk):
+        """Distance to and owner of the nearest descriptor of a slice of students, scanning every row."""
+        best_dist = np.full(len(queries), np.inf, dtype=np.float32)
+        best_row = np.zeros(len(queries), dtype=np.int64)
+        first, last = snapshot.row_starts[students.start], snapshot.row_starts[students.stop]
+        rows = np.arange(len(queries))
+        for start in range(first, last, chunk):
+            end = min(start + chunk, last)
+            dists = snapshot.codec.distances(queries, snapshot.descriptors[start:end], snapshot.sq_norms[start:end])
+            nearest = dists.argmin(axis=1)
+            closer = dists[rows, nearest] < best_dist
+            best_dist[closer] = dists[rows, nearest][closer]
+            best_row[closer] = nearest[closer] + start
+        return best_dist, snapshot.owners[best_row] if len(snapshot.owners) else best_row
+
+    def _screened_nearest(self, snapshot, queries, students, tolerance):
+        """Two-stage nearest descriptor of a slice of students.
+
+        Stage one ranks students by their closer summary (centroid or medoid)
+        and keeps SCREEN_CANDIDATES per face, minus any whose centroid is more
+        than tolerance + radius away and so cannot hold a match. Stage two
+        scans only the candidates' full descriptors.
+        """
+        count = students.stop - students.start
+        summary_dists = pairwise_distances(queries, snapshot.summaries[2 * students.start:2 * students.stop])
+        summary_dists = summary_dists.reshape(len(queries), count, 2)
+        k = min(SCREEN_CANDIDATES, count)
+        closest = np.minimum(summary_dists[:, :, 0], summary_dists[:, :, 1])  # Faster than min(axis=2) on pairs
+        top = np.argpartition(closest, k - 1, axis=1)[:, :k]
+        lower_bound = summary_dists[:, :, 0] - snapshot.radii[students]
+        candidates = np.zeros((len(queries), count), dtype=bool)
+        np.put_along_axis(candidates, top, np.take_along_axis(lower_bound, top, axis=1) < tolerance, axis=1)
+
+        checked = np.nonzero(candidates.any(axis=0))[0] + students.start
+        if len(checked) == 0:
+            return np.full(len(queries), np.inf, dtype=np.float32), np.zeros(len(queries), dtype=np.int32)
+
+        # Row indices of every checked student's descriptors, gathered without a Python loop
+        starts = snapshot.row_starts[checked]
+        lengths = snapshot.row_starts[checked + 1] - starts
+        rows = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+        dists = snapshot.codec.distances(queries, snapshot.descriptors[rows], snapshot.sq_norms[rows])
+        owners = snapshot.owners[rows]
+        dists[~candidates[:, owners - students.start]] = np.inf  # Each face only against its own candidates
+        nearest = dists.argmin(axis=1)
+        return dists[np.arange(len(queries)), nearest], owners[nearest]
+
+    def _assign(self, snapshot, encodings, students, tolerance, chunk):
+        queries = as_descriptor_matrix(encodings)
+        if students is None or len(queries) == 0 or students.stop == students.start:
+            return [None] * len(queries)
+        if self.two_stage:
+            dists, owners = self._screened_nearest(snapshot, queries, students, tolerance)
+        else:
+            dists, owners = self._exact_nearest(snapshot, queries, students, chunk)
+        return [(snapshot.students[i]['name'], snapshot.students[i]['usn']) if dist < tolerance else None
+                for i, dist in zip(owners, dists)]
+
+    def assign(self, encodings, semester, section, tolerance=MATCH_TOLERANCE):
+        """Match all faces of an upload against one class in a single batch.
+
+        Each face is assigned to the student owning its nearest descriptor when
+        that distance is below the tolerance. Returns one (name, usn) per face,
+        or None for a face that matched nobody.
+        """
+        snapshot = self.snapshot
+        students = snapshot.partitions.get((str(semester), str(section)))
+        return self._assign(snapshot, encodings, students, tolerance, chunk=65536)
+
+    def match(self, encodings, semester, section, tolerance=MATCH_TOLERANCE):
+        """Set of (name, usn) recognized among the faces, matched against one class."""
+        return {student for student in self.assign(encodings, semester, section, tolerance) if student}
+
+    def assign_all(self, encodings, tolerance=MATCH_TOLERANCE, chunk=65536):
+        """Campus-wide match of the faces against every partition.
+
+        The exhaustive scan goes through the gallery in chunks of rows so the
+        distance matrix stays bounded even for tens of thousands of students.
+        Returns one (name, usn) or None per face.
+        """
+        snapshot = self.snapshot
+        return self._assign(snapshot, encodings, slice(0, len(snapshot.students)), tolerance, chunk)
+
+    def match_all(self, encodings, tolerance=MATCH_TOLERANCE, chunk=65536):
+        """Set of (name, usn) recognized among the faces, matched against the whole campus."""
+        return {student for student in self.assign_all(encodings, tolerance, chunk) if student}
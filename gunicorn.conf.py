@@ -0,0 +1,38 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master with the dlib models and Google clients
+# already loaded, then forked into the workers. The ~100 MB of model weights are
+# shared copy-on-write instead of being loaded again by every worker. The face
+# gallery is memory-mapped from student_data/gallery (SHARED_GALLERY), so an
+# enrollment handled by one worker is published to all of them.
+import gc
+import os
+
+# Read by app.py at import time, which happens after this file is executed
+os.environ['PRELOAD_APP'] = '1'
+os.environ.setdefault('MODEL_WARMUP', 'eager')
+
+# Worker processes. warmup.SERVER_WORKERS reads the same variable, so every worker's job threads and
+# pipeline pool get 1/WEB_CONCURRENCY of the CPUs
+os.environ.setdefault('WEB_CONCURRENCY', '2')
+from warmup import SERVER_WORKERS
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = SERVER_WORKERS
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything allocated during preload out of the collector's reach, so
+    # collections in the workers do not touch (and un-share) those pages
+    gc.freeze()
+    import warmup
+    server.log.info(f"Master ready in {warmup.uptime():.2f}s (RSS {warmup.rss_mb():.0f} MB)")
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
+    server.log.info(f"Worker {worker.pid} started")
@@ -0,0 +1,109 @@
+import os
+import struct
+import cv2
+import numpy as np
+
+# Leading bytes searched for the image dimensions; JPEG EXIF/XMP segments can push the frame header this far
+HEADER_BYTES = 256 * 1024
+
+# Photos whose longest side is at least twice this are decoded at 1/2, 1/4 or 1/8 scale (0 disables)
+DECODE_MAX_SIDE = int(os.environ.get('DECODE_MAX_SIDE', 3000))
+
+# JPEG start-of-frame markers that carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def image_size(header):
+    """(width, height) read from a JPEG or PNG header without decoding, or None."""
+    header = bytes(header[:HEADER_BYTES])
+    if header.startswith(PNG_SIGNATURE) and len(header) >= 24:
+        return struct.unpack('>II', header[16:24])
+    if not header.startswith(b'\xff\xd8'):
+        return None
+    i = 2
+    while i + 4 <= len(header):
+        if header[i] != 0xFF:
+            return None
+        marker = header[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(header):
+                return None
+            height, width = struct.unpack('>HH', header[i + 5:i + 9])
+            return width, height
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # Markers without a length
+            i += 2
+            continue
+        i += 2 + struct.unpack('>H', header[i + 2:i + 4])[0]
+    return None
+
+
+def decode_factor(size, max_side=DECODE_MAX_SIDE):
+    """Largest of 8, 4, 2 that keeps the longest side at or above max_side, else 1."""
+    if not size or not max_side:
+        return 1
+    for factor, _ in REDUCED_DECODE_FLAGS:
+        if max(size) / factor >= max_side:
+            return factor
+    return 1
+
+
+def decode_image(data, max_side=DECODE_MAX_SIDE):
+    """Decode uploaded bytes to BGR, letting libjpeg scale very large photos down while decoding.
+
+    JPEG DCT scaling never materializes the full-size bitmap, so an 8000px
+    photo costs a quarter of the memory and decode time. Returns None if the
+    data is not an image.
+    """
+    if not len(data):
+        return None  # cv2.imdecode raises on an empty buffer instead of returning None
+    flag = dict(REDUCED_DECODE_FLAGS).get(decode_factor(image_size(memoryview(data)[:HEADER_BYTES]), max_side),
+                                          cv2.IMREAD_COLOR)
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+
+def read_upload(source):
+    """Bytes of one upload; file objects are read and closed so their spool is released right away."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    try:
+        return source.read()
+    finally:
+        source.close()
+
+
+def upload_size(file):
+    """Size of an uploaded file without reading it into memory."""
+    stream = getattr(file, 'stream', file)
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def estimate_decode_bytes(file, max_side=DECODE_MAX_SIDE):
+    """Bytes of the BGR bitmap an upload decodes to, from its header alone.
+
+    Falls back to ten times the file size when the dimensions are unknown.
+    """
+    stream = getattr(file, 'stream', file)
+    position = stream.tell()
+    header = stream.read(HEADER_BYTES)
+    stream.seek(position)
+    return decoded_bytes(header, upload_size(file), max_side)
+
+
+def decoded_bytes(header, file_size, max_side=DECODE_MAX_SIDE):
+    """Bytes of the BGR bitmap an image with this header decodes to, or ten times file_size if unknown."""
+    size = image_size(header)
+    if size is None:
+        return 10 * file_size
+    factor = decode_factor(size, max_side)
+    return (size[0] // factor) * (size[1] // factor) * 3
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import random
+import sqlite3
+import threading
+from metrics import REGISTRY
+from warmup import cpu_share
+
+# Jobs processed at once by one server process; the default spreads the CPUs over the gunicorn workers.
+# Every job of a process shares that process's face pipeline pool.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', cpu_share()))
+
+# Queued jobs beyond which new submissions are turned away
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 200))
+
+# Seconds a finished job's result stays available for polling
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 24 * 3600))
+
+# How often idle workers look for jobs submitted to other server processes
+JOB_POLL_INTERVAL = 1.0
+
+# How often finished jobs past JOB_RESULT_TTL are deleted
+JOB_PRUNE_INTERVAL = 600
+
+# A running job is handed to another worker if its process stops renewing its claim for this many seconds
+JOB_CLAIM_LEASE = 600
+
+# Runs of one job (including runs lost to a crashed worker) before it is marked as failed
+JOB_MAX_ATTEMPTS = 3
+
+# Seconds before a job that hit a transient error (e.g. a full memory budget) is tried again
+JOB_RETRY_DELAY = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    params TEXT NOT NULL,
+    photos INTEGER NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created);
+"""
+
+
+
+class QueueFull(Exception):
+    """The job queue already holds JOB_QUEUE_MAX queued jobs."""
+
+
+class JobQueue:
+    """Durable queue of jobs (e.g. attendance submissions), shared by every server process.
+
+    A submission spools its photos to `<directory>/<job id>/` and records the
+    job in SQLite, then returns at once. Worker threads in each process claim
+    jobs with a lease, which is renewed while the handler runs, so a job whose
+    process died is picked up again by another worker. `handler(params,
+    photo_paths)` does the work and returns a JSON-serializable result that
+    clients poll for with status(). `name` labels the queue's metrics and logs.
+
+    Exceptions of the `transient` types put the job back in the queue for a
+    later attempt; any other exception fails the job with its message.
+    """
+
+    def __init__(self, directory, handler, name='attendance', workers=JOB_WORKERS, max_queued=JOB_QUEUE_MAX,
+                 transient=(), lease=JOB_CLAIM_LEASE):
+        self.directory = directory
+        self.handler = handler
+        self.name = name
+        self.lease = lease
+        self.wait_seconds = REGISTRY.histogram(f'{name}_job_wait_seconds',
+                                               f'Time {name} jobs spent queued before a worker took them')
+        self.run_seconds = REGISTRY.histogram(f'{name}_job_run_seconds', f'Time {name} jobs took once started')
+        self.finished = REGISTRY.counter(f'{name}_jobs_total', f'Finished {name} jobs by outcome', labels=('outcome',))
+        self.rejected = REGISTRY.counter(f'{name}_jobs_rejected_total',
+                                         f'{name.capitalize()} submissions turned away because the queue was full')
+        self.workers = workers
+        self.max_queued = max_queued
+        self.transient = tuple(transient)
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'jobs.db')
+        self.reopen()
+        self._conn.executescript(SCHEMA)
+
+    def reopen(self):
+        """Fresh connection, lock and events for a forked child; the workers are not running afterwards."""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._next_prune = 0
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+    def _photo_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, params, files):
+        """Spool the uploads, queue the job and return its ID. Raises QueueFull when at capacity."""
+        if self.depth()['queued'] >= self.max_queued:
+            self.rejected.inc()
+            raise QueueFull(f"Too many {self.name} submissions are waiting. Please try again shortly.")
+
+        job_id = uuid.uuid4().hex
+        tmp_dir = self._photo_dir(f'{job_id}.tmp')
+        os.makedirs(tmp_dir)
+        try:
+            for index, file in enumerate(files):
+                with open(os.path.join(tmp_dir, f'{index:04d}'), 'wb') as f:
+                    shutil.copyfileobj(getattr(file, 'stream', file), f)
+            os.replace(tmp_dir, self._photo_dir(job_id))
+            with self._lock:
+                self._conn.execute('INSERT INTO jobs (id, state, params, photos, created) VALUES (?, ?, ?, ?, ?)',
+                                   (job_id, 'queued', json.dumps(params), len(files), time.time()))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            shutil.rmtree(self._photo_dir(job_id), ignore_errors=True)
+            raise
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id):
+        """State of a job for polling clients, or None for an unknown (or expired) job."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            status = {'job_id': row['id'], 'state': row['state'], 'photos': row['photos'],
+                      'attempts': row['attempts'], 'error': row['error'],
+                      'result': json.loads(row['result']) if row['result'] else None}
+            if row['state'] == 'queued':
+                status['position'] = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND created < ?", (row['created'],)).fetchone()[0]
+        return status
+
+    def depth(self):
+        """Jobs waiting and jobs being processed, across all server processes."""
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE state IN ('queued', 'running') GROUP BY state").fetchall())
+        return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0)}
+
+    def _claim(self, now):
+        """Lease the oldest due job, including running jobs whose lease expired.
+
+        Returns its row as it was before the claim, with the new lease in
+        claimed_until, or None. The lease identifies this claim: a worker whose
+        lease expired and was taken over can no longer change the job.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE (state = 'queued' AND next_attempt <= ?) "
+                    "OR (state = 'running' AND claimed_until <= ?) ORDER BY created LIMIT 1", (now, now)).fetchone()
+                if row is not None:
+                    row = dict(row, claimed_until=now + self.lease)
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'running', started = ?, claimed_until = ?, attempts = attempts + 1 "
+                        "WHERE id = ?", (now, row['claimed_until'], row['id']))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return row
+
+    def _update_claimed(self, row, sql, params):
+        """Run an UPDATE on a job only while `row`'s claim still holds it. Returns whether it did."""
+        with self._lock:
+            cursor = self._conn.execute(f"{sql} WHERE id = ? AND state = 'running' AND claimed_until = ?",
+                                        (*params, row['id'], row['claimed_until']))
+        if cursor.rowcount == 0:
+            print(f"{self.name.capitalize()} job {row['id']} was taken over by another worker; dropping this run's outcome")
+        return cursor.rowcount > 0
+
+    def _finish(self, row, state, result=None, error=None):
+        updated = self._update_claimed(row, 'UPDATE jobs SET state = ?, finished = ?, result = ?, error = ?, claimed_until = 0',
+                                       (state, time.time(), json.dumps(result) if result is not None else None, error))
+        if not updated:
+            return
+        shutil.rmtree(self._photo_dir(row['id']), ignore_errors=True)
+        self.finished.inc(outcome=state)
+
+    def _retry_later(self, row, error):
+        """Queue the job again; a deferral is not a failed run, so it gives back the attempt its claim took."""
+        self._update_claimed(row, "UPDATE jobs SET state = 'queued', next_attempt = ?, claimed_until = 0, error = ?, "
+                                  "attempts = attempts - 1",
+                             (time.time() + JOB_RETRY_DELAY * random.uniform(0.8, 1.2), error))
+
+    def _renew(self, row, done):
+        """Extend `row`'s claim every third of a lease until `done` is set or the claim is lost."""
+        while not done.wait(self.lease / 3):
+            claimed_until = time.time() + self.lease
+            try:
+                with self._lock:
+                    cursor = self._conn.execute(
+                        "UPDATE jobs SET claimed_until = ? WHERE id = ? AND state = 'running' AND claimed_until = ?",
+                        (claimed_until, row['id'], row['claimed_until']))
+            except sqlite3.Error as e:
+                print(f"{self.name.capitalize()} job {row['id']} lease renewal failed: {e}")
+                continue
+            if cursor.rowcount == 0:
+                return
+            row['claimed_until'] = claimed_until
+
+    def _run_job(self, row):
+        job_id = row['id']
+        if row['attempts'] >= JOB_MAX_ATTEMPTS:
+            self._finish(row, 'error', error="The job was interrupted too many times. Please submit it again.")
+            return
+        self.wait_seconds.observe(time.time() - row['created'])
+        photo_dir = self._photo_dir(job_id)
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(row, done), name=f'{self.name}-job-lease', daemon=True)
+        renewer.start()
+        start = time.perf_counter()
+        try:
+            photo_paths = [os.path.join(photo_dir, name) for name in sorted(os.listdir(photo_dir))]
+            result = self.handler(json.loads(row['params']), photo_paths)
+        except self.transient as e:
+            print(f"{self.name.capitalize()} job {job_id} deferred: {e}")
+            outcome = ('retry', str(e))
+        except Exception as e:
+            print(f"{self.name.capitalize()} job {job_id} failed: {e}")
+            outcome = ('error', str(e) or type(e).__name__)
+        else:
+            outcome = ('done', result)
+        finally:
+            self.run_seconds.observe(time.perf_counter() - start)
+            done.set()
+            renewer.join()  # row['claimed_until'] holds the latest renewal from here on
+        state, value = outcome
+        if state == 'retry':
+            self._retry_later(row, value)
+        elif state == 'error':
+            self._finish(row, 'error', error=value)
+        else:
+            self._finish(row, 'done', result=value)
+
+    def process_next(self, now=None):
+        """Claim and run one job. Returns False if none was due."""
+        row = self._claim(time.time() if now is None else now)
+        if row is None:
+            return False
+        self._run_job(row)
+        return True
+
+    def prune(self, now=None):
+        """Forget finished jobs older than JOB_RESULT_TTL."""
+        cutoff = (time.time() if now is None else now) - JOB_RESULT_TTL
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE state IN ('done', 'error') AND finished < ?", (cutoff,))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                if self.process_next():
+                    continue
+                if time.time() >= self._next_prune:
+                    self._next_prune = time.time() + JOB_PRUNE_INTERVAL
+                    self.prune()
+            except Exception as e:
+                print(f"{self.name.capitalize()} job worker error: {e}")
+            self._wakeup.wait(JOB_POLL_INTERVAL)
+
+    def start(self):
+        """Start the worker threads; jobs left queued or interrupted by a previous run are resumed."""
+        if not self._threads:
+            self._threads = [threading.Thread(target=self._run, name=f'{self.name}-job-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
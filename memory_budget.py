@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Memory the upload pipeline of one server process may hold at once
+UPLOAD_MEMORY_BUDGET_MB = float(os.environ.get('UPLOAD_MEMORY_BUDGET_MB', 1024))
+
+# Seconds a request waits for budget before it is turned away
+UPLOAD_QUEUE_TIMEOUT = float(os.environ.get('UPLOAD_QUEUE_TIMEOUT', 30))
+
+
+class BudgetExceeded(Exception):
+    """A request could not get its memory reservation.
+
+    `too_large` is True when the request alone needs more than the whole
+    budget, so retrying will not help.
+    """
+
+    def __init__(self, message, too_large=False):
+        super().__init__(message)
+        self.too_large = too_large
+
+
+class MemoryBudget:
+    """Counting reservation of bytes shared by the request threads of one process.
+
+    Requests reserve their estimated peak before touching image data. If the
+    budget is in use they queue (first come, first served) until enough is
+    released or the timeout lapses.
+    """
+
+    def __init__(self, limit_bytes=UPLOAD_MEMORY_BUDGET_MB * 1024 * 1024, timeout=UPLOAD_QUEUE_TIMEOUT):
+        self.limit = limit_bytes
+        self.timeout = timeout
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._queue = []  # Tickets of waiting requests in arrival order
+        self._next_ticket = 0
+
+    @contextmanager
+    def reserve(self, nbytes, timeout=None):
+        """Hold nbytes of the budget for the duration of the block, or raise BudgetExceeded."""
+        if nbytes > self.limit:
+            with self._cond:
+                self.rejected += 1
+            raise BudgetExceeded(f"Request needs {nbytes / 2**20:.0f} MB, budget is {self.limit / 2**20:.0f} MB",
+                                 too_large=True)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            self.waiting += 1
+            try:
+                while self._queue[0] != ticket or self.in_use + nbytes > self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise BudgetExceeded("Server is busy processing other uploads. Please try again shortly.")
+                    self._cond.wait(remaining)
+                self.in_use += nbytes
+            finally:
+                self._queue.remove(ticket)
+                self.waiting -= 1
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'limit_bytes': self.limit, 'in_use_bytes': self.in_use,
+                    'waiting': self.waiting, 'rejected': self.rejected}
@@ -0,0 +1,321 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import bisect
+import threading
+from collections import Counter as _Tally, OrderedDict
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Seconds between stack samples of a profiled request
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+
+# Finished request profiles kept on disk for download
+MAX_PROFILES = 20
+
+# IDs handed out by ProfileStore.add
+PROFILE_ID = re.compile(r'[0-9a-f]{12}')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Monotonic count, optionally split by labels."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f'{self.name}{_label_text(self.label_names, key)} {value}'
+                                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values, Prometheus style."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 3))
+            series[index] += 1  # Bucket len(buckets) is +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = self.header()
+        names = self.label_names + ('le',)
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_label_text(names, key + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_text(self.label_names, key)} {values[-2]}')
+            lines.append(f'{self.name}_count{_label_text(self.label_names, key)} {values[-1]}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time, e.g. a queue depth."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, read):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"Gauge {self.name} failed: {e}")
+            return []
+        return self.header() + [f'{self.name} {value}']
+
+
+class Registry:
+    """Every metric of this process, rendered in the Prometheus text format.
+
+    Metrics are per process; under gunicorn each worker reports its own.
+    """
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # Module reloads and repeated setup share the series
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read):
+        return self._register(Gauge(name, help_text, read))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('attendance_stage_seconds', 'Time spent in each stage of a request',
+                                   labels=('route', 'stage'))
+GOOGLE_API_SECONDS = REGISTRY.histogram('google_api_seconds', 'Latency of Google Sheets and Drive calls',
+                                        labels=('call',))
+GOOGLE_API_ERRORS = REGISTRY.counter('google_api_errors_total', 'Failed Google Sheets and Drive calls',
+                                     labels=('call', 'status'))
+
+
+@contextmanager
+def span(route, stage):
+    """Time one stage of a request into attendance_stage_seconds."""
+    with STAGE_SECONDS.time(route=route, stage=stage):
+        yield
+
+
+@contextmanager
+def google_call(call):
+    """Time one Google API call and count it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        status = getattr(getattr(e, 'resp', None), 'status', None) or type(e).__name__
+        GOOGLE_API_ERRORS.inc(call=call, status=status)
+        raise
+    finally:
+        GOOGLE_API_SECONDS.observe(time.perf_counter() - start, call=call)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Statistical profiler for one thread, built on sys._current_frames().
+
+    A daemon thread snapshots the target thread's stack every `interval`
+    seconds. The result is a table of collapsed stacks ('a;b;c count') that
+    flamegraph tools read directly. Work done inside pipeline worker
+    processes shows up as time waiting on their futures.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = _Tally()
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common()) + '\n'
+
+    def top(self, limit=10):
+        """(function, share of samples) for the innermost frames seen most often."""
+        leaves = _Tally()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(name, count / total) for name, count in leaves.most_common(limit)]
+
+
+class ProfileStore:
+    """The most recent request profiles, saved as files in a directory every server process shares.
+
+    Each profile is `<id>.folded` (the collapsed stacks) plus `<id>.json`
+    (label, duration and sample count), written in that order so a listed
+    profile can always be downloaded, whichever worker recorded it.
+    """
+
+    def __init__(self, directory, max_profiles=MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id, ext):
+        return os.path.join(self.directory, f'{profile_id}.{ext}')
+
+    def _write(self, path, text):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _ids(self):
+        """Saved profile IDs, newest first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name[:-5]))
+                except FileNotFoundError:
+                    pass  # Pruned by another process meanwhile
+        return [profile_id for _, profile_id in sorted(entries, reverse=True)]
+
+    def add(self, label, profiler):
+        profile_id = uuid.uuid4().hex[:12]
+        self._write(self._path(profile_id, 'folded'), profiler.folded())
+        self._write(self._path(profile_id, 'json'), json.dumps({
+            'label': label, 'seconds': round(profiler.duration, 3), 'samples': sum(profiler.samples.values())}))
+        for old_id in self._ids()[self.max_profiles:]:
+            for ext in ('json', 'folded'):
+                try:
+                    os.remove(self._path(old_id, ext))
+                except FileNotFoundError:
+                    pass
+        return profile_id
+
+    def _info(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json'), encoding='utf-8') as f:
+                return dict(json.load(f), id=profile_id)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get(self, profile_id):
+        """Profile info with its collapsed stacks under 'folded', or None for an unknown ID."""
+        if not PROFILE_ID.fullmatch(profile_id):
+            return None
+        info = self._info(profile_id)
+        try:
+            with open(self._path(profile_id, 'folded'), encoding='utf-8') as f:
+                return dict(info, folded=f.read()) if info else None
+        except FileNotFoundError:
+            return None
+
+    def list(self):
+        return [info for info in map(self._info, self._ids()) if info]
@@ -0,0 +1,135 @@
+import os
+import math
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Where generated PDFs are cached, named by source content hash and threshold
+REPORT_DIR = 'reports'
+
+# Most PDFs kept on disk; the least recently served ones are evicted first
+REPORT_CACHE_MAX_FILES = int(os.environ.get('REPORT_CACHE_MAX_FILES', 200))
+
+# Reports rendered at the same time
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+
+# Finished jobs remembered for status polling
+MAX_TRACKED_JOBS = 1000
+
+# Attendance percentage below which a student is flagged, when the form leaves it empty
+DEFAULT_THRESHOLD = 75
+
+
+def parse_threshold(value):
+    """Threshold percentage from a form field; raises ValueError unless it is a number from 0 to 100."""
+    if value is None or not str(value).strip():
+        return DEFAULT_THRESHOLD
+    threshold = float(value)
+    if not math.isfinite(threshold) or not 0 <= threshold <= 100:
+        raise ValueError(f"Threshold must be a percentage from 0 to 100, got {value!r}")
+    return threshold
+
+
+def files_digest(paths, chunk_size=1 << 20):
+    """SHA-256 over the contents of several files, in order; a missing file hashes differently from an empty one."""
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            digest.update(b'missing\0')
+            continue
+        with f:
+            digest.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'big'))
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReportJobs:
+    """Background PDF report generation with a content-addressed disk cache.
+
+    `render(file_path, threshold, output_path)` builds the PDF for one
+    attendance file, and `sources(file_path)` lists the files it reads.
+    Reports are cached as `<sha256 of the sources>_<threshold>.pdf`, hashed
+    on the report worker, so a request for an unchanged log is answered from
+    disk without rendering and concurrent users never overwrite each other's
+    output.
+    """
+
+    def __init__(self, render, sources=lambda file_path: [file_path], report_dir=REPORT_DIR,
+                 max_files=REPORT_CACHE_MAX_FILES):
+        self.render = render
+        self.sources = sources
+        self.report_dir = report_dir
+        self.max_files = max_files
+        os.makedirs(report_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix='report')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._running = {}  # (file path, threshold) -> job_id, so identical requests share one job
+
+    def _output_path(self, file_path, threshold):
+        return os.path.join(self.report_dir, f"{files_digest(self.sources(file_path))}_{threshold:g}.pdf")
+
+    def submit(self, file_path, file_name, threshold=DEFAULT_THRESHOLD):
+        """Start (or reuse) a report job and return its ID."""
+        key = (file_path, threshold)
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if key in self._running:
+                return self._running[key]
+            self._forget_finished()
+            self._jobs[job_id] = {'status': 'running', 'file_name': file_name, 'pdf_path': None, 'message': None}
+            self._running[key] = job_id
+        self._executor.submit(self._run, job_id, file_path, threshold)
+        return job_id
+
+    def _forget_finished(self):
+        """Drop the oldest finished jobs beyond MAX_TRACKED_JOBS; running ones are kept. Caller holds the lock."""
+        excess = len(self._jobs) - MAX_TRACKED_JOBS + 1
+        if excess > 0:
+            finished = [job_id for job_id, job in self._jobs.items() if job['status'] != 'running'][:excess]
+            for job_id in finished:
+                del self._jobs[job_id]
+
+    def _run(self, job_id, file_path, threshold):
+        output_path = tmp_path = None
+        try:
+            # Hashed before rendering, so a session appended meanwhile gives the next request a new key
+            output_path = self._output_path(file_path, threshold)
+            if os.path.exists(output_path):
+                os.utime(output_path)  # Mark as recently used for eviction
+            else:
+                tmp_path = f'{output_path}.{job_id}.tmp'
+                self.render(file_path, threshold, tmp_path)
+                os.replace(tmp_path, output_path)
+            status, message = 'success', None
+        except Exception as e:
+            print(f"Report generation for {file_path} failed: {e}")
+            status, message = 'error', "Error generating the report. Please try again."
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._jobs[job_id].update(status=status, message=message, pdf_path=output_path)
+            self._running.pop((file_path, threshold), None)
+        self._evict()
+
+    def status(self, job_id):
+        """Job state dict, or None for an unknown job."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _evict(self):
+        """Delete the least recently used PDFs beyond the cache size."""
+        reports = [os.path.join(self.report_dir, name) for name in os.listdir(self.report_dir) if name.endswith('.pdf')]
+        if len(reports) <= self.max_files:
+            return
+        reports.sort(key=os.path.getmtime)
+        for path in reports[:len(reports) - self.max_files]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
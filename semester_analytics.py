@@ -0,0 +1,236 @@
+"""Per-student attendance across every subject and section, from all attendance logs."""
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from attendance_stats import STATS_DIR_NAME
+from session_log import SessionLog, load_counters, parse_student_line
+
+# Worker processes used to scan changed logs
+ANALYTICS_WORKERS = int(os.environ.get('ANALYTICS_WORKERS', os.cpu_count() or 1))
+
+# Below this many changed logs the scan stays in the calling process
+ANALYTICS_PARALLEL_MIN = 4
+
+CACHE_FILE_NAME = 'semester_analytics.json'
+
+ATTENDANCE_PREFIX = 'attendance_'
+ATTENDANCE_SUFFIX = '.txt'
+
+
+def parse_attendance_filename(filename):
+    """Return (semester, subject, section) for attendance_<semester>_<subject>_<section>.txt, or None."""
+    if not (filename.startswith(ATTENDANCE_PREFIX) and filename.endswith(ATTENDANCE_SUFFIX)):
+        return None
+    stem = filename[len(ATTENDANCE_PREFIX):-len(ATTENDANCE_SUFFIX)]
+    semester, _, rest = stem.partition('_')
+    subject, _, section = rest.rpartition('_')
+    if not semester or not subject or not section:
+        return None
+    return semester, subject, section
+
+
+def file_signature(path):
+    """Size and modification time of the text log and of the structured log it is read from."""
+    log = SessionLog(path)
+    signature = []
+    for source in (path, log.records_path, log.students_path):
+        try:
+            stat = os.stat(source)
+            signature += [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            signature += [None, None]
+    return signature
+
+
+def scan_file(path):
+    """Counters of one log as {usn: [name, present, total]}; runs in a worker process."""
+    students = {}
+    for student, (present, total) in (load_counters(path) or {}).items():
+        name, usn = parse_student_line(student)
+        entry = students.setdefault(usn, [name, 0, 0])
+        entry[0] = name
+        entry[1] += present
+        entry[2] += total
+    return students
+
+
+def percentage(present, total):
+    return round(present / total * 100, 1) if total else None
+
+
+def merge(files):
+    """Build the student x subject report from {filename: cached file entry}.
+
+    Columns are (semester, subject), so a subject name reused in another
+    semester gets its own column.
+    """
+    subjects = sorted({(entry['semester'], entry['subject']) for entry in files.values()})
+    column = {subject: i for i, subject in enumerate(subjects)}
+    students = {}
+    for filename in sorted(files):
+        entry = files[filename]
+        for usn, (name, present, total) in entry['students'].items():
+            student = students.setdefault(usn, {'usn': usn, 'name': name, 'classes': set(), 'present': 0, 'total': 0,
+                                                'counts': [[0, 0] for _ in subjects]})
+            student['name'] = name
+            student['classes'].add((entry['semester'], entry['section']))
+            student['present'] += present
+            student['total'] += total
+            counts = student['counts'][column[(entry['semester'], entry['subject'])]]
+            counts[0] += present
+            counts[1] += total
+
+    rows, matrix = [], []
+    for usn in sorted(students):
+        student = students[usn]
+        rows.append({'usn': usn, 'name': student['name'],
+                     'semester': ', '.join(sorted({semester for semester, _ in student['classes']})),
+                     'section': ', '.join(sorted({section for _, section in student['classes']})),
+                     'present': student['present'], 'total': student['total'],
+                     'percentage': percentage(student['present'], student['total'])})
+        matrix.append([percentage(present, total) for present, total in student['counts']])
+    return {'subjects': subjects, 'students': rows, 'matrix': matrix,
+            'classes': sorted({(entry['semester'], entry['subject'], entry['section']) for entry in files.values()})}
+
+
+class SemesterAnalytics:
+    """Cached cross-subject attendance report over the logs in one directory."""
+
+    def __init__(self, directory='.', workers=ANALYTICS_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self.cache_path = os.path.join(directory, STATS_DIR_NAME, CACHE_FILE_NAME)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._reports = {}
+        self._signatures = None
+        self._pool = None
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                return json.load(f).get('files', {})
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_cache(self, files):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': files}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.cache_path)
+
+    def _get_pool(self):
+        """Create the worker pool on first use and keep it for later scans. Caller holds the lock.
+
+        Workers are spawned rather than forked, since the server calls this
+        from a thread while its other threads may hold locks.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _scan(self, paths):
+        """{path: counters} for the given logs, in worker processes when there are enough of them."""
+        if self.workers > 1 and len(paths) >= ANALYTICS_PARALLEL_MIN:
+            chunksize = max(1, len(paths) // (4 * self.workers))
+            return dict(zip(paths, self._get_pool().map(scan_file, paths, chunksize=chunksize)))
+        return {path: scan_file(path) for path in paths}
+
+    def _refresh(self):
+        """Per-file entries for every log, rescanning only logs whose signature changed."""
+        logs = {}
+        for filename in os.listdir(self.directory):
+            parts = parse_attendance_filename(filename)
+            if parts is not None:
+                logs[filename] = (parts, file_signature(os.path.join(self.directory, filename)))
+
+        signatures = {filename: signature for filename, (_, signature) in logs.items()}
+        if signatures == self._signatures:
+            return None, 0
+
+        cached = self._load_cache()
+        stale = [filename for filename, signature in signatures.items()
+                 if cached.get(filename, {}).get('signature') != signature]
+        scanned = self._scan([os.path.join(self.directory, filename) for filename in stale])
+
+        files = {}
+        for filename, ((semester, subject, section), signature) in logs.items():
+            students = scanned[os.path.join(self.directory, filename)] if filename in stale else cached[filename]['students']
+            files[filename] = {'semester': semester, 'subject': subject, 'section': section,
+                               'signature': signature, 'students': students}
+        if stale or len(files) != len(cached):
+            self._save_cache(files)
+        self._signatures = signatures
+        return files, len(stale)
+
+    def report(self, semester=None, section=None):
+        """Student x subject attendance, optionally limited to one semester and/or section.
+
+        Returns {'subjects', 'students', 'matrix', 'classes', ...}: subjects
+        are (semester, subject) pairs and matrix[i][j] is the percentage of
+        students[i] in subjects[j], or None if the student has no sessions of
+        that subject.
+        """
+        start = time.perf_counter()
+        key = (str(semester) if semester else None, section or None)
+        with self._lock:
+            files, rescanned = self._refresh()
+            if files is not None:
+                self._files = files
+                self._reports = {}
+            if key not in self._reports:
+                selected = {filename: entry for filename, entry in self._files.items()
+                            if (key[0] is None or entry['semester'] == key[0])
+                            and (key[1] is None or entry['section'] == key[1])}
+                self._reports[key] = dict(merge(selected), files=len(selected))
+            report = dict(self._reports[key], rescanned=rescanned,
+                          seconds=round(time.perf_counter() - start, 3))
+        return report
+
+
+def write_csv(report, path):
+    """Write the matrix as CSV: one row per student, one column per subject."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['USN', 'Name', 'Semester', 'Section']
+                        + [f'{subject} (sem {semester})' for semester, subject in report['subjects']] + ['Overall'])
+        for student, row in zip(report['students'], report['matrix']):
+            writer.writerow([student['usn'], student['name'], student['semester'], student['section']]
+                            + ['' if value is None else value for value in row] + [student['percentage']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attendance of every student across all subjects and sections.')
+    parser.add_argument('--directory', default='.', help='Where the attendance_*.txt logs live')
+    parser.add_argument('--semester')
+    parser.add_argument('--section')
+    parser.add_argument('--threshold', type=float, default=75, help='List students below this overall percentage')
+    parser.add_argument('--workers', type=int, default=ANALYTICS_WORKERS)
+    parser.add_argument('--csv', help='Write the student x subject matrix to this CSV file')
+    parser.add_argument('--json', help='Write the full report to this JSON file')
+    args = parser.parse_args()
+
+    report = SemesterAnalytics(args.directory, args.workers).report(args.semester, args.section)
+    print(f"{len(report['students'])} students, {len(report['subjects'])} subjects from {report['files']} logs "
+          f"({report['rescanned']} rescanned) in {report['seconds']:.2f}s")
+    low = [student for student in report['students']
+           if student['percentage'] is not None and student['percentage'] < args.threshold]
+    if low:
+        print(f"\nBelow {args.threshold:g}% overall:")
+        for student in low:
+            print(f"{student['name']} ({student['usn']}) - {student['percentage']:.1f}%")
+    if args.csv:
+        write_csv(report, args.csv)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
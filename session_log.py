@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+import numpy as np
+from attendance_stats import IncrementalStats, parse_sessions
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the in-process lock still applies
+    fcntl = None
+
+# Directory (next to the attendance_*.txt files) holding the structured logs
+SESSION_LOG_DIR = 'attendance_logs'
+
+# One fixed-size record per (session, student)
+RECORD_DTYPE = np.dtype([('session', '<u4'), ('student', '<u4'), ('status', 'u1')])
+ABSENT, PRESENT = 0, 1
+
+# 'name (usn)' as written in the text reports
+STUDENT_LINE = re.compile(r'^(.*) \(([^()]*)\)$')
+
+_process_lock = threading.Lock()
+
+
+def log_prefix(attendance_file):
+    """Path prefix of the structured log that mirrors one attendance_*.txt file."""
+    directory, name = os.path.split(os.path.abspath(attendance_file))
+    return os.path.join(directory, SESSION_LOG_DIR, os.path.splitext(name)[0])
+
+
+def parse_student_line(line):
+    """Split 'name (usn)' into (name, usn)."""
+    match = STUDENT_LINE.match(line)
+    return (match.group(1), match.group(2)) if match else (line, line)
+
+
+class SessionLog:
+    """Append-only binary attendance log for one class.
+
+    `<prefix>.records` holds packed (session, student, status) records that
+    readers scan through a memory map. `<prefix>.students` maps student IDs to
+    USN and name, one tab-separated line per ID (a later line for the same ID
+    renames the student). `<prefix>.sessions` lists session timestamps in order.
+    The attendance_*.txt file stays as the human-readable export.
+    """
+
+    def __init__(self, attendance_file):
+        self.attendance_file = attendance_file
+        prefix = log_prefix(attendance_file)
+        self.records_path = f'{prefix}.records'
+        self.students_path = f'{prefix}.students'
+        self.sessions_path = f'{prefix}.sessions'
+        self.lock_path = f'{prefix}.lock'
+
+    def exists(self):
+        return os.path.exists(self.records_path)
+
+    def _students(self):
+        """{student_id: (usn, name)} read from the student table."""
+        students = {}
+        if os.path.exists(self.students_path):
+            with open(self.students_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t', 2)
+                    if len(parts) == 3:
+                        students[int(parts[0])] = (parts[1], parts[2])
+        return students
+
+    def _session_count(self):
+        if not os.path.exists(self.records_path):
+            return 0
+        records = self.records()
+        return int(records[-1]['session']) + 1 if len(records) else 0  # Session IDs only grow
+
+    def _append(self, sessions):
+        """Append (timestamp, present, absent) sessions. Caller holds the log lock."""
+        students = self._students()
+        ids = {usn: student_id for student_id, (usn, _) in students.items()}
+        names = {usn: name for usn, name in students.values()}
+        new_students, session_lines, blocks = [], [], []
+        session_id = self._session_count()
+
+        for timestamp, present, absent in sessions:
+            for status, group in ((PRESENT, present), (ABSENT, absent)):
+                block = np.empty(len(group), dtype=RECORD_DTYPE)
+                for i, (name, usn) in enumerate(group):
+                    if usn not in ids:
+                        ids[usn] = len(ids)
+                    if names.get(usn) != name:
+                        names[usn] = name
+                        new_students.append(f"{ids[usn]}\t{usn}\t{name}\n")
+                    block[i] = (session_id, ids[usn], status)
+                blocks.append(block)
+            session_lines.append(f"{timestamp}\n")
+            session_id += 1
+
+        # Student and session tables first, so every record written refers to known rows
+        with open(self.students_path, 'a', encoding='utf-8') as f:
+            f.writelines(new_students)
+        with open(self.sessions_path, 'a', encoding='utf-8') as f:
+            f.writelines(session_lines)
+        with open(self.records_path, 'ab') as f:
+            # Drop a partial record left by an interrupted write so later records stay aligned
+            end = f.tell()
+            if end % RECORD_DTYPE.itemsize:
+                f.truncate(end - end % RECORD_DTYPE.itemsize)
+            f.write(np.concatenate(blocks).tobytes() if blocks else b'')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _backfill(self):
+        """Import the sessions already in the text report the first time the log is created."""
+        if self.exists() or not os.path.exists(self.attendance_file):
+            return
+        with open(self.attendance_file, 'r', encoding='utf-8') as f:
+            sessions = [(timestamp, [parse_student_line(s) for s in present], [parse_student_line(s) for s in absent])
+                        for timestamp, present, absent in parse_sessions(f.read())]
+        self._append(sessions)
+
+    def append_session(self, timestamp, present_students, absent_students):
+        """Record one session; present/absent are lists of (name, usn)."""
+        os.makedirs(os.path.dirname(self.records_path), exist_ok=True)
+        with _process_lock, open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # Serialize with other server processes
+            self._backfill()
+            self._append([(timestamp, list(present_students), list(absent_students))])
+
+    def records(self):
+        """Memory-mapped view of every complete record."""
+        count = os.path.getsize(self.records_path) // RECORD_DTYPE.itemsize if self.exists() else 0
+        if count == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.records_path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+
+    def counters(self):
+        """Per-student [present, total_sessions] keyed 'name (usn)', aggregated with bincount."""
+        records = self.records()
+        if len(records) == 0:
+            return {}
+        student_ids = np.asarray(records['student'])
+        totals = np.bincount(student_ids)
+        presents = np.bincount(student_ids, weights=np.asarray(records['status']) == PRESENT, minlength=len(totals))
+        students = self._students()
+        return {f"{students[i][1]} ({students[i][0]})" if i in students else str(i): [int(presents[i]), int(totals[i])]
+                for i in np.nonzero(totals)[0]}
+
+
+def counter_sources(attendance_file):
+    """Files load_counters reads for an attendance file: its structured log if there is one, else the text report."""
+    log = SessionLog(attendance_file)
+    if log.exists():
+        return [log.records_path, log.students_path]
+    return [attendance_file]
+
+
+def load_counters(attendance_file):
+    """Counters for an attendance file, from its structured log when one exists.
+
+    Falls back to incrementally parsing the text report. Returns None if
+    neither exists.
+    """
+    log = SessionLog(attendance_file)
+    if log.exists():
+        return log.counters()
+    return IncrementalStats(attendance_file).counters()
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+from googleapiclient.errors import HttpError
+from metrics import google_call
+
+# Seconds before the first retry of a failed write; doubles on every further failure
+SHEET_RETRY_BASE = float(os.environ.get('SHEET_RETRY_BASE', 2))
+
+# Upper bound on the retry delay
+SHEET_RETRY_MAX = float(os.environ.get('SHEET_RETRY_MAX', 300))
+
+# How often the worker looks for due writes when nothing wakes it up
+SHEET_POLL_INTERVAL = 5
+
+# A claimed write is handed to another worker if not finished within this many seconds
+SHEET_CLAIM_LEASE = 120
+
+# Failed writes of one session before it is set aside as failed (see SheetWriteQueue.failed())
+SHEET_MAX_ATTEMPTS = int(os.environ.get('SHEET_MAX_ATTEMPTS', 12))
+
+# Tabs every attendance spreadsheet has
+ATTENDANCE_TABS = ('Present', 'Absent')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    semester TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    section TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    present TEXT NOT NULL,
+    absent TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS failed (
+    id INTEGER PRIMARY KEY,
+    semester TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    section TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    present TEXT NOT NULL,
+    absent TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+def session_row(timestamp, students):
+    """Row written to a tab for one session: the timestamp followed by 'name (usn)' cells."""
+    return [timestamp] + [f"{name} ({usn})" for name, usn in students]
+
+
+def append_cells_request(grid_id, rows):
+    """A spreadsheets.batchUpdate request that appends rows to one tab."""
+    return {'appendCells': {
+        'sheetId': grid_id,
+        'rows': [{'values': [{'userEnteredValue': {'stringValue': value}} for value in row]} for row in rows],
+        'fields': 'userEnteredValue',
+    }}
+
+
+class SheetWriteQueue:
+    """Persistent write-behind queue for attendance sessions bound for Google Sheets.
+
+    take_attendance enqueues a session into a local SQLite file and returns. A
+    background worker drains the queue, coalescing every pending session of a
+    spreadsheet into a single spreadsheets.batchUpdate. Failed writes are
+    retried with exponential backoff, and anything still queued when the
+    process stops is replayed on the next start.
+
+    `resolve_sheet(subject, section, semester)` returns the spreadsheet ID for
+    a class, creating the spreadsheet if needed. `forget_sheet` with the same
+    arguments is called when a write finds the spreadsheet deleted; the write
+    is then retried once against a freshly resolved sheet (the deleted sheet's
+    ID is passed as a fourth argument). A session that still fails after
+    SHEET_MAX_ATTEMPTS writes is moved to the failed table, listed by failed().
+    """
+
+    def __init__(self, db_path, sheets_service, resolve_sheet, forget_sheet=None):
+        self.sheets_service = sheets_service
+        self.resolve_sheet = resolve_sheet
+        self.forget_sheet = forget_sheet
+        self.db_path = db_path
+        self._grid_ids = {}
+        self.reopen()
+        self._conn.executescript(SCHEMA)
+
+    def reopen(self):
+        """Fresh connection, lock and events for a forked child; the worker is not running afterwards."""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+    def enqueue(self, semester, subject, section, present_students, absent_students, timestamp):
+        """Record one session locally and wake the worker."""
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO pending (semester, subject, section, timestamp, present, absent) VALUES (?, ?, ?, ?, ?, ?)',
+                (semester, subject, section, timestamp, json.dumps(list(present_students)), json.dumps(list(absent_students))))
+        self._wakeup.set()
+
+    def depth(self):
+        """Number of sessions not yet written to Sheets."""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    def failed(self):
+        """Sessions given up on after SHEET_MAX_ATTEMPTS failed writes, oldest first."""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM failed ORDER BY id').fetchall()
+        return [{'semester': row['semester'], 'subject': row['subject'], 'section': row['section'],
+                 'timestamp': row['timestamp'], 'attempts': row['attempts'], 'error': row['last_error'],
+                 'failed_at': row['failed_at']} for row in rows]
+
+    def _claim(self, now):
+        """Lease every due session so other worker processes skip them."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    'SELECT * FROM pending WHERE next_attempt <= ? AND claimed_until <= ? ORDER BY id',
+                    (now, now)).fetchall()
+                self._conn.executemany('UPDATE pending SET claimed_until = ? WHERE id = ?',
+                                       [(now + SHEET_CLAIM_LEASE, row['id']) for row in rows])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return rows
+
+    def _finish(self, ids):
+        with self._lock:
+            self._conn.executemany('DELETE FROM pending WHERE id = ?', [(i,) for i in ids])
+
+    def _retry_later(self, rows, error, now):
+        """Back off before writing the sessions again, or set them aside once SHEET_MAX_ATTEMPTS is reached."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for row in rows:
+                    if row['attempts'] + 1 >= SHEET_MAX_ATTEMPTS:
+                        print(f"Giving up on the {row['timestamp']} session of {row['semester']} {row['subject']} "
+                              f"({row['section']}) after {row['attempts'] + 1} failed writes: {error}")
+                        self._conn.execute(
+                            'INSERT OR REPLACE INTO failed (id, semester, subject, section, timestamp, present, absent, '
+                            'attempts, last_error, failed_at) SELECT id, semester, subject, section, timestamp, present, '
+                            'absent, attempts + 1, ?, ? FROM pending WHERE id = ?', (str(error), now, row['id']))
+                        self._conn.execute('DELETE FROM pending WHERE id = ?', (row['id'],))
+                        continue
+                    delay = min(SHEET_RETRY_BASE * 2 ** row['attempts'], SHEET_RETRY_MAX) * random.uniform(0.8, 1.2)
+                    self._conn.execute(
+                        'UPDATE pending SET attempts = attempts + 1, next_attempt = ?, claimed_until = 0, last_error = ? '
+                        'WHERE id = ?', (now + delay, str(error), row['id']))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _tab_grid_ids(self, sheet_id):
+        """Grid IDs of the Present and Absent tabs, fetched once per spreadsheet."""
+        if sheet_id not in self._grid_ids:
+            with google_call('spreadsheets.get'):
+                metadata = self.sheets_service.spreadsheets().get(
+                    spreadsheetId=sheet_id, fields='sheets.properties(sheetId,title)').execute()
+            self._grid_ids[sheet_id] = {sheet['properties']['title']: sheet['properties']['sheetId']
+                                        for sheet in metadata.get('sheets', [])}
+        return self._grid_ids[sheet_id]
+
+    def _append_sessions(self, sheet_id, rows):
+        grid_ids = self._tab_grid_ids(sheet_id)
+        present_rows = [session_row(row['timestamp'], json.loads(row['present'])) for row in rows]
+        absent_rows = [session_row(row['timestamp'], json.loads(row['absent'])) for row in rows]
+        requests = [append_cells_request(grid_ids['Present'], present_rows),
+                    append_cells_request(grid_ids['Absent'], absent_rows)]
+        try:
+            with google_call('spreadsheets.batchUpdate'):
+                self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id, body={'requests': requests}).execute()
+        except HttpError:
+            self._grid_ids.pop(sheet_id, None)  # Tabs may have changed; refetch on retry
+            raise
+
+    def _write_class(self, key, rows):
+        """Append every queued session of one class with a single batchUpdate."""
+        semester, subject, section = key
+        sheet_id = self.resolve_sheet(subject, section, semester)
+        if not sheet_id:
+            raise RuntimeError(f"No spreadsheet available for {semester} {subject} ({section})")
+        try:
+            self._append_sessions(sheet_id, rows)
+        except HttpError as e:
+            if e.resp.status != 404 or self.forget_sheet is None:
+                raise
+            # The spreadsheet was deleted since it was last verified; recreate it and write there
+            print(f"Sheet with ID {sheet_id} not found. Creating a new sheet...")
+            self.forget_sheet(subject, section, semester, sheet_id)
+            sheet_id = self.resolve_sheet(subject, section, semester)
+            if not sheet_id:
+                raise
+            self._append_sessions(sheet_id, rows)
+
+    def process_pending(self, now=None):
+        """Write every due session to Sheets once. Returns the number written."""
+        now = time.time() if now is None else now
+        classes = OrderedDict()
+        for row in self._claim(now):
+            classes.setdefault((row['semester'], row['subject'], row['section']), []).append(row)
+
+        written = 0
+        for key, rows in classes.items():
+            try:
+                self._write_class(key, rows)
+            except Exception as e:
+                print(f"Sheet write for {key} failed, will retry: {e}")
+                self._retry_later(rows, e, now)
+                continue
+            self._finish([row['id'] for row in rows])
+            written += len(rows)
+        return written
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(SHEET_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.process_pending()
+            except Exception as e:
+                print(f"Sheet write worker error: {e}")
+
+    def start(self):
+        """Start the background worker; sessions left from a previous run are replayed."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sheet-write-queue', daemon=True)
+            self._thread.start()
+            self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
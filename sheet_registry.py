@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the in-process lock still applies
+    fcntl = None
+
+# Single index of every class spreadsheet, replacing the scattered *_sheet_id.txt files
+SHEET_REGISTRY_FILE = 'sheet_registry.json'
+
+# Where the app keeps the registry and the legacy files: the directory it runs from.
+# The admin scripts look there too unless given --directory.
+SHEET_REGISTRY_DIR = '.'
+
+# Suffix of the legacy per-class files: {subject}_{section}_{semester}_sheet_id.txt
+LEGACY_SUFFIX = '_sheet_id.txt'
+
+# Seconds a successful existence check stays valid before the sheet is verified again
+SHEET_VERIFY_TTL = float(os.environ.get('SHEET_VERIFY_TTL', 6 * 3600))
+
+
+def registry_key(semester, subject, section):
+    return f"{semester}|{subject}|{section}"
+
+
+def parse_legacy_filename(filename):
+    """Return (semester, subject, section) for a legacy sheet ID file name, or None."""
+    if not filename.endswith(LEGACY_SUFFIX):
+        return None
+    parts = filename[:-len(LEGACY_SUFFIX)].rsplit('_', 2)
+    if len(parts) != 3:
+        return None
+    subject, section, semester = parts
+    return semester, subject, section
+
+
+def known_sheet_ids(directory=SHEET_REGISTRY_DIR):
+    """Every sheet ID in `directory`'s registry and legacy *_sheet_id.txt files, without duplicates.
+
+    Read-only, unlike opening a SheetRegistry, which imports the legacy files.
+    """
+    sheet_ids = []
+    registry_path = os.path.join(directory, SHEET_REGISTRY_FILE)
+    if os.path.exists(registry_path):
+        with open(registry_path, 'r') as f:
+            sheet_ids = [entry['sheet_id'] for entry in json.load(f).get('sheets', {}).values()]
+    for filename in sorted(os.listdir(directory)):
+        if parse_legacy_filename(filename) is not None:
+            with open(os.path.join(directory, filename), 'r') as f:
+                sheet_ids.append(f.read().strip())
+    return list(dict.fromkeys(sheet_id for sheet_id in sheet_ids if sheet_id))
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock shared by every process using the registry at `path`."""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+class SheetRegistry:
+    """Maps (semester, subject, section) to its Google Sheet ID.
+
+    Entries remember when the sheet was last confirmed to exist, so callers
+    only hit the API once the TTL has lapsed or a write actually fails.
+
+    Every server process has its own SheetRegistry on the same file. A change
+    re-reads the file under a file lock and writes it back with the one entry
+    changed, so changes made by other processes are kept; reads pick up the
+    file again whenever it has been replaced.
+    """
+
+    def __init__(self, path=SHEET_REGISTRY_FILE, legacy_dir=SHEET_REGISTRY_DIR):
+        self.path = path
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._entries = {}
+        self._imported = []
+        self._signature = None
+        with self._lock, _file_lock(path):
+            self._read()
+            if self._import_legacy(legacy_dir):
+                self._save()
+
+    def _read(self):
+        """Load the file if it changed since it was last read or written. Caller holds the lock."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns) == self._signature:
+            return
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self._entries = data.get('sheets', {})
+        self._imported = data.get('imported_files', [])
+        self._signature = (stat.st_ino, stat.st_mtime_ns)
+
+    def _import_legacy(self, directory):
+        """Pull in IDs from old *_sheet_id.txt files, once per file."""
+        imported = 0
+        for filename in os.listdir(directory):
+            key_parts = parse_legacy_filename(filename)
+            if key_parts is None or filename in self._imported:
+                continue
+            self._imported.append(filename)
+            imported += 1
+            if registry_key(*key_parts) in self._entries:
+                continue
+            with open(os.path.join(directory, filename), 'r') as f:
+                sheet_id = f.read().strip()
+            if sheet_id:
+                semester, subject, section = key_parts
+                self._entries[registry_key(*key_parts)] = {'semester': semester, 'subject': subject, 'section': section,
+                                                           'sheet_id': sheet_id, 'verified_at': 0}
+        return imported
+
+    def _save(self):
+        """Write the registry atomically. Caller holds both locks."""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'sheets': self._entries, 'imported_files': self._imported}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._signature = (stat.st_ino, stat.st_mtime_ns)
+
+    def _update(self, change):
+        """Apply change(entries) to the latest file contents and save them, unless it returns False."""
+        with self._lock, _file_lock(self.path):
+            self._read()
+            if change(self._entries) is not False:
+                self._save()
+
+    def get(self, semester, subject, section):
+        """Return the registry entry for a class, or None."""
+        with self._lock:
+            self._read()
+            entry = self._entries.get(registry_key(semester, subject, section))
+            return dict(entry) if entry else None
+
+    def sheet_id(self, semester, subject, section):
+        entry = self.get(semester, subject, section)
+        return entry['sheet_id'] if entry else None
+
+    def is_fresh(self, entry, now=None):
+        """True if the entry was verified within the TTL."""
+        now = time.time() if now is None else now
+        return now - entry.get('verified_at', 0) < SHEET_VERIFY_TTL
+
+    def put(self, semester, subject, section, sheet_id, verified=True):
+        def change(entries):
+            entries[registry_key(semester, subject, section)] = {
+                'semester': semester, 'subject': subject, 'section': section,
+                'sheet_id': sheet_id, 'verified_at': time.time() if verified else 0}
+        self._update(change)
+
+    def mark_verified(self, semester, subject, section):
+        def change(entries):
+            entry = entries.get(registry_key(semester, subject, section))
+            if not entry:
+                return False
+            entry['verified_at'] = time.time()
+        self._update(change)
+
+    def forget(self, semester, subject, section, sheet_id=None):
+        """Drop a class whose spreadsheet no longer exists; with sheet_id, only while that sheet is registered."""
+        def change(entries):
+            entry = entries.get(registry_key(semester, subject, section))
+            if not entry or (sheet_id is not None and entry['sheet_id'] != sheet_id):
+                return False
+            del entries[registry_key(semester, subject, section)]
+        self._update(change)
+
+    def get_or_create(self, semester, subject, section, create, stale_id=None):
+        """The class's sheet ID, calling create() when none is registered or only stale_id, found deleted, is.
+
+        create() makes and registers the spreadsheet and returns its ID (or
+        None). It runs under a file lock, so processes resolving the same new
+        class at once make one spreadsheet between them.
+        """
+        with self._create_lock, _file_lock(f'{self.path}.create'):
+            sheet_id = self.sheet_id(semester, subject, section)
+            if sheet_id and sheet_id != stale_id:
+                return sheet_id
+            if sheet_id:
+                self.forget(semester, subject, section, sheet_id)
+            return create()
+
+    def entries(self):
+        """Snapshot of every registered class spreadsheet."""
+        with self._lock:
+            self._read()
+            return [dict(entry) for entry in self._entries.values()]
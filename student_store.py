@@ -0,0 +1,275 @@
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from gallery import DESCRIPTOR_SIZE, as_descriptor_matrix
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the in-process lock still applies
+    fcntl = None
+
+# Bytes taken by one float32 descriptor row in the descriptor file
+ROW_BYTES = DESCRIPTOR_SIZE * np.dtype(np.float32).itemsize
+
+# Compact the descriptor file once dead rows outnumber live ones by this factor
+COMPACT_DEAD_RATIO = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    usn TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    section TEXT NOT NULL,
+    row_start INTEGER NOT NULL,
+    row_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_students_class ON students (semester, section);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on `path`, shared by every process using the store."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _descriptor_generation(name):
+    """Generation number of a descriptors.<n>.f32 file name, or None for any other file."""
+    parts = name.split('.')
+    if len(parts) == 3 and parts[0] == 'descriptors' and parts[2] == 'f32' and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+
+class StudentStore:
+    """Student roster in SQLite with descriptors in an append-only float32 file.
+
+    Metadata (name, semester, section and the descriptor row range) is keyed by
+    USN with a secondary index on (semester, section). Descriptors are appended
+    to a flat row-major float32 file that is read through a memory map. A write
+    appends the new rows first and then commits the metadata in one SQLite
+    transaction, so a crash at any point leaves the previous state intact.
+    Compaction switches to a new descriptor file and keeps the previous one
+    until the next compaction, for readers still holding the older snapshot.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'students.db')
+        self.reopen()
+        self._conn.executescript(SCHEMA)
+        self._recover()
+
+    def reopen(self):
+        """Open a fresh connection and lock; call in a forked child before using the store."""
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+
+    def _meta(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _descriptor_file(self):
+        return os.path.join(self.directory, self._meta('descriptor_file', 'descriptors.0.f32'))
+
+    def _recover(self):
+        """Drop rows appended by a write that never committed and stale compaction files."""
+        with self._lock:
+            # Hold the write lock so another process cannot be mid-append or mid-compaction
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                path = self._descriptor_file()
+                committed = int(self._meta('next_row', 0)) * ROW_BYTES
+                with open(path, 'ab') as f:
+                    if f.tell() > committed:
+                        f.truncate(committed)
+                self._remove_stale_files(int(self._meta('descriptor_generation', 0)))
+            finally:
+                self._conn.execute('COMMIT')
+
+    def _remove_stale_files(self, generation):
+        """Delete descriptor files other than the current and the previous generation's."""
+        for name in os.listdir(self.directory):
+            number = _descriptor_generation(name)
+            if number is not None and not generation - 1 <= number <= generation:
+                os.remove(os.path.join(self.directory, name))
+
+    def _append_rows(self, matrix):
+        """Write rows at the committed end of the descriptor file. Caller holds the write lock."""
+        start = int(self._meta('next_row', 0))
+        with open(self._descriptor_file(), 'r+b') as f:
+            f.seek(start * ROW_BYTES)
+            f.write(matrix.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        return start
+
+    def _descriptor_map(self):
+        """Memory map of the committed descriptor rows; call within a transaction."""
+        rows = int(self._meta('next_row', 0))
+        if rows == 0:
+            return as_descriptor_matrix([])
+        return np.memmap(self._descriptor_file(), dtype=np.float32, mode='r', shape=(rows, DESCRIPTOR_SIZE))
+
+    def _snapshot(self, query=None, params=()):
+        """Student rows matching `query` and the descriptor rows they point into, from one committed state.
+
+        A compaction in another process may remove the file of an older state
+        before it is mapped; the read is then repeated on the newer state.
+        """
+        with self._lock:
+            for attempt in range(3):
+                self._conn.execute('BEGIN')
+                try:
+                    rows = self._conn.execute(query, params).fetchall() if query else []
+                    return rows, self._descriptor_map()
+                except FileNotFoundError:
+                    if attempt == 2:
+                        raise
+                finally:
+                    self._conn.execute('COMMIT')
+
+    def _record(self, row, descriptors):
+        encodings = np.array(descriptors[row['row_start']:row['row_start'] + row['row_count']])
+        return {'name': row['name'], 'usn': row['usn'], 'semester': row['semester'],
+                'section': row['section'], 'encodings': list(encodings)}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+
+    def version(self):
+        """Counter bumped by every committed write, to tell whether a published gallery is up to date."""
+        with self._lock:
+            return int(self._meta('version', 0))
+
+    def descriptors(self):
+        """Memory-mapped view of every committed descriptor row."""
+        return self._snapshot()[1]
+
+    def get(self, usn):
+        """Look up one student by USN, or None."""
+        rows, descriptors = self._snapshot('SELECT * FROM students WHERE usn = ?', (usn,))
+        return self._record(rows[0], descriptors) if rows else None
+
+    def by_class(self, semester, section):
+        """All students of one (semester, section), served from the secondary index."""
+        rows, descriptors = self._snapshot('SELECT * FROM students WHERE semester = ? AND section = ?',
+                                           (str(semester), str(section)))
+        return [self._record(row, descriptors) for row in rows]
+
+    def all(self):
+        """Every enrolled student with its encodings."""
+        rows, descriptors = self._snapshot('SELECT * FROM students ORDER BY usn')
+        return [self._record(row, descriptors) for row in rows]
+
+    def upsert(self, student):
+        """Add or replace one student. Returns True if the USN already existed."""
+        return self.upsert_many([student])[0]
+
+    def upsert_many(self, students):
+        """Add or replace a batch of students in a single transaction.
+
+        Returns one flag per student telling whether its USN already existed.
+        """
+        if not students:
+            return []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                matrices = [as_descriptor_matrix(student['encodings']) for student in students]
+                start = self._append_rows(np.concatenate(matrices))
+                existed = []
+                dead = int(self._meta('dead_rows', 0))
+                for student, matrix in zip(students, matrices):
+                    old = self._conn.execute('SELECT row_count FROM students WHERE usn = ?',
+                                             (student['usn'],)).fetchone()
+                    existed.append(old is not None)
+                    dead += old['row_count'] if old else 0
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO students (usn, name, semester, section, row_start, row_count) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (student['usn'], student['name'], str(student['semester']), str(student['section']),
+                         start, len(matrix)))
+                    start += len(matrix)
+                self._set_meta('next_row', start)
+                self._set_meta('dead_rows', dead)
+                self._set_meta('version', int(self._meta('version', 0)) + 1)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            if dead > COMPACT_DEAD_RATIO * max(start - dead, 1):
+                self.compact()
+            return existed
+
+    def compact(self):
+        """Rewrite only live descriptor rows into a fresh file and switch to it atomically."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                generation = int(self._meta('descriptor_generation', 0)) + 1
+                new_name = f'descriptors.{generation}.f32'
+                descriptors = self._descriptor_map()
+                rows = self._conn.execute('SELECT usn, row_start, row_count FROM students ORDER BY semester, section, usn').fetchall()
+                position = 0
+                with open(os.path.join(self.directory, new_name), 'wb') as f:
+                    for row in rows:
+                        f.write(np.ascontiguousarray(descriptors[row['row_start']:row['row_start'] + row['row_count']]).tobytes())
+                        self._conn.execute('UPDATE students SET row_start = ? WHERE usn = ?', (position, row['usn']))
+                        position += row['row_count']
+                    f.flush()
+                    os.fsync(f.fileno())
+                del descriptors
+                self._set_meta('descriptor_file', new_name)
+                self._set_meta('descriptor_generation', generation)
+                self._set_meta('next_row', position)
+                self._set_meta('dead_rows', 0)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._remove_stale_files(generation)
+
+    def migrate_pickle(self, pickle_file):
+        """One-shot import of the legacy append-stream encodings.pkl.
+
+        The pickle is renamed to `<name>.migrated` afterwards so the import never
+        runs twice; server processes starting together take turns, and all but
+        the first find it gone. Returns the number of students imported.
+        """
+        with _file_lock(os.path.join(self.directory, 'migrate.lock')):
+            if not os.path.exists(pickle_file):
+                return 0
+            students = {}
+            with open(pickle_file, 'rb') as f:
+                while True:
+                    try:
+                        student = pickle.load(f)
+                    except EOFError:
+                        break
+                    students[student['usn']] = student
+            if students:
+                self.upsert_many(list(students.values()))
+            os.replace(pickle_file, f'{pickle_file}.migrated')
+            return len(students)
@@ -0,0 +1,241 @@
+"""In-memory stand-ins for the Google Sheets and Drive clients, recording every call."""
+import re
+import copy
+import time
+import itertools
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def http_error(status, reason='Injected failure'):
+    """Build an HttpError like the ones googleapiclient raises."""
+    response = httplib2.Response({'status': status})
+    response.reason = reason
+    return HttpError(response, reason.encode())
+
+
+class FakeRequest:
+    def __init__(self, backend, method, func):
+        self.backend = backend
+        self.method = method
+        self.func = func
+
+    def execute(self, http=None, num_retries=0):
+        return self.backend.call(self.method, self.func)
+
+
+class FakeBackend:
+    """Shared state and bookkeeping for the fake services."""
+
+    def __init__(self, latency=0.0):
+        self._lock = threading.Lock()
+        self.calls = []
+        self._failures = []
+        self.latency = latency
+
+    def fail_next(self, count=1, status=503):
+        """Make the next `count` executed calls raise an HttpError with `status`."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def call(self, method, func, round_trip=True):
+        with self._lock:
+            self.calls.append(method)
+            status = self._failures.pop(0) if self._failures else None
+        if round_trip and self.latency:
+            time.sleep(self.latency)
+        if status is not None:
+            raise http_error(status)
+        with self._lock:
+            return func()
+
+    def count(self, method):
+        return sum(1 for call in self.calls if call == method)
+
+
+class FakeSheetsService(FakeBackend):
+    """Fake of build('sheets', 'v4', ...)."""
+
+    def __init__(self):
+        super().__init__()
+        self.spreadsheets_data = {}
+        self._ids = itertools.count(1)
+
+    def spreadsheets(self):
+        return _FakeSpreadsheets(self)
+
+    def _sheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets_data:
+            raise http_error(404, 'Requested entity was not found.')
+        return self.spreadsheets_data[spreadsheet_id]
+
+    def tab_rows(self, spreadsheet_id, title):
+        """Rows currently stored in one tab, for assertions and inspection."""
+        for tab in self._sheet(spreadsheet_id)['sheets']:
+            if tab['properties']['title'] == title:
+                return tab['rows']
+        raise KeyError(title)
+
+
+class _FakeSpreadsheets:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, body, fields=None):
+        def run():
+            spreadsheet_id = f"fake-sheet-{next(self.service._ids)}"
+            tabs = []
+            for grid_id, tab in enumerate(body.get('sheets', [{'properties': {'title': 'Sheet1'}}])):
+                properties = {'sheetId': grid_id, **copy.deepcopy(tab['properties'])}
+                tabs.append({'properties': properties, 'rows': []})
+            self.service.spreadsheets_data[spreadsheet_id] = {'spreadsheetId': spreadsheet_id,
+                                                              'properties': copy.deepcopy(body.get('properties', {})),
+                                                              'sheets': tabs}
+            return {'spreadsheetId': spreadsheet_id}
+        return FakeRequest(self.service, 'spreadsheets.create', run)
+
+    def get(self, spreadsheetId, fields=None, ranges=None, includeGridData=False):
+        def run():
+            sheet = self.service._sheet(spreadsheetId)
+            return {'spreadsheetId': spreadsheetId, 'properties': copy.deepcopy(sheet['properties']),
+                    'sheets': [{'properties': copy.deepcopy(tab['properties'])} for tab in sheet['sheets']]}
+        return FakeRequest(self.service, 'spreadsheets.get', run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            sheet = self.service._sheet(spreadsheetId)
+            tabs = {tab['properties']['sheetId']: tab for tab in sheet['sheets']}
+            for request in body['requests']:
+                append = request['appendCells']
+                tabs[append['sheetId']]['rows'].extend(
+                    [cell['userEnteredValue']['stringValue'] for cell in row['values']] for row in append['rows'])
+            return {'spreadsheetId': spreadsheetId, 'replies': [{} for _ in body['requests']]}
+        return FakeRequest(self.service, 'spreadsheets.batchUpdate', run)
+
+    def values(self):
+        return _FakeValues(self.service)
+
+
+class _FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def _tab(self, spreadsheet_id, a1_range):
+        title = a1_range.split('!')[0]
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+        for tab in self.service._sheet(spreadsheet_id)['sheets']:
+            if tab['properties']['title'] == title:
+                return tab
+        raise http_error(400, f'Unable to parse range: {a1_range}')
+
+    def append(self, spreadsheetId, range, valueInputOption, body, insertDataOption=None):
+        def run():
+            self._tab(spreadsheetId, range)['rows'].extend(copy.deepcopy(body['values']))
+            return {'spreadsheetId': spreadsheetId}
+        return FakeRequest(self.service, 'values.append', run)
+
+    def clear(self, spreadsheetId, range, body=None):
+        def run():
+            self._tab(spreadsheetId, range)['rows'].clear()
+            return {'spreadsheetId': spreadsheetId, 'clearedRange': range}
+        return FakeRequest(self.service, 'values.clear', run)
+
+    def batchClear(self, spreadsheetId, body):
+        def run():
+            tabs = [self._tab(spreadsheetId, a1_range) for a1_range in body['ranges']]
+            for tab in tabs:
+                tab['rows'].clear()
+            return {'spreadsheetId': spreadsheetId, 'clearedRanges': list(body['ranges'])}
+        return FakeRequest(self.service, 'values.batchClear', run)
+
+
+class FakeDriveService(FakeBackend):
+    """Fake of build('drive', 'v3', ...), including batch HTTP requests."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.permissions_data = {}
+        self.files_data = {}
+        self._ids = itertools.count(1)
+
+    def add_file(self, name, mime_type='application/vnd.google-apps.spreadsheet'):
+        """Seed the fake Drive with a file and return its ID."""
+        file_id = f"fake-file-{next(self._ids)}"
+        self.files_data[file_id] = {'id': file_id, 'name': name, 'mimeType': mime_type}
+        return file_id
+
+    def _file(self, file_id):
+        if file_id not in self.files_data:
+            raise http_error(404, f'File not found: {file_id}.')
+        return self.files_data[file_id]
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def permissions(self):
+        return _FakePermissions(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+
+class _FakeFiles:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q=None, fields=None, pageSize=100, pageToken=None, **kwargs):
+        def run():
+            mime_type = re.search(r"mimeType\s*=\s*'([^']+)'", q or '')
+            files = [f for f in self.service.files_data.values() if not mime_type or f['mimeType'] == mime_type.group(1)]
+            start = int(pageToken or 0)
+            result = {'files': copy.deepcopy(files[start:start + pageSize])}
+            if start + pageSize < len(files):
+                result['nextPageToken'] = str(start + pageSize)
+            return result
+        return FakeRequest(self.service, 'files.list', run)
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(self.service, 'files.get', lambda: copy.deepcopy(self.service._file(fileId)))
+
+    def delete(self, fileId, **kwargs):
+        def run():
+            self.service._file(fileId)
+            del self.service.files_data[fileId]
+            return ''
+        return FakeRequest(self.service, 'files.delete', run)
+
+
+class _FakeBatch:
+    """Runs its requests in one round trip; each one succeeds or fails on its own."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.service.call('batch', lambda: None)
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = self.service.call(request.method, request.func, round_trip=False), None
+            except HttpError as e:
+                response, error = None, e
+            if callback is not None:
+                callback(request_id, response, error)
+
+
+class _FakePermissions:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, fileId, body, fields=None):
+        def run():
+            self.service.permissions_data.setdefault(fileId, []).append(copy.deepcopy(body))
+            return {'id': f'perm-{len(self.service.permissions_data[fileId])}'}
+        return FakeRequest(self.service, 'permissions.create', run)
@@ -0,0 +1,59 @@
+import numpy as np
+from ann_index import IVFIndex
+from gallery import pairwise_distances
+
+
+def clustered(students=200, per_student=3, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(students, 128)).astype(np.float32)
+    vectors = np.repeat(centres, per_student, axis=0) + rng.normal(scale=0.05, size=(students * per_student, 128))
+    labels = np.repeat([f'U{i}' for i in range(students)], per_student)
+    return vectors.astype(np.float32), labels, centres
+
+
+def exact(vectors, labels, queries):
+    dists = pairwise_distances(queries, vectors)
+    nearest = dists.argmin(axis=1)
+    return dists[np.arange(len(queries)), nearest], labels[nearest]
+
+
+def test_probing_every_list_matches_exact_search():
+    vectors, labels, centres = clustered()
+    index = IVFIndex.build(vectors, labels, n_lists=16)
+    distances, found = index.search(centres, nprobe=16)
+    exact_distances, exact_labels = exact(vectors, labels, centres)
+    np.testing.assert_allclose(distances, exact_distances, rtol=1e-4, atol=1e-4)
+    assert list(found) == list(exact_labels)
+
+
+def test_default_probe_finds_the_enrolled_student():
+    vectors, labels, centres = clustered()
+    _, found = IVFIndex.build(vectors, labels, n_lists=16).search(centres, nprobe=4)
+    assert np.mean(found == np.array([f'U{i}' for i in range(len(centres))])) >= 0.95
+
+
+def test_update_replaces_a_students_rows():
+    vectors, labels, centres = clustered()
+    index = IVFIndex.build(vectors, labels, n_lists=16)
+    index.update_many({'U0': [centres[1]], 'NEW': [centres[2]]})
+    assert len(index) == len(vectors) - 3 + 2
+    assert (index.labels == 'U0').sum() == 1
+    distances, found = index.search(centres[:3], nprobe=16)
+    assert found[0] != 'U0' and found[1] == 'U0' and found[2] == 'NEW'
+    assert distances[1] == distances[2] == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors, labels, centres = clustered(students=50)
+    index = IVFIndex.build(vectors, labels, n_lists=4)
+    path = str(tmp_path / 'ann_index.npz')
+    assert IVFIndex.load(path) is None
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert (loaded.generation, loaded.version) == (None, None)
+    index.generation, index.version = 3, 7
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert (loaded.generation, loaded.version) == (3, 7)
+    for result, expected in zip(loaded.search(centres), index.search(centres)):
+        np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,61 @@
+import json
+from attendance_stats import IncrementalStats, count_sessions, percentages
+
+
+def session(timestamp, present, absent):
+    return (f'--- Attendance Session: {timestamp} ---\nPresent Students:\n'
+            + ''.join(f'{student}\n' for student in present) + 'Absent Students:\n'
+            + ''.join(f'{student}\n' for student in absent) + '\n')
+
+
+SESSIONS = [session(f'2024-01-{day:02d} 09:00:00', present, absent) for day, (present, absent) in enumerate([
+    (['Al (1)', 'Bo (2)'], ['Cy (3)']),
+    (['Al (1)'], ['Bo (2)', 'Cy (3)']),
+    (['Cy (3)', "D'Souza, E. (4)"], ['Al (1)', 'Bo (2)']),
+    ([], ['Al (1)', 'Bo (2)', 'Cy (3)', "D'Souza, E. (4)"]),
+], start=1)]
+
+
+def full_parse(path):
+    with open(path, encoding='utf-8') as f:
+        return dict(count_sessions(f.read()))
+
+
+def test_appends_are_counted_like_a_full_reparse(tmp_path):
+    path = tmp_path / 'attendance_5_DBMS_A.txt'
+    path.write_text('')
+    for text in SESSIONS:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(text)
+        assert dict(IncrementalStats(str(path)).counters()) == full_parse(path)
+    assert IncrementalStats(str(path)).percentages() == percentages(full_parse(path))
+
+    # Everything but the last session is settled in the sidecar
+    with open(tmp_path / '.attendance_stats' / 'attendance_5_DBMS_A.txt.json') as f:
+        state = json.load(f)
+    assert state['offset'] == len(''.join(SESSIONS[:-1]).encode())
+
+
+def test_a_session_still_being_written_is_recounted(tmp_path):
+    path = tmp_path / 'attendance_5_DBMS_A.txt'
+    half = len(SESSIONS[1]) // 2
+    path.write_text(SESSIONS[0] + SESSIONS[1][:half])
+    stats = IncrementalStats(str(path))
+    assert dict(stats.counters()) == full_parse(path)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(SESSIONS[1][half:] + SESSIONS[2])
+    assert dict(stats.counters()) == full_parse(path)
+
+
+def test_rewritten_or_truncated_files_are_parsed_again(tmp_path):
+    path = tmp_path / 'attendance_5_DBMS_A.txt'
+    path.write_text(''.join(SESSIONS))
+    stats = IncrementalStats(str(path))
+    stats.counters()
+
+    path.write_text(''.join(SESSIONS[1:]))  # First session removed, so the head of the file changed
+    assert dict(stats.counters()) == full_parse(path)
+    path.write_text(SESSIONS[1])
+    assert dict(stats.counters()) == full_parse(path)
+    path.unlink()
+    assert stats.counters() is None and stats.percentages() is None
@@ -0,0 +1,111 @@
+import io
+import os
+import zipfile
+import numpy as np
+import pytest
+
+pytest.importorskip('dlib')  # bulk_enroll runs photos through the dlib pipeline
+
+import bulk_enroll
+from bulk_enroll import (RosterError, read_roster, group_photos, open_batch, plan_batch, enroll_batch,
+                         ArchiveBatch, DirectoryBatch)
+from face_pipeline import PipelineResult
+from student_store import StudentStore
+
+ROSTER = 'USN , Name,Semester,SECTION\n1am22ci001,Asha Rao,5,A\n\n1AM22CI002,"Rao, B. ",5,A\n1AM22CI003,Chen,5,B\n'
+
+# Photo contents stand in for images: the number of faces the fake pipeline finds in them
+PHOTOS = {
+    '1AM22CI001/front.jpg': b'1', '1AM22CI001/left.JPG': b'1', '1AM22CI001/notes.txt': b'9',
+    '1am22ci002/group.png': b'3', '1am22ci002/blurred.png': b'0',
+    '1AM22CI009/stranger.jpg': b'1',
+    '.DS_Store': b'', '__MACOSX/1AM22CI001/._front.jpg': b'1', '1AM22CI001/.hidden.jpg': b'1',
+}
+
+
+def fake_pipeline(files):
+    counts = []
+    for file in files:
+        with file:
+            counts.append(int(file.read()))
+    encodings = [np.full(128, i, dtype=np.float32) for i in range(sum(counts))]
+    return PipelineResult(encodings, counts, {'total': 0.0}, 0, None)
+
+
+def write_zip(path, top=''):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in PHOTOS.items():
+            archive.writestr(top + name, data)
+    return str(path)
+
+
+def write_directory(root):
+    for name, data in PHOTOS.items():
+        os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(data)
+    return str(root)
+
+
+def test_roster_columns_and_rows_are_normalized(tmp_path):
+    (tmp_path / 'roster.csv').write_text('\ufeff' + ROSTER, encoding='utf-8')  # As saved by Excel
+    with open(tmp_path / 'roster.csv', newline='', encoding='utf-8-sig') as f:
+        roster = read_roster(f)
+    assert list(roster) == ['1AM22CI001', '1AM22CI002', '1AM22CI003']
+    assert roster['1AM22CI002'] == {'name': 'Rao, B.', 'semester': '5', 'section': 'A'}
+
+
+@pytest.mark.parametrize('text, message', [
+    ('usn,name,semester\n1,A,5\n', 'section'),
+    ('usn,name,semester,section\n1,,5,A\n', 'line 2'),
+    ('usn,name,semester,section\n1,A,5,A\n1,B,5,A\n', 'repeats USN 1'),
+    ('usn,name,semester,section\n1,Rao, B.,5,A\n', 'line 2 has more cells'),
+    ('', 'missing'),
+])
+def test_bad_rosters_are_rejected(text, message):
+    with pytest.raises(RosterError, match=message):
+        read_roster(io.StringIO(text))
+
+
+def test_photos_are_grouped_by_folder():
+    assert group_photos(PHOTOS) == {
+        '1AM22CI001': ['1AM22CI001/front.jpg', '1AM22CI001/left.JPG'],
+        '1AM22CI002': ['1am22ci002/blurred.png', '1am22ci002/group.png'],
+        '1AM22CI009': ['1AM22CI009/stranger.jpg'],
+    }
+
+
+def test_zip_and_directory_batches_plan_alike(tmp_path):
+    roster = read_roster(io.StringIO(ROSTER))
+    plans = [plan_batch(open_batch(write_zip(tmp_path / 'flat.zip')), roster),
+             plan_batch(open_batch(write_zip(tmp_path / 'nested.zip', top='batch/')), roster),
+             plan_batch(open_batch(write_directory(tmp_path / 'photos')), roster)]
+    assert isinstance(open_batch(str(tmp_path / 'photos')), DirectoryBatch)
+    assert isinstance(open_batch(str(tmp_path / 'flat.zip')), ArchiveBatch)
+    for photos, report in plans:
+        assert {usn: len(paths) for usn, paths in photos.items()} == {'1AM22CI001': 2, '1AM22CI002': 2}
+        assert report == {'roster': 3, 'missing_photos': ['1AM22CI003'], 'unknown_folders': ['1AM22CI009']}
+    with pytest.raises(RosterError):
+        open_batch(io.BytesIO(b'not a zip'))
+
+
+def test_only_single_face_photos_are_enrolled(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_enroll, 'process_images', fake_pipeline)
+    roster = read_roster(io.StringIO(ROSTER))
+    batch = open_batch(write_zip(tmp_path / 'batch.zip'))
+    store = StudentStore(str(tmp_path / 'data'))
+
+    students, report = enroll_batch(batch, roster, store, dry_run=True)
+    assert len(store) == 0 and report['dry_run']
+    assert [(s['usn'], len(s['encodings'])) for s in students] == [('1AM22CI001', 2)]
+
+    students, report = enroll_batch(batch, roster, store)
+    assert (report['enrolled'], report['updated'], report['photos']) == (1, 0, 4)
+    assert report['not_enrolled'] == ['1AM22CI002']
+    assert report['no_face'] == [{'usn': '1AM22CI002', 'name': 'Rao, B.', 'photos': ['1am22ci002/blurred.png']}]
+    assert report['multiple_faces'] == [{'usn': '1AM22CI002', 'name': 'Rao, B.',
+                                         'photos': [{'photo': '1am22ci002/group.png', 'faces': 3}]}]
+    enrolled = store.get('1AM22CI001')
+    assert (enrolled['name'], enrolled['semester'], enrolled['section']) == ('Asha Rao', '5', 'A')
+    assert len(enrolled['encodings']) == 2
+    assert enroll_batch(batch, roster, store)[1]['updated'] == 1
@@ -0,0 +1,104 @@
+import pytest
+import drive_admin
+from drive_admin import DriveAdmin, DRIVE_MAX_RETRIES, DRIVE_PAGE_SIZE, is_retryable
+from fake_google import FakeDriveService, FakeRequest, http_error
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(drive_admin.time, 'sleep', delays.append)
+    return delays
+
+
+def seeded(count):
+    service = FakeDriveService()
+    ids = [service.add_file(f'Attendance {i}') for i in range(count)]
+    return service, ids
+
+
+def test_list_files_follows_every_page():
+    service, ids = seeded(2 * DRIVE_PAGE_SIZE + 5)
+    service.add_file('notes.txt', mime_type='text/plain')
+
+    files = list(DriveAdmin(service).list_files())
+    assert [f['id'] for f in files] == ids
+    assert service.count('files.list') == 3
+
+
+def test_get_many_batches_calls_and_reports_missing_files():
+    service, ids = seeded(250)
+    progress = []
+    admin = DriveAdmin(service, batch_size=100, progress=lambda done, total: progress.append((done, total)))
+
+    found, errors = admin.get_many(ids + ['gone'])
+    assert errors == {}
+    assert found['gone'] is None
+    assert [found[file_id]['name'] for file_id in ids[:2]] == ['Attendance 0', 'Attendance 1']
+    assert admin.stats == {'requests': 251, 'batches': 3, 'retries': 0}
+    assert service.count('batch') == 3
+    assert progress[-1] == (251, 251)
+
+
+def test_rate_limited_batch_is_retried_with_growing_delays(sleeps):
+    service, ids = seeded(10)
+    service.fail_next(3, status=429)  # The batch round trip itself fails three times
+
+    found, errors = DriveAdmin(service, workers=1).get_many(ids)
+    assert errors == {} and len(found) == 10
+    assert len(sleeps) == 3
+    assert sleeps[0] <= drive_admin.DRIVE_RETRY_BASE * 1 and sleeps[2] >= drive_admin.DRIVE_RETRY_BASE * 2
+
+
+def test_only_failed_calls_of_a_batch_are_retried(sleeps):
+    service, ids = seeded(5)
+    throttled = {ids[1]: 2, ids[3]: 1}
+    runs = []
+
+    def make_request(file_id):
+        def run():
+            runs.append(file_id)
+            if throttled.get(file_id):
+                throttled[file_id] -= 1
+                raise http_error(403, 'User rate limit exceeded: rateLimitExceeded')
+            return {'id': file_id}
+        return FakeRequest(service, 'files.get', run)
+
+    admin = DriveAdmin(service, workers=1)
+    results = admin.run_batched(make_request, ids)
+    assert {file_id: response['id'] for file_id, (response, error) in results.items() if error is None} == \
+        {file_id: file_id for file_id in ids}
+    assert runs.count(ids[0]) == 1 and runs.count(ids[1]) == 3 and runs.count(ids[3]) == 2
+    assert admin.stats['retries'] == 3 and service.count('batch') == 3
+
+
+def test_persistent_errors_are_reported_after_the_last_retry(sleeps):
+    service, ids = seeded(3)
+    service.fail_next(DRIVE_MAX_RETRIES + 1, status=503)
+
+    found, errors = DriveAdmin(service).get_many(ids)
+    assert found == {} and set(errors) == set(ids)
+    assert len(sleeps) == DRIVE_MAX_RETRIES
+
+
+def test_only_rate_limits_and_server_errors_are_retryable():
+    assert is_retryable(http_error(429)) and is_retryable(http_error(503))
+    assert is_retryable(http_error(403, 'rateLimitExceeded'))
+    assert not is_retryable(http_error(403, 'The caller does not have permission'))
+    assert not is_retryable(http_error(404)) and not is_retryable(ValueError())
+
+
+def test_delete_many_dry_run_changes_nothing():
+    service, ids = seeded(4)
+    files = [{'id': file_id, 'name': 'x'} for file_id in ids]
+
+    report = DriveAdmin(service, dry_run=True).delete_many(files)
+    assert report['dry_run'] and len(report['deleted']) == 4
+    assert len(service.files_data) == 4 and service.count('files.delete') == 0
+
+    del service.files_data[ids[0]]
+    report = DriveAdmin(service).delete_many(files)
+    assert [f['id'] for f in report['missing']] == [ids[0]]
+    assert sorted(f['id'] for f in report['deleted']) == sorted(ids[1:])
+    assert report['failed'] == [] and service.files_data == {}
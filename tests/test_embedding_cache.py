@@ -0,0 +1,51 @@
+import os
+import numpy as np
+from embedding_cache import EmbeddingCache, image_digest
+
+
+def entry(faces):
+    return np.arange(faces * 4).reshape(-1, 4), np.full((faces, 128), 0.5)
+
+
+def disk_bytes(cache):
+    return sum(size for _, size, _ in cache._entries())
+
+
+def test_round_trip_with_quality_rejections(tmp_path):
+    cache = EmbeddingCache('fp', directory=str(tmp_path))
+    digest = image_digest(b'photo')
+    assert cache.get(digest) is None
+
+    boxes, descriptors = entry(2)
+    cache.put(digest, boxes, descriptors, {'blur': 1, 'small': 0})
+    cached_boxes, cached_descriptors, rejected = cache.get(digest)
+    np.testing.assert_array_equal(cached_boxes, boxes)
+    np.testing.assert_array_equal(cached_descriptors, descriptors)
+    assert rejected == {'blur': 1, 'small': 0}
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_entries_without_rejection_counts_are_misses(tmp_path):
+    cache = EmbeddingCache('fp', directory=str(tmp_path))
+    boxes, descriptors = entry(1)
+    np.savez(os.path.join(cache.namespace, 'old.npz'), boxes=boxes, descriptors=descriptors)
+    assert cache.get('old') is None
+
+
+def test_rewriting_an_entry_counts_its_size_once(tmp_path):
+    cache = EmbeddingCache('fp', directory=str(tmp_path))
+    for faces in (3, 1, 1, 2):
+        cache.put('same', *entry(faces))
+    assert cache.stats()['bytes'] == disk_bytes(cache)
+    assert EmbeddingCache('fp', directory=str(tmp_path)).stats()['bytes'] == disk_bytes(cache)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache('fp', directory=str(tmp_path))
+    for i in range(5):
+        cache.put(f'd{i}', *entry(1))
+        os.utime(cache._path(f'd{i}'), (i, i))  # d0 is the least recently used
+    cache.max_bytes = 3.5 * disk_bytes(cache) / 5
+    cache.put('d5', *entry(1))
+    assert sorted(name[:-4] for name in os.listdir(cache.namespace)) == ['d3', 'd4', 'd5']
+    assert cache.stats()['bytes'] == disk_bytes(cache)
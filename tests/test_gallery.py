@@ -0,0 +1,210 @@
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from gallery import FaceGallery, FloatCodec, MATCH_TOLERANCE
+
+CLASSES = [('5', 'A'), ('5', 'B'), ('3', 'A')]
+
+
+def make_students(count, per_student=3, seed=0):
+    """Students with well-separated faces, spread over CLASSES."""
+    rng = np.random.default_rng(seed)
+    students = []
+    for i in range(count):
+        centre = rng.normal(scale=0.1, size=128)
+        semester, section = CLASSES[i % len(CLASSES)]
+        students.append({'name': f'Student {i}', 'usn': f'U{i:03d}', 'semester': semester, 'section': section,
+                         'encodings': list((centre + rng.normal(scale=0.01, size=(per_student, 128))).astype(np.float32))})
+    return students
+
+
+def faces_of(students, seed=1):
+    """One fresh photo of every student plus two strangers."""
+    rng = np.random.default_rng(seed)
+    faces = [np.mean(s['encodings'], axis=0) + rng.normal(scale=0.01, size=128) for s in students]
+    return np.array(faces + list(rng.normal(scale=0.1, size=(2, 128))), dtype=np.float32)
+
+
+def linear_scan(students, faces, semester, section):
+    """The original matcher: the first student of the class with any encoding within the tolerance."""
+    result = []
+    for face in faces:
+        match = None
+        for student in students:
+            if student['semester'] == semester and student['section'] == section:
+                if any(np.linalg.norm(face - enc) < MATCH_TOLERANCE for enc in student['encodings']):
+                    match = (student['name'], student['usn'])
+                    break
+        result.append(match)
+    return result
+
+
+def assert_same_gallery(gallery, students):
+    faces = faces_of(students)
+    for semester, section in CLASSES:
+        assert gallery.assign(faces, semester, section) == linear_scan(students, faces, semester, section)
+        assert sorted(gallery.roster(semester, section)) == \
+            sorted((s['name'], s['usn']) for s in students if (s['semester'], s['section']) == (semester, section))
+    labels = np.array(gallery.row_labels())
+    rows = gallery.row_descriptors()
+    for student in students:
+        np.testing.assert_allclose(rows[labels == student['usn']], np.array(student['encodings']), atol=1e-3)
+
+
+def test_assign_matches_the_linear_scan():
+    students = make_students(30)
+    gallery = FaceGallery(students)
+    assert len(gallery) == 30
+    assert_same_gallery(gallery, students)
+    assert gallery.assign([], '5', 'A') == []
+    assert gallery.assign(faces_of(students), '9', 'Z') == [None] * 32
+
+
+def test_campus_match_finds_every_class():
+    students = make_students(30)
+    faces = faces_of(students)
+    expected = [(s['name'], s['usn']) for s in students] + [None, None]
+    assert FaceGallery(students).assign_all(faces, chunk=7) == expected
+
+
+def test_spliced_upserts_match_a_fresh_build():
+    students = make_students(40)
+    gallery = FaceGallery(students[:25])
+    changes = []
+    gallery.on_change(lambda generation, changed: changes.append((generation, sorted(changed))))
+
+    moved = dict(students[3], semester='3', section='B')  # Changes class
+    refreshed = dict(students[4], encodings=make_students(1, seed=9)[0]['encodings'], name='Renamed')
+    batch = students[25:35] + [moved, refreshed]
+    gallery.upsert_many(batch)
+    gallery.upsert(students[35])
+
+    final = {s['usn']: s for s in students[:25]}
+    final.update({s['usn']: s for s in batch + [students[35]]})
+    final = list(final.values())
+    assert_same_gallery(gallery, final)
+    assert gallery.lookup('U003')['section'] == 'B' and gallery.lookup('U004')['name'] == 'Renamed'
+    fresh = FaceGallery(final)
+    for name in ('descriptors', 'sq_norms', 'owners', 'row_starts', 'summaries', 'radii'):
+        np.testing.assert_allclose(getattr(gallery.snapshot, name), getattr(fresh.snapshot, name), rtol=1e-5)
+    assert gallery.snapshot.students == fresh.snapshot.students
+    assert gallery.snapshot.partitions == fresh.snapshot.partitions
+    assert changes == [(2, sorted(s['usn'] for s in batch)), (3, ['U035'])]
+
+
+def brute_force(students, faces, semester, section):
+    """Nearest descriptor of the class for every face, compared in float64."""
+    members = [s for s in students if (s['semester'], s['section']) == (semester, section)]
+    result = []
+    for face in faces.astype(np.float64):
+        dist, student = min((np.linalg.norm(face - np.asarray(enc, dtype=np.float64)), i)
+                            for i, s in enumerate(members) for enc in s['encodings'])
+        result.append((members[student]['name'], members[student]['usn']) if dist < MATCH_TOLERANCE else None)
+    return result
+
+
+@pytest.mark.parametrize('codec', [FloatCodec('float32'), FloatCodec('float16')], ids=['float32', 'float16'])
+def test_two_stage_matches_brute_force(codec):
+    students = make_students(60, per_student=4)
+    faces = faces_of(students)
+    # Faces part way towards a classmate, so more than one student's summaries are close
+    blended = np.array([0.7 * faces[0] + 0.3 * faces[3], 0.6 * faces[1] + 0.4 * faces[4]], dtype=np.float32)
+    faces = np.concatenate([faces, blended])
+    exact, screened = FaceGallery(students, codec=codec), FaceGallery(students, codec=codec, two_stage=True)
+    for semester, section in CLASSES:
+        expected = brute_force(students, faces, semester, section)
+        assert exact.assign(faces, semester, section) == expected
+        assert screened.assign(faces, semester, section) == expected
+    assert screened.assign_all(faces) == exact.assign_all(faces)
+
+
+def test_float16_halves_the_descriptor_memory():
+    students = make_students(20)
+    full, half = FaceGallery(students), FaceGallery(students, codec=FloatCodec('float16'))
+    assert half.snapshot.descriptors.nbytes * 2 == full.snapshot.descriptors.nbytes
+
+
+def test_product_quantized_gallery_agrees_with_brute_force():
+    from ann_index import ProductQuantizer
+    students = make_students(150, per_student=4)
+    faces = faces_of(students)
+    gallery = FaceGallery(students, codec=ProductQuantizer(subspaces=16))
+    assert gallery.snapshot.descriptors.nbytes == 16 * 150 * 4
+    for semester, section in CLASSES:
+        expected = brute_force(students, faces, semester, section)
+        found = gallery.assign(faces, semester, section)
+        assert np.mean([a == b for a, b in zip(found, expected)]) >= 0.95
+        assert found[-2:] == [None, None]  # Strangers stay unknown
+
+
+def test_keeping_fewer_encodings_still_matches():
+    students = make_students(30, per_student=8)
+    faces = faces_of(students)
+    gallery = FaceGallery(students, max_encodings=3)
+    assert len(gallery.row_labels()) == 30 * 3
+    for semester, section in CLASSES:
+        assert gallery.assign(faces, semester, section) == brute_force(students, faces, semester, section)
+
+
+def _enroll_in_child(directory, students):
+    gallery = FaceGallery.open_shared(directory, lambda: [], version=0)
+    for student in students:
+        gallery.upsert(student)
+
+
+def test_shared_gallery_publishes_to_other_processes(tmp_path):
+    students = make_students(20)
+    directory = str(tmp_path / 'gallery')
+    loads = []
+
+    def load_students():
+        loads.append(True)
+        return students[:10]
+    first = FaceGallery.open_shared(directory, load_students, version=1)
+    second = FaceGallery.open_shared(directory, load_students, version=1)
+    assert len(loads) == 1  # The second process maps what the first published
+    assert_same_gallery(second, students[:10])
+
+    seen = []
+    second.on_change(lambda generation, changed: seen.append(generation))
+    first.upsert_many(students[10:15], version=2)
+    assert second.generation == first.generation == 2
+    assert_same_gallery(second, students[:15])
+    second.upsert(students[15], version=3)
+    assert seen == [3]
+    assert_same_gallery(first, students[:16])
+    assert sorted(name for name in os.listdir(directory) if name.startswith('gen-')) == ['gen-2', 'gen-3']
+
+    # A restart reuses the published gallery unless the store has moved on
+    assert FaceGallery.open_shared(directory, load_students, version=3).generation == 3
+    assert len(loads) == 1
+    assert len(FaceGallery.open_shared(directory, load_students, version=4)) == 10
+    assert len(loads) == 2
+
+
+def test_concurrent_upserts_from_processes_are_all_kept(tmp_path):
+    students = make_students(24)
+    directory = str(tmp_path / 'gallery')
+    FaceGallery.open_shared(directory, lambda: students[:4])
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_enroll_in_child, args=(directory, students[i::4][1:])) for i in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+    gallery = FaceGallery.open_shared(directory, lambda: [], version=0)
+    assert gallery.generation == 1 + 20
+    assert_same_gallery(gallery, students)
+
+
+def test_shared_gallery_keeps_its_codec_settings(tmp_path):
+    students = make_students(12)
+    directory = str(tmp_path / 'gallery')
+    FaceGallery.open_shared(directory, lambda: students, codec=FloatCodec('float16'))
+    reader = FaceGallery.open_shared(directory, lambda: students, codec=FloatCodec('float16'))
+    assert reader.snapshot.descriptors.dtype == np.float16 and reader.generation == 1
+    # A process configured differently republishes with its own settings
+    assert FaceGallery.open_shared(directory, lambda: students).snapshot.descriptors.dtype == np.float32
+    assert reader.snapshot.descriptors.dtype == np.float32
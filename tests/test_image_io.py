@@ -0,0 +1,46 @@
+import io
+import cv2
+import numpy as np
+import pytest
+from image_io import image_size, decode_factor, decode_image, decoded_bytes, estimate_decode_bytes
+
+
+def encoded(width, height, ext):
+    ok, data = cv2.imencode(ext, np.full((height, width, 3), 128, dtype=np.uint8))
+    assert ok
+    return data.tobytes()
+
+
+@pytest.mark.parametrize('ext', ['.jpg', '.png'])
+def test_header_size_matches_the_decoded_image(ext):
+    data = encoded(640, 480, ext)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    assert image_size(data) == (image.shape[1], image.shape[0]) == (640, 480)
+
+
+def test_jpeg_size_after_an_app_segment_and_fill_bytes():
+    data = encoded(320, 200, '.jpg')
+    segment = b'\xff\xe1' + (2 + 1000).to_bytes(2, 'big') + b'\0' * 1000  # An EXIF-sized APP1 block
+    assert image_size(data[:2] + segment + b'\xff' + data[2:]) == (320, 200)
+
+
+def test_unknown_or_truncated_headers():
+    assert image_size(b'GIF89a' + b'\0' * 20) is None
+    assert image_size(encoded(320, 200, '.jpg')[:4]) is None
+    assert image_size(b'') is None
+    assert decoded_bytes(b'junk', 100) == 1000
+
+
+def test_large_photos_decode_at_reduced_scale():
+    assert decode_factor((8000, 6000), 1000) == 8
+    assert decode_factor((2500, 1000), 1000) == 2
+    assert decode_factor((1999, 1000), 1000) == 1
+    assert decode_factor(None, 1000) == 1
+    data = encoded(4000, 2000, '.jpg')
+    assert decode_image(data, max_side=1000).shape == (500, 1000, 3)
+    assert estimate_decode_bytes(io.BytesIO(data), max_side=1000) == 1000 * 500 * 3
+
+
+def test_empty_or_corrupt_uploads_decode_to_none():
+    assert decode_image(b'') is None
+    assert decode_image(b'not an image') is None
@@ -0,0 +1,154 @@
+import io
+import os
+import time
+import pytest
+from job_queue import JobQueue, QueueFull, JOB_CLAIM_LEASE, JOB_MAX_ATTEMPTS, JOB_RESULT_TTL
+
+
+class Busy(Exception):
+    """Stands in for BudgetExceeded: try the job again later."""
+
+
+def make_queue(tmp_path, handler, **options):
+    return JobQueue(str(tmp_path / 'jobs'), handler, workers=1, transient=(Busy,), **options)
+
+
+def submit(queue, photos=(b'photo',)):
+    return queue.submit({'class': '5A'}, [io.BytesIO(photo) for photo in photos])
+
+
+def test_job_runs_with_its_spooled_photos(tmp_path):
+    seen = []
+
+    def handler(params, paths):
+        seen.append((params, [open(path, 'rb').read() for path in paths]))
+        return {'present': 2}
+
+    queue = make_queue(tmp_path, handler)
+    job_id = submit(queue, [b'one', b'two'])
+    assert queue.status(job_id)['state'] == 'queued'
+
+    assert queue.process_next()
+    assert seen == [({'class': '5A'}, [b'one', b'two'])]
+    status = queue.status(job_id)
+    assert (status['state'], status['result'], status['attempts']) == ('done', {'present': 2}, 1)
+    assert not os.path.exists(os.path.join(queue.directory, job_id))
+    assert not queue.process_next()
+
+
+def test_failure_is_reported_without_retrying(tmp_path):
+    def handler(params, paths):
+        raise ValueError('no faces')
+
+    queue = make_queue(tmp_path, handler)
+    job_id = submit(queue)
+    queue.process_next()
+    status = queue.status(job_id)
+    assert (status['state'], status['error']) == ('error', 'no faces')
+
+
+def test_deferrals_do_not_use_up_attempts(tmp_path):
+    calls = []
+
+    def handler(params, paths):
+        calls.append(1)
+        if len(calls) <= JOB_MAX_ATTEMPTS + 2:
+            raise Busy('memory budget full')
+        return {'ok': True}
+
+    queue = make_queue(tmp_path, handler)
+    job_id = submit(queue)
+    for _ in range(JOB_MAX_ATTEMPTS + 2):
+        assert queue.process_next(time.time() + 60)
+        status = queue.status(job_id)
+        assert (status['state'], status['attempts'], status['error']) == ('queued', 0, 'memory budget full')
+        assert not queue.process_next()  # Not due again until the retry delay has passed
+
+    assert queue.process_next(time.time() + 60)
+    status = queue.status(job_id)
+    assert (status['state'], status['result'], status['attempts']) == ('done', {'ok': True}, 1)
+
+
+def test_job_of_a_dead_worker_is_taken_over_then_given_up(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: {'ok': True})
+    job_id = submit(queue)
+    now = 1e9
+    for _ in range(JOB_MAX_ATTEMPTS):
+        assert queue._claim(now)['id'] == job_id  # Claimed by a worker that never finishes
+        assert queue._claim(now + JOB_CLAIM_LEASE - 1) is None
+        now += JOB_CLAIM_LEASE
+
+    assert queue.process_next(now)
+    status = queue.status(job_id)
+    assert status['state'] == 'error'
+    assert 'interrupted too many times' in status['error']
+
+
+def test_worker_whose_lease_expired_cannot_overwrite_the_result(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: {'by': 'second worker'})
+    job_id = submit(queue)
+    stale = queue._claim(1e9)
+
+    assert queue.process_next(1e9 + JOB_CLAIM_LEASE)  # The second worker takes over and finishes
+    queue._finish(stale, 'done', result={'by': 'first worker'})
+    queue._retry_later(stale, 'late deferral')
+
+    status = queue.status(job_id)
+    assert (status['state'], status['result'], status['error']) == ('done', {'by': 'second worker'}, None)
+
+
+def test_full_queue_turns_submissions_away(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: None, max_queued=2)
+    submit(queue)
+    submit(queue)
+    with pytest.raises(QueueFull):
+        submit(queue)
+    assert queue.depth() == {'queued': 2, 'running': 0}
+    assert [name for name in os.listdir(queue.directory) if name.endswith('.tmp')] == []
+
+
+def test_prune_forgets_only_old_finished_jobs(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: {'ok': True})
+    finished = submit(queue)
+    queue.process_next()
+    waiting = submit(queue)
+
+    queue.prune(now=time.time() + JOB_RESULT_TTL + 1)
+    assert queue.status(finished) is None
+    assert queue.status(waiting)['state'] == 'queued'
+
+
+def test_worker_threads_process_submissions(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: {'photos': len(paths)})
+    queue.start()
+    try:
+        job_id = submit(queue, [b'a', b'b', b'c'])
+        for _ in range(200):
+            if queue.status(job_id)['state'] == 'done':
+                break
+            time.sleep(0.01)
+    finally:
+        queue.stop(timeout=5)
+    assert queue.status(job_id)['result'] == {'photos': 3}
+
+
+def test_claim_is_renewed_while_a_long_job_runs(tmp_path):
+    def handler(params, paths):
+        time.sleep(1.0)
+        assert other._claim(time.time()) is None  # Another worker must not take the job over
+        return {'ok': True}
+
+    queue = make_queue(tmp_path, handler, lease=0.3)
+    other = make_queue(tmp_path, handler, lease=0.3)
+    job_id = submit(queue)
+    assert queue.process_next()
+    status = queue.status(job_id)
+    assert (status['state'], status['result'], status['attempts']) == ('done', {'ok': True}, 1)
+
+
+def test_metrics_and_messages_are_named_after_the_queue(tmp_path):
+    queue = make_queue(tmp_path, lambda params, paths: None, name='enroll', max_queued=0)
+    with pytest.raises(QueueFull, match='enroll'):
+        submit(queue)
+    assert queue.rejected.name == 'enroll_jobs_rejected_total'
+    assert queue.wait_seconds.name == 'enroll_job_wait_seconds'
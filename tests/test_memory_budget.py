@@ -0,0 +1,61 @@
+import time
+import threading
+import pytest
+from memory_budget import MemoryBudget, BudgetExceeded
+
+
+def test_reservations_are_released():
+    budget = MemoryBudget(limit_bytes=100, timeout=1)
+    with budget.reserve(60):
+        with budget.reserve(40):
+            assert budget.stats()['in_use_bytes'] == 100
+    assert budget.stats() == {'limit_bytes': 100, 'in_use_bytes': 0, 'waiting': 0, 'rejected': 0}
+
+    with pytest.raises(RuntimeError):
+        with budget.reserve(70):
+            raise RuntimeError('pipeline failed')
+    assert budget.stats()['in_use_bytes'] == 0
+
+
+def test_a_request_larger_than_the_budget_is_turned_away_at_once():
+    budget = MemoryBudget(limit_bytes=100, timeout=10)
+    start = time.monotonic()
+    with pytest.raises(BudgetExceeded) as error:
+        with budget.reserve(101):
+            pass
+    assert error.value.too_large and time.monotonic() - start < 1
+    assert budget.stats()['rejected'] == 1
+
+
+def test_waiting_requests_time_out():
+    budget = MemoryBudget(limit_bytes=100, timeout=0.05)
+    with budget.reserve(80):
+        with pytest.raises(BudgetExceeded) as error:
+            with budget.reserve(30):
+                pass
+    assert not error.value.too_large
+    assert budget.stats() == {'limit_bytes': 100, 'in_use_bytes': 0, 'waiting': 0, 'rejected': 1}
+
+
+def test_waiting_requests_are_served_in_arrival_order():
+    budget = MemoryBudget(limit_bytes=100, timeout=5)
+    order = []
+    held = budget.reserve(90)
+    held.__enter__()
+
+    def request(name, nbytes):
+        with budget.reserve(nbytes):
+            order.append(name)
+
+    threads = []
+    for name, nbytes in (('large', 80), ('small', 10)):  # The small one would fit now but must not jump the queue
+        threads.append(threading.Thread(target=request, args=(name, nbytes)))
+        threads[-1].start()
+        while budget.stats()['waiting'] < len(threads):
+            time.sleep(0.001)
+    assert order == []
+    held.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    assert order == ['large', 'small']
+    assert budget.stats()['in_use_bytes'] == 0
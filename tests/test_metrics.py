@@ -0,0 +1,34 @@
+import os
+import time
+from metrics import ProfileStore, SamplingProfiler
+
+
+def profiled(seconds=0.05):
+    profiler = SamplingProfiler(interval=0.001).start()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+    return profiler.stop()
+
+
+def test_profiles_are_visible_to_every_worker(tmp_path):
+    recording, serving = ProfileStore(str(tmp_path)), ProfileStore(str(tmp_path))  # Two server processes
+    profiler = profiled()
+    profile_id = recording.add('POST /take_attendance', profiler)
+
+    [info] = serving.list()
+    assert (info['id'], info['label']) == (profile_id, 'POST /take_attendance')
+    assert info['samples'] == sum(profiler.samples.values()) > 0
+    assert serving.get(profile_id)['folded'] == profiler.folded()
+    assert serving.get('0' * 12) is None
+    assert serving.get('../profiles') is None
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    store = ProfileStore(str(tmp_path), max_profiles=2)
+    ids = []
+    for i in range(4):
+        ids.append(store.add(f'request {i}', profiled(0.001)))
+        os.utime(tmp_path / f'{ids[-1]}.json', (i, i))
+    assert [info['id'] for info in store.list()] == [ids[3], ids[2]]
+    assert sorted(os.listdir(tmp_path)) == sorted(f'{i}.{ext}' for i in ids[2:] for ext in ('json', 'folded'))
@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+import pytest
+from report_jobs import ReportJobs, parse_threshold, DEFAULT_THRESHOLD
+from session_log import SessionLog, counter_sources, load_counters
+
+
+def wait(jobs, job_id):
+    deadline = time.monotonic() + 10
+    while jobs.status(job_id)['status'] == 'running':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return jobs.status(job_id)
+
+
+class Renderer:
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, file_path, threshold, output_path):
+        self.release.wait()
+        self.calls.append((file_path, threshold))
+        with open(output_path, 'w') as f:
+            f.write(repr(sorted(load_counters(file_path).items())))
+
+
+@pytest.fixture
+def attendance_file(tmp_path):
+    path = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    with open(path, 'w') as f:
+        f.write('--- Attendance Session: 2024-01-01 09:00:00 ---\nPresent Students:\nAl (1)\nAbsent Students:\nBo (2)\n')
+    return path
+
+
+def test_threshold_parsing():
+    assert parse_threshold(None) == parse_threshold(' ') == DEFAULT_THRESHOLD
+    assert parse_threshold('60.5') == 60.5
+    for value in ('abc', '-1', '101', 'nan'):
+        with pytest.raises(ValueError):
+            parse_threshold(value)
+
+
+def test_unchanged_log_is_served_from_the_cache(tmp_path, attendance_file):
+    render = Renderer()
+    jobs = ReportJobs(render, counter_sources, report_dir=str(tmp_path / 'reports'))
+    first = wait(jobs, jobs.submit(attendance_file, 'DBMS'))
+    second = wait(jobs, jobs.submit(attendance_file, 'DBMS'))
+    assert first['status'] == second['status'] == 'success'
+    assert first['pdf_path'] == second['pdf_path'] and os.path.exists(first['pdf_path'])
+    assert len(render.calls) == 1
+    assert wait(jobs, jobs.submit(attendance_file, 'DBMS', 50))['pdf_path'] != first['pdf_path']
+
+
+def test_key_follows_the_session_log_that_is_rendered(tmp_path, attendance_file):
+    render = Renderer()
+    jobs = ReportJobs(render, counter_sources, report_dir=str(tmp_path / 'reports'))
+    SessionLog(attendance_file).append_session('2024-01-02 09:00:00', [('Bo', '2')], [('Al', '1')])
+    before = wait(jobs, jobs.submit(attendance_file, 'DBMS'))
+
+    # Only the session log changes; the text report is exported separately
+    SessionLog(attendance_file).append_session('2024-01-03 09:00:00', [('Bo', '2')], [('Al', '1')])
+    after = wait(jobs, jobs.submit(attendance_file, 'DBMS'))
+    assert after['pdf_path'] != before['pdf_path']
+    with open(after['pdf_path']) as f:
+        assert f.read() == repr(sorted({'Al (1)': [1, 3], 'Bo (2)': [2, 3]}.items()))
+
+
+def test_identical_requests_share_one_job(tmp_path, attendance_file):
+    render = Renderer()
+    render.release.clear()
+    jobs = ReportJobs(render, report_dir=str(tmp_path / 'reports'))
+    job_id = jobs.submit(attendance_file, 'DBMS')
+    assert jobs.submit(attendance_file, 'DBMS') == job_id
+    assert jobs.status(job_id)['pdf_path'] is None
+    render.release.set()
+    assert wait(jobs, job_id)['status'] == 'success'
+    assert len(render.calls) == 1
+
+
+def test_failed_render_leaves_no_file(tmp_path, attendance_file):
+    def fail(file_path, threshold, output_path):
+        open(output_path, 'w').close()
+        raise RuntimeError('boom')
+    jobs = ReportJobs(fail, report_dir=str(tmp_path / 'reports'))
+    job = wait(jobs, jobs.submit(attendance_file, 'DBMS'))
+    assert job['status'] == 'error' and job['message']
+    assert os.listdir(tmp_path / 'reports') == []
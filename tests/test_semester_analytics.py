@@ -0,0 +1,92 @@
+import semester_analytics
+from attendance_stats import count_sessions
+from semester_analytics import SemesterAnalytics, parse_attendance_filename
+
+
+def session(timestamp, present, absent):
+    lines = [f'--- Attendance Session: {timestamp} ---', 'Present Students:']
+    lines += [f'Student {usn} ({usn})' for usn in present] + ['Absent Students:']
+    lines += [f'Student {usn} ({usn})' for usn in absent]
+    return '\n'.join(lines) + '\n\n'
+
+
+def write_log(directory, semester, subject, section, sessions):
+    path = directory / f'attendance_{semester}_{subject}_{section}.txt'
+    with open(path, 'a', encoding='utf-8') as f:
+        for i, (present, absent) in enumerate(sessions):
+            f.write(session(f'2024-01-01 09:{i:02d}:00', present, absent))
+    return path
+
+
+def classes(tmp_path):
+    write_log(tmp_path, '3', 'Maths', 'A', [(['U1', 'U2'], []), (['U1'], ['U2'])])
+    write_log(tmp_path, '5', 'Maths', 'A', [(['U1'], ['U3']), ([], ['U1', 'U3']), (['U3'], ['U1'])])
+    write_log(tmp_path, '5', 'DBMS', 'B', [(['U3'], ['U4'])])
+    write_log(tmp_path, '5', 'OS_Lab', 'A', [(['U4'], [])])
+
+
+def cell(report, usn, semester, subject):
+    row = [student['usn'] for student in report['students']].index(usn)
+    return report['matrix'][row][report['subjects'].index((semester, subject))]
+
+
+def test_filename_parsing():
+    assert parse_attendance_filename('attendance_5_OS_Lab_A.txt') == ('5', 'OS_Lab', 'A')
+    assert parse_attendance_filename('attendance_5_A.txt') is None
+    assert parse_attendance_filename('notes.txt') is None
+
+
+def test_same_subject_in_two_semesters_gets_two_columns(tmp_path):
+    classes(tmp_path)
+    report = SemesterAnalytics(str(tmp_path), workers=1).report()
+    assert report['subjects'] == [('3', 'Maths'), ('5', 'DBMS'), ('5', 'Maths'), ('5', 'OS_Lab')]
+    assert cell(report, 'U1', '3', 'Maths') == 100.0
+    assert cell(report, 'U1', '5', 'Maths') == 33.3
+    assert cell(report, 'U2', '5', 'Maths') is None
+
+    # Overall percentages match counting every log from scratch
+    expected = {}
+    for path in tmp_path.glob('attendance_*.txt'):
+        for student, (present, total) in count_sessions(path.read_text()).items():
+            counts = expected.setdefault(student, [0, 0])
+            counts[0] += present
+            counts[1] += total
+    assert {f"{s['name']} ({s['usn']})": [s['present'], s['total']] for s in report['students']} == expected
+
+    fifth = SemesterAnalytics(str(tmp_path), workers=1).report(semester=5)
+    assert fifth['subjects'] == [('5', 'DBMS'), ('5', 'Maths'), ('5', 'OS_Lab')]
+    assert cell(fifth, 'U1', '5', 'Maths') == 33.3
+
+
+def test_parallel_scan_matches_serial_scan(tmp_path, monkeypatch):
+    monkeypatch.setattr(semester_analytics, 'ANALYTICS_PARALLEL_MIN', 2)
+    classes(tmp_path)
+    serial = SemesterAnalytics(str(tmp_path), workers=1).report()
+    (tmp_path / '.attendance_stats' / 'semester_analytics.json').unlink()
+    analytics = SemesterAnalytics(str(tmp_path), workers=2)
+    try:
+        parallel = analytics.report()
+        assert parallel['rescanned'] == 4
+        for key in ('subjects', 'students', 'matrix', 'classes'):
+            assert parallel[key] == serial[key]
+
+        write_log(tmp_path, '5', 'DBMS', 'B', [(['U4'], ['U3'])])
+        write_log(tmp_path, '3', 'Maths', 'A', [([], ['U1'])])
+        pool = analytics._pool
+        again = analytics.report()
+        assert analytics._pool is pool  # Workers are kept between reports
+        assert again['rescanned'] == 2
+        assert cell(again, 'U1', '3', 'Maths') == 66.7
+    finally:
+        analytics._pool.shutdown()
+
+
+def test_only_changed_logs_are_rescanned(tmp_path):
+    classes(tmp_path)
+    assert SemesterAnalytics(str(tmp_path), workers=1).report()['rescanned'] == 4
+    analytics = SemesterAnalytics(str(tmp_path), workers=1)  # A restarted server reads the cache
+    assert analytics.report()['rescanned'] == 0
+    write_log(tmp_path, '5', 'OS_Lab', 'A', [([], ['U4'])])
+    report = analytics.report(section='A')
+    assert report['rescanned'] == 1
+    assert cell(report, 'U4', '5', 'OS_Lab') == 50.0
@@ -0,0 +1,94 @@
+import multiprocessing
+from attendance_stats import count_sessions
+from session_log import SessionLog, RECORD_DTYPE, load_counters, parse_student_line
+
+SESSIONS = [
+    ('2024-01-01 09:00:00', [('Al', '1'), ('Bo', '2')], [('Cy', '3')]),
+    ('2024-01-02 09:00:00', [('Al', '1')], [('Bo', '2'), ('Cy', '3')]),
+    ('2024-01-03 09:00:00', [('Cy', '3'), ('Dee (Jr)', '4')], [('Al', '1'), ('Bo', '2')]),
+]
+
+
+def record(attendance_file, timestamp, present, absent):
+    """Write one session the way record_attendance does: structured log first, then the text report."""
+    SessionLog(attendance_file).append_session(timestamp, present, absent)
+    with open(attendance_file, 'a') as report:
+        report.write(f"\n--- Attendance Session: {timestamp} ---\nPresent Students:\n")
+        report.writelines(f"{name} ({usn})\n" for name, usn in present)
+        report.write("\nAbsent Students:\n")
+        report.writelines(f"{name} ({usn})\n" for name, usn in absent)
+
+
+def text_counters(attendance_file):
+    with open(attendance_file) as f:
+        return dict(count_sessions(f.read()))
+
+
+def test_student_lines():
+    assert parse_student_line('Al (1)') == ('Al', '1')
+    assert parse_student_line('Dee (Jr) (4)') == ('Dee (Jr)', '4')
+    assert parse_student_line('no usn') == ('no usn', 'no usn')
+
+
+def test_counters_match_the_text_report(tmp_path):
+    attendance_file = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    assert load_counters(attendance_file) is None
+    for session in SESSIONS:
+        record(attendance_file, *session)
+    assert SessionLog(attendance_file).counters() == text_counters(attendance_file)
+    assert len(SessionLog(attendance_file).records()) == 10
+
+
+def test_sessions_already_in_the_text_report_are_imported(tmp_path):
+    attendance_file = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    with open(attendance_file, 'w') as report:  # Written before the structured log existed
+        for timestamp, present, absent in SESSIONS[:2]:
+            report.write(f"\n--- Attendance Session: {timestamp} ---\nPresent Students:\n")
+            report.writelines(f"{name} ({usn})\n" for name, usn in present)
+            report.write("\nAbsent Students:\n")
+            report.writelines(f"{name} ({usn})\n" for name, usn in absent)
+    assert load_counters(attendance_file) == text_counters(attendance_file)  # Parsed from the text
+
+    record(attendance_file, *SESSIONS[2])
+    log = SessionLog(attendance_file)
+    assert log.exists() and log.counters() == text_counters(attendance_file)
+    with open(log.sessions_path) as f:
+        assert f.read().split('\n')[:-1] == [timestamp for timestamp, _, _ in SESSIONS]
+
+
+def test_renamed_students_keep_their_counts(tmp_path):
+    attendance_file = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    log = SessionLog(attendance_file)
+    log.append_session('2024-01-01 09:00:00', [('Al', '1')], [])
+    log.append_session('2024-01-02 09:00:00', [], [('Alan', '1')])
+    assert log.counters() == {'Alan (1)': [1, 2]}
+
+
+def test_a_torn_record_is_dropped_before_the_next_append(tmp_path):
+    attendance_file = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    log = SessionLog(attendance_file)
+    log.append_session(*SESSIONS[0])
+    with open(log.records_path, 'ab') as f:
+        f.write(b'\x07' * (RECORD_DTYPE.itemsize // 2))  # A crash in the middle of a record
+    assert len(log.records()) == 3
+    log.append_session(*SESSIONS[1])
+    assert log.counters() == {'Al (1)': [2, 2], 'Bo (2)': [1, 2], 'Cy (3)': [0, 2]}
+
+
+def _append_sessions(attendance_file, worker):
+    for i in range(20):
+        SessionLog(attendance_file).append_session(f'{worker}-{i}', [(f'S{worker}', str(worker))], [('Common', '0')])
+
+
+def test_appends_from_several_processes_are_all_kept(tmp_path):
+    attendance_file = str(tmp_path / 'attendance_5_DBMS_A.txt')
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_append_sessions, args=(attendance_file, worker)) for worker in range(1, 5)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+    counters = SessionLog(attendance_file).counters()
+    assert counters == dict({f'S{worker} ({worker})': [20, 20] for worker in range(1, 5)}, **{'Common (0)': [0, 80]})
+    assert sorted(set(SessionLog(attendance_file).records()['session'])) == list(range(80))
@@ -0,0 +1,127 @@
+import time
+import pytest
+from fake_google import FakeSheetsService
+from sheet_queue import SheetWriteQueue, ATTENDANCE_TABS, SHEET_CLAIM_LEASE, SHEET_MAX_ATTEMPTS
+
+
+class Classes:
+    """resolve_sheet/forget_sheet pair over the fake Sheets, like the app's registry."""
+
+    def __init__(self, service):
+        self.service = service
+        self.sheets = {}
+        self.forgotten = []
+
+    def resolve(self, subject, section, semester):
+        key = (semester, subject, section)
+        if key not in self.sheets:
+            body = {'properties': {'title': f'Attendance_{semester}_{subject}_{section}'},
+                    'sheets': [{'properties': {'title': tab}} for tab in ATTENDANCE_TABS]}
+            self.sheets[key] = self.service.spreadsheets().create(body=body).execute()['spreadsheetId']
+        return self.sheets[key]
+
+    def forget(self, subject, section, semester, sheet_id=None):
+        assert sheet_id == self.sheets[(semester, subject, section)]
+        self.forgotten.append((semester, subject, section))
+        del self.sheets[(semester, subject, section)]
+
+
+@pytest.fixture
+def setup(tmp_path):
+    service = FakeSheetsService()
+    classes = Classes(service)
+
+    def open_queue():
+        return SheetWriteQueue(str(tmp_path / 'sheet_queue.db'), service, classes.resolve, classes.forget)
+    return service, classes, open_queue
+
+
+def enqueue(queue, subject, timestamp, present=(('Al', '1'),), absent=(('Bo', '2'),)):
+    queue.enqueue('5', subject, 'A', list(present), list(absent), timestamp)
+
+
+def test_sessions_of_a_class_are_written_with_one_batch_update(setup):
+    service, classes, open_queue = setup
+    queue = open_queue()
+    for hour in (9, 10, 11):
+        enqueue(queue, 'DBMS', f'2024-01-01 {hour:02d}:00:00')
+    enqueue(queue, 'OS', '2024-01-01 09:00:00')
+
+    assert queue.process_pending() == 4
+    assert service.count('spreadsheets.batchUpdate') == 2
+    assert queue.depth() == 0
+    sheet_id = classes.sheets[('5', 'DBMS', 'A')]
+    assert service.tab_rows(sheet_id, 'Present') == [[f'2024-01-01 {hour:02d}:00:00', 'Al (1)'] for hour in (9, 10, 11)]
+    assert service.tab_rows(sheet_id, 'Absent')[0] == ['2024-01-01 09:00:00', 'Bo (2)']
+
+
+def test_failed_writes_back_off_and_are_retried(setup):
+    service, classes, open_queue = setup
+    queue = open_queue()
+    enqueue(queue, 'DBMS', '2024-01-01 09:00:00')
+    service.fail_next(1, status=503)
+
+    now = time.time()
+    assert queue.process_pending(now) == 0
+    row = queue._conn.execute('SELECT attempts, next_attempt, last_error FROM pending').fetchone()
+    assert row['attempts'] == 1 and row['next_attempt'] > now and '503' in row['last_error']
+    assert queue.process_pending(now) == 0  # Not due yet
+
+    assert queue.process_pending(row['next_attempt']) == 1
+    assert queue.depth() == 0
+
+
+def test_permanent_failures_are_set_aside(setup):
+    service, classes, open_queue = setup
+    queue = open_queue()
+    enqueue(queue, 'DBMS', '2024-01-01 09:00:00')
+    enqueue(queue, 'OS', '2024-01-01 10:00:00')
+    classes.resolve('DBMS', 'A', '5')
+    service.spreadsheets_data[classes.sheets[('5', 'DBMS', 'A')]]['sheets'].pop()  # No Absent tab: never writable
+
+    now = time.time()
+    for _ in range(SHEET_MAX_ATTEMPTS):
+        queue.process_pending(now)
+        now += 10 ** 6
+    assert queue.depth() == 0
+    failed = queue.failed()
+    assert [(entry['subject'], entry['attempts']) for entry in failed] == [('DBMS', SHEET_MAX_ATTEMPTS)]
+    assert "'Absent'" in failed[0]['error']
+    assert service.tab_rows(classes.sheets[('5', 'OS', 'A')], 'Present') == [['2024-01-01 10:00:00', 'Al (1)']]
+
+
+def test_deleted_spreadsheet_is_recreated_once(setup):
+    service, classes, open_queue = setup
+    queue = open_queue()
+    enqueue(queue, 'DBMS', '2024-01-01 09:00:00')
+    queue.process_pending()
+    old_sheet = classes.sheets[('5', 'DBMS', 'A')]
+    del service.spreadsheets_data[old_sheet]
+
+    enqueue(queue, 'DBMS', '2024-01-02 09:00:00')
+    assert queue.process_pending() == 1
+    assert classes.forgotten == [('5', 'DBMS', 'A')]
+    new_sheet = classes.sheets[('5', 'DBMS', 'A')]
+    assert new_sheet != old_sheet
+    assert service.tab_rows(new_sheet, 'Present') == [['2024-01-02 09:00:00', 'Al (1)']]
+
+
+def test_queued_sessions_survive_a_restart(setup):
+    service, classes, open_queue = setup
+    enqueue(open_queue(), 'DBMS', '2024-01-01 09:00:00')
+
+    restarted = open_queue()
+    assert restarted.depth() == 1
+    assert restarted.process_pending() == 1
+
+
+def test_sessions_claimed_by_another_process_are_skipped_until_the_lease_ends(setup):
+    service, classes, open_queue = setup
+    first, second = open_queue(), open_queue()
+    enqueue(first, 'DBMS', '2024-01-01 09:00:00')
+
+    now = time.time()
+    assert len(first._claim(now)) == 1  # First worker dies holding the claim
+    assert second.process_pending(now) == 0
+    assert second.process_pending(now + SHEET_CLAIM_LEASE) == 1
+    assert service.count('spreadsheets.batchUpdate') == 1
@@ -0,0 +1,100 @@
+import os
+import json
+import multiprocessing
+from sheet_registry import SheetRegistry
+
+
+def open_registry(tmp_path):
+    return SheetRegistry(str(tmp_path / 'sheet_registry.json'), legacy_dir=str(tmp_path))
+
+
+def test_changes_from_other_processes_are_kept(tmp_path):
+    first, second = open_registry(tmp_path), open_registry(tmp_path)
+    first.put('5', 'DBMS', 'A', 'sheet-a')
+    second.put('5', 'OS', 'B', 'sheet-b')
+    first.mark_verified('5', 'DBMS', 'A')
+
+    with open(tmp_path / 'sheet_registry.json') as f:
+        saved = json.load(f)['sheets']
+    assert sorted(entry['sheet_id'] for entry in saved.values()) == ['sheet-a', 'sheet-b']
+    assert first.sheet_id('5', 'OS', 'B') == 'sheet-b'
+    assert second.sheet_id('5', 'DBMS', 'A') == 'sheet-a'
+
+
+def test_forget_is_seen_everywhere_and_not_undone(tmp_path):
+    first, second = open_registry(tmp_path), open_registry(tmp_path)
+    first.put('5', 'DBMS', 'A', 'sheet-a')
+    assert second.get('5', 'DBMS', 'A') is not None
+
+    second.forget('5', 'DBMS', 'A')
+    first.mark_verified('5', 'DBMS', 'A')  # Must not bring back the entry it still had in memory
+    assert first.get('5', 'DBMS', 'A') is None
+    assert open_registry(tmp_path).entries() == []
+
+
+def test_legacy_files_are_imported_once(tmp_path):
+    (tmp_path / 'DBMS_A_5_sheet_id.txt').write_text('legacy-sheet\n')
+    registry = open_registry(tmp_path)
+    assert registry.sheet_id('5', 'DBMS', 'A') == 'legacy-sheet'
+
+    registry.forget('5', 'DBMS', 'A')
+    assert open_registry(tmp_path).get('5', 'DBMS', 'A') is None
+
+
+def _put_many(tmp_path, worker):
+    registry = open_registry(tmp_path)
+    for i in range(20):
+        registry.put(str(worker), f'subject{i}', 'A', f'sheet-{worker}-{i}')
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_put_many, args=(tmp_path, worker)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    assert len(open_registry(tmp_path).entries()) == 4 * 20
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def _resolve_new_class(tmp_path, worker):
+    registry = open_registry(tmp_path)
+
+    def create():
+        with open(tmp_path / 'created.log', 'a') as log:
+            log.write(f'{worker}\n')
+        registry.put('5', 'DBMS', 'A', f'sheet-{worker}')
+        return f'sheet-{worker}'
+    with open(tmp_path / f'resolved-{worker}', 'w') as f:
+        f.write(registry.get_or_create('5', 'DBMS', 'A', create))
+
+
+def test_a_new_class_gets_one_sheet_across_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_resolve_new_class, args=(tmp_path, worker)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    assert len((tmp_path / 'created.log').read_text().split()) == 1
+    resolved = {(tmp_path / f'resolved-{worker}').read_text() for worker in range(4)}
+    assert resolved == {open_registry(tmp_path).sheet_id('5', 'DBMS', 'A')}
+
+
+def test_a_deleted_sheet_is_replaced_once(tmp_path):
+    first, second = open_registry(tmp_path), open_registry(tmp_path)
+    first.put('5', 'DBMS', 'A', 'deleted')
+
+    def create():
+        first.put('5', 'DBMS', 'A', 'replacement')
+        return 'replacement'
+    assert first.get_or_create('5', 'DBMS', 'A', create, stale_id='deleted') == 'replacement'
+    # A second process that also found the old sheet gone uses the replacement instead of making another
+    assert second.get_or_create('5', 'DBMS', 'A', lambda: 'another', stale_id='deleted') == 'replacement'
+    second.forget('5', 'DBMS', 'A', 'deleted')
+    assert first.sheet_id('5', 'DBMS', 'A') == 'replacement'
@@ -0,0 +1,108 @@
+import os
+import pickle
+import numpy as np
+import student_store
+from student_store import StudentStore
+
+
+def student(usn, value, semester='5', section='A', rows=2):
+    return {'usn': usn, 'name': f'Student {usn}', 'semester': semester, 'section': section,
+            'encodings': [np.full(128, value + i, dtype=np.float32) for i in range(rows)]}
+
+
+def encodings(record):
+    return np.array(record['encodings'])
+
+
+def test_upsert_and_lookups(tmp_path):
+    store = StudentStore(str(tmp_path))
+    assert store.upsert_many([student('U1', 1), student('U2', 2, section='B')]) == [False, False]
+    assert store.upsert(student('U1', 10, rows=3)) is True
+
+    assert len(store) == 2
+    np.testing.assert_array_equal(encodings(store.get('U1')), encodings(student('U1', 10, rows=3)))
+    assert [s['usn'] for s in store.by_class('5', 'B')] == ['U2']
+    assert [s['usn'] for s in store.all()] == ['U1', 'U2']
+    assert store.get('nope') is None
+    assert store.version() == 2
+
+
+def test_compaction_keeps_every_student_and_the_previous_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(student_store, 'COMPACT_DEAD_RATIO', 1e9)
+    store = StudentStore(str(tmp_path))
+    store.upsert_many([student(f'U{i}', i) for i in range(5)])
+    for i in range(5):
+        store.upsert(student(f'U{i}', 100 + i, rows=1))
+    before = {s['usn']: encodings(s) for s in store.all()}
+
+    store.compact()
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.f32')) == \
+        ['descriptors.0.f32', 'descriptors.1.f32']
+    store.compact()
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.f32')) == \
+        ['descriptors.1.f32', 'descriptors.2.f32']
+
+    other = StudentStore(str(tmp_path))  # Another process opening the store after the compactions
+    for reader in (store, other):
+        after = {s['usn']: encodings(s) for s in reader.all()}
+        assert after.keys() == before.keys()
+        for usn in before:
+            np.testing.assert_array_equal(after[usn], before[usn])
+    assert len(store.descriptors()) == 5
+
+
+def test_reader_sees_a_compaction_made_by_another_process(tmp_path):
+    store = StudentStore(str(tmp_path))
+    other = StudentStore(str(tmp_path))
+    store.upsert_many([student('U1', 1), student('U2', 2)])
+    store.upsert(student('U1', 7))
+    for _ in range(3):
+        other.compact()  # Removes every file this reader has seen
+    np.testing.assert_array_equal(encodings(store.get('U1')), encodings(student('U1', 7)))
+    by_usn = {s['usn']: s for s in store.by_class('5', 'A')}
+    np.testing.assert_array_equal(encodings(by_usn['U2']), encodings(student('U2', 2)))
+
+
+def test_read_retries_when_a_compaction_removes_its_file(tmp_path, monkeypatch):
+    store = StudentStore(str(tmp_path))
+    other = StudentStore(str(tmp_path))
+    store.upsert_many([student('U1', 1), student('U2', 2)])
+    original = StudentStore._descriptor_map
+    raced = []
+
+    def compact_midway(self):
+        if self is store and not raced:
+            raced.append(True)
+            other.compact()
+            other.compact()  # The file named by the reader's snapshot is gone now
+        return original(self)
+
+    monkeypatch.setattr(StudentStore, '_descriptor_map', compact_midway)
+    assert [s['usn'] for s in store.all()] == ['U1', 'U2']
+    np.testing.assert_array_equal(encodings(store.all()[1]), encodings(student('U2', 2)))
+    assert raced
+
+
+def test_uncommitted_rows_are_dropped_on_open(tmp_path):
+    store = StudentStore(str(tmp_path))
+    store.upsert(student('U1', 1))
+    with open(tmp_path / 'descriptors.0.f32', 'ab') as f:
+        f.write(b'\0' * 512)  # A write that crashed before committing
+    StudentStore(str(tmp_path))
+    assert os.path.getsize(tmp_path / 'descriptors.0.f32') == 2 * student_store.ROW_BYTES
+
+
+def test_pickle_migration_runs_once(tmp_path):
+    pickle_file = tmp_path / 'encodings.pkl'
+    with open(pickle_file, 'wb') as f:
+        for record in (student('U1', 1), student('U2', 2), student('U1', 3)):
+            pickle.dump(record, f)
+
+    store = StudentStore(str(tmp_path / 'data'))
+    assert store.migrate_pickle(str(pickle_file)) == 2
+    np.testing.assert_array_equal(encodings(store.get('U1')), encodings(student('U1', 3)))
+    assert not pickle_file.exists() and (tmp_path / 'encodings.pkl.migrated').exists()
+
+    # A second server process starting at the same time finds it already migrated
+    assert StudentStore(str(tmp_path / 'data')).migrate_pickle(str(pickle_file)) == 0
+    assert len(store) == 2
@@ -0,0 +1,66 @@
+import pytest
+import video_sessions
+from video_sessions import VideoSessionStore, parse_source, parse_window
+
+
+@pytest.fixture
+def store(tmp_path):
+    return VideoSessionStore(str(tmp_path / 'video_sessions.db'))
+
+
+def test_sources_are_camera_indices_or_allow_listed():
+    assert parse_source('2') == 2
+    assert parse_source(None) == 0
+    assert parse_source('rtsp://cam/1', allowed=['rtsp://cam/1']) == 'rtsp://cam/1'
+    for value in ('/etc/passwd', 'rtsp://elsewhere/1', '-1'):
+        with pytest.raises(ValueError):
+            parse_source(value, allowed=['rtsp://cam/1'])
+
+
+def test_window_is_validated_and_clamped():
+    assert parse_window('', 600) == 600
+    assert parse_window('120', 600) == 120
+    assert parse_window('1', 600) == video_sessions.VIDEO_WINDOW_MIN_SECONDS
+    assert parse_window('1e12', 600) == video_sessions.VIDEO_WINDOW_MAX_SECONDS
+    for value in ('soon', 'nan', 'inf'):
+        with pytest.raises(ValueError):
+            parse_window(value, 600)
+
+
+def test_progress_and_stop_are_seen_through_another_connection(store):
+    session_id = store.create({'semester': '5', 'section': 'A'})
+    other = VideoSessionStore(store.db_path)
+
+    assert store.report(session_id, ['Al (U1)'], {'frames_read': 10}) is False
+    entry = other.get(session_id)
+    assert entry['state'] == 'running'
+    assert entry['present'] == ['Al (U1)'] and entry['stats'] == {'frames_read': 10}
+    assert entry['params'] == {'semester': '5', 'section': 'A'}
+
+    assert other.request_stop(session_id)
+    assert store.report(session_id, ['Al (U1)'], {'frames_read': 12}) is True
+    store.finish(session_id, result={'present': [['Al', 'U1']]})
+    entry = other.get(session_id)
+    assert entry['state'] == 'done' and entry['result'] == {'present': [['Al', 'U1']]}
+
+
+def test_unknown_sessions(store):
+    assert store.get('nope') is None
+    assert not store.request_stop('nope')
+
+
+def test_session_without_heartbeat_is_marked_failed(store, monkeypatch):
+    session_id = store.create({})
+    monkeypatch.setattr(video_sessions, 'VIDEO_HEARTBEAT_TIMEOUT', -1)
+    entry = store.get(session_id)
+    assert entry['state'] == 'error' and entry['error']
+    store.finish(session_id, result={'late': True})
+    assert store.get(session_id)['result'] is None
+
+
+def test_finished_sessions_expire(store, monkeypatch):
+    session_id = store.create({})
+    store.finish(session_id, error='Cannot open video source 0')
+    monkeypatch.setattr(video_sessions, 'VIDEO_RESULT_TTL', -1)
+    store.create({})
+    assert store.get(session_id) is None
@@ -0,0 +1,325 @@
+"""Attendance from a classroom camera or video file, tracking faces between sampled detections."""
+import os
+import time
+import argparse
+import threading
+import cv2
+import dlib
+from face_pipeline import load_models, detect_faces, face_landmarks, embed_chips, CHIP_SIZE, CHIP_PADDING
+
+# Longest side of the frame used for detection and tracking; 0 keeps the camera resolution
+VIDEO_MAX_SIDE = int(os.environ.get('VIDEO_MAX_SIDE', 1280))
+
+# Detector upsampling on sampled frames; 1 finds faces down to ~40px at VIDEO_MAX_SIDE but costs ~4x
+VIDEO_DETECT_UPSAMPLE = int(os.environ.get('VIDEO_DETECT_UPSAMPLE', 0))
+
+# Frames between detections: reset to the minimum when faces come or go, doubled while the scene is stable
+VIDEO_DETECT_INTERVAL_MIN = int(os.environ.get('VIDEO_DETECT_INTERVAL_MIN', 3))
+VIDEO_DETECT_INTERVAL_MAX = int(os.environ.get('VIDEO_DETECT_INTERVAL_MAX', 30))
+
+# Visible seconds a student needs within the session window to be marked present
+VIDEO_MIN_PRESENCE_SECONDS = float(os.environ.get('VIDEO_MIN_PRESENCE_SECONDS', 5))
+
+# Length of the session window; capture stops once it has elapsed
+VIDEO_SESSION_SECONDS = float(os.environ.get('VIDEO_SESSION_SECONDS', 3000))
+
+# Correlation tracker peak-to-sidelobe ratio below which a track is considered lost
+TRACK_MIN_PSR = 7.0
+
+# Overlap needed to treat a detection as the continuation of an existing track
+TRACK_MATCH_IOU = 0.3
+
+# Detection rounds a track may go unconfirmed before it is dropped
+TRACK_MAX_MISSES = 2
+
+# Times an unrecognized track is re-embedded (the face may have been turned away at first)
+TRACK_MAX_EMBED_ATTEMPTS = 3
+
+# Smallest face box side (pixels, after clipping to the frame) worth computing a descriptor for
+MIN_EMBED_SIDE = 8
+
+# Longest gap between processed frames credited as visible time
+MAX_CREDIT_GAP = 2.0
+
+
+def box_iou(a, b):
+    """Intersection-over-union of two (left, top, right, bottom) boxes."""
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One face followed across frames, in tracking-frame coordinates."""
+
+    def __init__(self, track_id, frame, box):
+        self.track_id = track_id
+        self.tracker = dlib.correlation_tracker()
+        self.tracker.start_track(frame, dlib.rectangle(*box))
+        self.box = box
+        self.student = None  # (name, usn) once recognized
+        self.embed_attempts = 0
+        self.misses = 0
+
+    def update(self, frame):
+        """Advance the tracker to a new frame. Returns False once the face is lost."""
+        psr = self.tracker.update(frame)
+        position = self.tracker.get_position()
+        self.box = (int(position.left()), int(position.top()), int(position.right()), int(position.bottom()))
+        return psr >= TRACK_MIN_PSR
+
+    def restart(self, frame, box):
+        """Re-anchor the tracker on a fresh detection to stop drift."""
+        self.tracker.start_track(frame, dlib.rectangle(*box))
+        self.box = box
+        self.misses = 0
+
+
+class VideoSession:
+    """Accumulates presence over a stream of frames for one class.
+
+    `match(encodings)` returns the set of (name, usn) recognized among the
+    given descriptors, e.g. `lambda e: gallery.match(e, semester, section)`.
+    Frames are fed with `process_frame(frame, t)` where t is the frame time in
+    seconds; `run_capture` does this for a cv2.VideoCapture source.
+    """
+
+    def __init__(self, match, window_seconds=VIDEO_SESSION_SECONDS, min_presence=VIDEO_MIN_PRESENCE_SECONDS):
+        self.match = match
+        self.window_seconds = window_seconds
+        self.min_presence = min_presence
+        self.models = load_models()
+        self.tracks = []
+        self.visible_seconds = {}  # (name, usn) -> seconds in view
+        self.interval = VIDEO_DETECT_INTERVAL_MIN
+        self.started_at = None
+        self.last_time = None
+        self.next_track_id = 0
+        self.frames_until_detect = 0
+        self.stats = {'frames_read': 0, 'frames_processed': 0, 'detections': 0,
+                      'descriptors': 0, 'processing_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def finished(self, t):
+        return self.started_at is not None and t - self.started_at >= self.window_seconds
+
+    def _scaled(self, frame):
+        """Downscaled grayscale frame for detection and tracking, and its scale factor."""
+        height, width = frame.shape[:2]
+        scale = VIDEO_MAX_SIDE / max(height, width) if VIDEO_MAX_SIDE else 1.0
+        if scale < 1.0:
+            frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame, scale
+
+    def _embed(self, frame, tracks, scale):
+        """Compute one descriptor per track from the full-resolution frame and try to recognize it.
+
+        Boxes are clipped to the frame; a track whose box lies outside it is left for a later detection.
+        """
+        height, width = frame.shape[:2]
+        shapes = dlib.full_object_detections()
+        inside = []
+        for track in tracks:
+            left, top, right, bottom = (int(v / scale) for v in track.box)
+            left, top, right, bottom = max(left, 0), max(top, 0), min(right, width - 1), min(bottom, height - 1)
+            if right - left < MIN_EMBED_SIDE or bottom - top < MIN_EMBED_SIDE:
+                continue
+            inside.append(track)
+            shapes.append(face_landmarks(self.models.shape_predictor, frame, dlib.rectangle(left, top, right, bottom)))
+        if not inside:
+            return
+        tracks = inside
+        chips = dlib.get_face_chips(frame, shapes, size=CHIP_SIZE, padding=CHIP_PADDING)
+        descriptors, _ = embed_chips(list(chips))
+        self.stats['descriptors'] += len(descriptors)
+        for track, descriptor in zip(tracks, descriptors):
+            track.embed_attempts += 1
+            found = self.match([descriptor])
+            if found:
+                track.student = next(iter(found))
+
+    def _detect(self, small):
+        """Run the detector, confirm existing tracks and open tracks for new faces.
+
+        Returns the tracks that still need a descriptor.
+        """
+        self.stats['detections'] += 1
+        boxes = [(f.left(), f.top(), f.right(), f.bottom())
+                 for f in detect_faces(self.models.detector, small, max_side=0, upsample=VIDEO_DETECT_UPSAMPLE)]
+
+        # Greedy association by overlap
+        pairs = sorted(((box_iou(track.box, box), i, j) for i, track in enumerate(self.tracks)
+                        for j, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, i, j in pairs:
+            if overlap < TRACK_MATCH_IOU:
+                break
+            if i in matched_tracks or j in matched_boxes:
+                continue
+            matched_tracks.add(i)
+            matched_boxes.add(j)
+            self.tracks[i].restart(small, boxes[j])
+
+        confirmed = [self.tracks[i] for i in sorted(matched_tracks)]
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+        kept = [track for track in self.tracks if track.misses <= TRACK_MAX_MISSES]
+        lost = len(self.tracks) - len(kept)
+
+        new_tracks = []
+        for j, box in enumerate(boxes):
+            if j not in matched_boxes:
+                new_tracks.append(Track(self.next_track_id, small, box))
+                self.next_track_id += 1
+        self.tracks = kept + new_tracks
+
+        # A stable scene needs fewer detections; any change brings the detector back quickly
+        if new_tracks or lost:
+            self.interval = VIDEO_DETECT_INTERVAL_MIN
+        else:
+            self.interval = min(self.interval * 2, VIDEO_DETECT_INTERVAL_MAX)
+
+        # Only tracks this detection confirmed are re-embedded; the others may have drifted off the face
+        retry = [track for track in confirmed if track.student is None and track.embed_attempts < TRACK_MAX_EMBED_ATTEMPTS]
+        return new_tracks + retry
+
+    def process_frame(self, frame, t):
+        """Track faces in one BGR frame taken at time t (seconds)."""
+        start = time.perf_counter()
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = t
+            self.stats['frames_processed'] += 1
+            small, scale = self._scaled(frame)
+
+            # Follow known faces; a tracker that loses its face waits for the next detection to confirm
+            survivors = []
+            for track in self.tracks:
+                if track.update(small):
+                    survivors.append(track)
+                else:
+                    self.frames_until_detect = 0
+            self.tracks = survivors
+
+            if self.frames_until_detect <= 0:
+                pending = self._detect(small)
+                if pending:
+                    self._embed(frame, pending, scale)
+                self.frames_until_detect = self.interval
+            self.frames_until_detect -= 1
+
+            # Credit the time since the previous frame to every recognized face in view
+            gap = min(t - self.last_time, MAX_CREDIT_GAP) if self.last_time is not None else 0.0
+            for track in self.tracks:
+                if track.student is not None:
+                    self.visible_seconds[track.student] = self.visible_seconds.get(track.student, 0.0) + gap
+            self.last_time = t
+            self.stats['processing_seconds'] += time.perf_counter() - start
+
+    def present(self):
+        """Students seen for at least the minimum presence time so far."""
+        with self._lock:
+            return {student for student, seconds in self.visible_seconds.items() if seconds >= self.min_presence}
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['tracks'] = len(self.tracks)
+            stats['detect_interval'] = self.interval
+            stats['elapsed_seconds'] = (self.last_time - self.started_at) if self.started_at is not None else 0.0
+            processed = stats['frames_processed']
+            stats['processing_fps'] = processed / stats['processing_seconds'] if stats['processing_seconds'] else 0.0
+            stats['visible_seconds'] = {f"{name} ({usn})": round(seconds, 1)
+                                        for (name, usn), seconds in self.visible_seconds.items()}
+            return stats
+
+
+def is_live_source(source):
+    return isinstance(source, int) or str(source).startswith(('rtsp://', 'http://', 'https://'))
+
+
+def run_capture(session, source, stop_event=None, drop_frames=True):
+    """Feed frames from a camera index, stream URL or video file into a session.
+
+    Frames that arrive while the previous one is still being processed are
+    grabbed and discarded (never decoded), so a slow machine falls back to a
+    lower sampling rate instead of falling behind the camera. Returns the
+    session summary.
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video source {source!r}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    live = is_live_source(source)
+    clock_start = time.monotonic()
+    skip = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if not capture.grab():
+                break
+            session.stats['frames_read'] += 1
+            if skip > 0:
+                skip -= 1
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            # Live streams run on the wall clock, files on their own timestamps
+            t = time.monotonic() - clock_start if live else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if session.finished(t):
+                break
+            start = time.perf_counter()
+            session.process_frame(frame, t)
+            if drop_frames:
+                skip = int((time.perf_counter() - start) * fps)
+    finally:
+        capture.release()
+    return session.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Take attendance from a camera or a video file.')
+    parser.add_argument('source', help='Video file, stream URL, or camera index')
+    parser.add_argument('--semester', required=True)
+    parser.add_argument('--section', required=True)
+    parser.add_argument('--campus', action='store_true', help='Match against every enrolled student')
+    parser.add_argument('--window', type=float, default=VIDEO_SESSION_SECONDS, help='Session window in seconds')
+    parser.add_argument('--min-presence', type=float, default=VIDEO_MIN_PRESENCE_SECONDS)
+    parser.add_argument('--every-frame', action='store_true', help='Process every frame instead of keeping real time')
+    parser.add_argument('--student-data', default='student_data/')
+    args = parser.parse_args()
+
+    from gallery import FaceGallery
+    from student_store import StudentStore
+    gallery = FaceGallery(StudentStore(args.student_data).all())
+    if args.campus:
+        match = gallery.match_all
+    else:
+        match = lambda encodings: gallery.match(encodings, args.semester, args.section)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    session = VideoSession(match, args.window, args.min_presence)
+    wall_start = time.perf_counter()
+    summary = run_capture(session, source, drop_frames=not args.every_frame)
+    wall = time.perf_counter() - wall_start
+
+    present = session.present()
+    print(f"Processed {summary['frames_processed']}/{summary['frames_read']} frames of "
+          f"{summary['elapsed_seconds']:.1f}s video in {wall:.1f}s ({summary['processing_fps']:.1f} fps), "
+          f"{summary['detections']} detections, {summary['descriptors']} descriptors")
+    print("Present Students:")
+    for name, usn in sorted(present, key=lambda s: s[1]):
+        print(f"{name} ({usn})")
+    print("\nAbsent Students:")
+    for name, usn in gallery.roster(args.semester, args.section):
+        if (name, usn) not in present:
+            print(f"{name} ({usn})")
+
+
+if __name__ == '__main__':
+    main()
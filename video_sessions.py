@@ -0,0 +1,130 @@
+import os
+import json
+import math
+import time
+import uuid
+import sqlite3
+import threading
+
+# Video sources other than camera indices that sessions may open (comma-separated stream URLs or file paths)
+VIDEO_SOURCES = [source.strip() for source in os.environ.get('VIDEO_SOURCES', '').split(',') if source.strip()]
+
+# Bounds on the session window a client may ask for
+VIDEO_WINDOW_MIN_SECONDS = 30
+VIDEO_WINDOW_MAX_SECONDS = float(os.environ.get('VIDEO_WINDOW_MAX_SECONDS', 4 * 3600))
+
+# How often the capturing process publishes progress and looks for a stop request
+VIDEO_SYNC_INTERVAL = 1.0
+
+# A running session whose process has not reported for this long is marked as failed
+VIDEO_HEARTBEAT_TIMEOUT = 30
+
+# Seconds a finished session's result stays available
+VIDEO_RESULT_TTL = float(os.environ.get('VIDEO_RESULT_TTL', 24 * 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_sessions (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    params TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    stop_requested INTEGER NOT NULL DEFAULT 0,
+    present TEXT NOT NULL DEFAULT '[]',
+    stats TEXT NOT NULL DEFAULT '{}',
+    heartbeat REAL NOT NULL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+"""
+
+
+def parse_source(value, allowed=None):
+    """Camera index or allow-listed source from a form field; raises ValueError for anything else."""
+    value = (value or '0').strip()
+    if value.isdigit():
+        return int(value)
+    if value not in (VIDEO_SOURCES if allowed is None else allowed):
+        raise ValueError(f"Video source {value!r} is not a camera index or a configured source")
+    return value
+
+
+def parse_window(value, default):
+    """Session window in seconds from a form field, clamped to the allowed range; raises ValueError if not a number."""
+    if value is None or not str(value).strip():
+        window = default
+    else:
+        window = float(value)
+        if not math.isfinite(window):
+            raise ValueError(f"Window must be a number of seconds, got {value!r}")
+    return min(max(window, VIDEO_WINDOW_MIN_SECONDS), VIDEO_WINDOW_MAX_SECONDS)
+
+
+class VideoSessionStore:
+    """Video attendance sessions, shared by every server process.
+
+    The capture runs in the process that started it, which reports the
+    students present so far and its statistics every VIDEO_SYNC_INTERVAL and
+    stops once any process asks it to. Status and stop requests can therefore
+    reach any worker. When the capture ends, the owner records the session
+    and stores its result (or error) here until VIDEO_RESULT_TTL has passed.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.reopen()
+        self._conn.executescript(SCHEMA)
+
+    def reopen(self):
+        """Fresh connection and lock for a forked child."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+    def create(self, params):
+        """Register a session captured by this process and return its ID."""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM video_sessions WHERE state != 'running' AND finished < ?",
+                               (now - VIDEO_RESULT_TTL,))
+            self._conn.execute('INSERT INTO video_sessions (id, state, params, owner, heartbeat) VALUES (?, ?, ?, ?, ?)',
+                               (session_id, 'running', json.dumps(params), os.getpid(), now))
+        return session_id
+
+    def report(self, session_id, present, stats):
+        """Publish a running session's progress. Returns whether it was asked to stop."""
+        with self._lock:
+            self._conn.execute("UPDATE video_sessions SET present = ?, stats = ?, heartbeat = ? "
+                               "WHERE id = ? AND state = 'running'",
+                               (json.dumps(present), json.dumps(stats), time.time(), session_id))
+            row = self._conn.execute('SELECT stop_requested FROM video_sessions WHERE id = ?', (session_id,)).fetchone()
+        return row is None or bool(row['stop_requested'])
+
+    def finish(self, session_id, result=None, error=None):
+        with self._lock:
+            self._conn.execute("UPDATE video_sessions SET state = ?, finished = ?, result = ?, error = ? "
+                               "WHERE id = ? AND state = 'running'",
+                               ('error' if error else 'done', time.time(),
+                                json.dumps(result) if result is not None else None, error, session_id))
+
+    def request_stop(self, session_id):
+        """Ask the owning process to end a session. Returns False for an unknown session."""
+        with self._lock:
+            cursor = self._conn.execute('UPDATE video_sessions SET stop_requested = 1 WHERE id = ?', (session_id,))
+        return cursor.rowcount > 0
+
+    def get(self, session_id):
+        """State, progress and (once done) result of a session, or None for an unknown (or expired) one."""
+        with self._lock:
+            self._conn.execute("UPDATE video_sessions SET state = 'error', finished = ?, "
+                               "error = 'The capture stopped unexpectedly' "
+                               "WHERE id = ? AND state = 'running' AND heartbeat < ?",
+                               (time.time(), session_id, time.time() - VIDEO_HEARTBEAT_TIMEOUT))
+            row = self._conn.execute('SELECT * FROM video_sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        return {'session_id': row['id'], 'state': row['state'], 'params': json.loads(row['params']),
+                'present': json.loads(row['present']), 'stats': json.loads(row['stats']), 'error': row['error'],
+                'result': json.loads(row['result']) if row['result'] else None}
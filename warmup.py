@@ -0,0 +1,112 @@
+import os
+import time
+import resource
+import threading
+
+# Reference point for startup timings; set when this module is first imported
+PROCESS_STARTED = time.perf_counter()
+
+# Server processes on this machine: the gunicorn workers (gunicorn.conf.py sets it), 1 under the Flask
+# dev server or a CLI. Per-process pools (job threads, pipeline processes) are sized to their share of the CPUs.
+SERVER_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+
+def cpu_share():
+    """CPUs one server process may keep busy."""
+    return max(1, (os.cpu_count() or 1) // SERVER_WORKERS)
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def uptime():
+    return time.perf_counter() - PROCESS_STARTED
+
+
+class LazyResource:
+    """An expensive object (model, API client) built on first use.
+
+    Attribute access is forwarded to the loaded object, so a LazyResource can
+    stand in for the object itself, e.g. `sheets_service.spreadsheets()`.
+    Loading is thread-safe; a failed load is recorded and retried on the next use.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.seconds = None
+        self.error = None
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self._loaded = True
+                print(f"Loaded {self.name} in {self.seconds:.2f}s (RSS {rss_mb():.0f} MB)")
+        return self._value
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def status(self):
+        return {'loaded': self._loaded, 'seconds': self.seconds, 'error': self.error}
+
+
+def warm_up(resources, background=True):
+    """Load every resource now, or on a daemon thread when background is True.
+
+    Failures are only logged; the resource is retried on first real use.
+    """
+    def run():
+        for res in resources:
+            try:
+                res.get()
+            except Exception as e:
+                print(f"Warmup of {res.name} failed: {e}")
+        print(f"Warmup finished {uptime():.2f}s after start (RSS {rss_mb():.0f} MB)")
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness(resources, require_loaded=True):
+    """(ready, report) for a readiness probe; ready once every resource has loaded."""
+    report = {
+        'uptime_seconds': round(uptime(), 3),
+        'rss_mb': round(rss_mb(), 1),
+        'pid': os.getpid(),
+        'resources': {res.name: res.status() for res in resources},
+    }
+    ready = not require_loaded or all(res.loaded for res in resources)
+    report['ready'] = ready
+    return ready, report